@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+"""Measure the time spent saving checkpoints as a share of the crawl time
+against a local fixture site"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from crawler_collage import Crawler, CrawlerUserInput
+from fixture_site import FixtureSite
+
+
+def make_pages(page_count, fan_out=10, images=20):
+    """Return a site where every page links to the next few pages and holds
+    a number of images"""
+
+    pages = {}
+    for i in range(page_count):
+        links = ''.join('<a href="/page{}.html">Next</a>'.format(
+            (i + j) % page_count) for j in range(1, fan_out + 1))
+        imgs = ''.join('<img src="/img{}_{}.png" alt="Picture {} {}">'.format(
+            i, j, i, j) for j in range(images))
+        pages["/page{}.html".format(i)] = links + imgs
+    return pages
+
+
+def time_crawl(site, page_lim, checkpoint_path=None, checkpoint_interval=50):
+    """Return the time taken to crawl the site and the time of that spent
+    saving checkpoints"""
+
+    settings = CrawlerUserInput()
+    settings.user_url = site.url("/page0.html")
+    settings.user_page_lim = page_lim
+    crawler = Crawler(settings, checkpoint_path=checkpoint_path,
+                      checkpoint_interval=checkpoint_interval)
+
+    checkpoint_time = [0.0]
+    save_checkpoint = crawler.save_checkpoint
+
+    def timed_save_checkpoint():
+        start = time.perf_counter()
+        save_checkpoint()
+        checkpoint_time[0] += time.perf_counter() - start
+
+    crawler.save_checkpoint = timed_save_checkpoint
+
+    start = time.perf_counter()
+    crawler.visit_multiple_pages()
+    return time.perf_counter() - start, checkpoint_time[0]
+
+
+def main(page_count=2000, page_lim=1000, latency=0.005):
+    with FixtureSite(make_pages(page_count), latency=latency) as site, \
+            tempfile.TemporaryDirectory() as temp_dir:
+        checkpoint_path = os.path.join(temp_dir, 'crawl.json.gz')
+        plain_time = time_crawl(site, page_lim)[0]
+        print("Crawl without checkpoints: {:.2f} s".format(plain_time))
+        for interval in (10, 50, 200):
+            crawl_time, checkpoint_time = time_crawl(
+                site, page_lim, checkpoint_path, interval)
+            print("Checkpoint every {:>3} pages: {:.2f} s, {:.3f} s saving "
+                  "({:.1f}% of the crawl, {} KB file)".format(
+                      interval, crawl_time, checkpoint_time,
+                      100 * checkpoint_time / crawl_time,
+                      os.path.getsize(checkpoint_path) // 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+"""Measure the cost per image of adding images to the crawler as the number
+of images collected grows"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from crawler_collage import Crawler, CrawlerUserInput, ImageData
+
+
+class FakePage:
+    """Stand in for a visited page holding the given images and no links"""
+
+    def __init__(self, images):
+        self.images = images
+
+    def get_links(self):
+        return []
+
+    def get_images(self):
+        return self.images
+
+
+def make_images(count):
+    """Return count images where every tenth one repeats an earlier image"""
+
+    return [ImageData(image_url="http://site.example.com/{}.png".format(
+                          i - i % 10 if i % 10 == 9 else i),
+                      alt_text="Picture {}".format(i),
+                      unnamed_image_count=0)
+            for i in range(count)]
+
+
+def time_dump(count, page_size=100):
+    """Return the time taken per image to dump count images into a crawler,
+    page_size images at a time"""
+
+    settings = CrawlerUserInput()
+    settings.user_url = "http://site.example.com/"
+    crawler = Crawler(settings)
+    images = make_images(count)
+    pages = [FakePage(images[i:i + page_size]) for i in
+             range(0, count, page_size)]
+
+    start = time.perf_counter()
+    for page in pages:
+        crawler.dump_data(page)
+    return (time.perf_counter() - start) / count
+
+
+def main(counts=(100, 1000, 10000, 100000, 1000000)):
+    for count in counts:
+        print("{:>8} images: {:.2f} us/image".format(
+            count, time_dump(count) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+"""Measure the throughput and memory of the crawl frontier on a synthetic
+link graph"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from crawler_collage import Frontier
+
+
+def make_graph(nodes, fan_out, seed=0):
+    """Return the links found on each page of a random graph with
+    nodes * fan_out edges"""
+
+    rng = random.Random(seed)
+    urls = ["http://site{}.example.com/page/{}".format(i % 50, i)
+            for i in range(nodes)]
+    return urls, [[urls[rng.randrange(nodes)] for j in range(fan_out)]
+                  for i in range(nodes)]
+
+
+def main(nodes=100000, fan_out=10):
+    urls, graph = make_graph(nodes, fan_out)
+    index = {url: i for i, url in enumerate(urls)}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    frontier = Frontier([urls[0]])
+    visited = 0
+    edges = 0
+    while len(frontier):
+        url = frontier.pop()
+        links = graph[index[url]]
+        frontier.extend(links)
+        visited += 1
+        edges += len(links)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("Edges processed:", edges)
+    print("Pages visited:", visited)
+    print("Distinct links seen:", frontier.get_seen_count())
+    print("Time: {:.2f} s ({:.0f} edges/s)".format(elapsed, edges / elapsed))
+    print("Peak frontier memory: {:.1f} MB".format(peak / (1024 * 1024)))
+
+
+if __name__ == '__main__':
+    main()
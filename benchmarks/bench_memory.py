@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""Measure the peak memory of a crawl as the page limit grows, collecting
+every image before downloading against streaming them, against a local
+site where every page links to many new pages"""
+
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from PIL import Image
+from crawler_collage import Crawler, CrawlerUserInput, HostScheduler, \
+    HttpClient
+from fixture_site import FixtureSite
+
+
+def make_pages(page_count, fan_out=10, images=2):
+    """Return a site laid out as a tree, so that the first page_count pages
+    in the order they are found link to page_count * fan_out distinct
+    pages. Every image is a distinct picture, so that the checksums,
+    perceptual hashes and manifest entries of the downloader grow with the
+    page limit too"""
+
+    pages = {}
+    for i in range(page_count):
+        links = ''.join(
+            '<a href="/section/{}/page{}.html">Page</a>'.format(
+                child % 97, child)
+            for child in range(i * fan_out + 1, (i + 1) * fan_out + 1))
+        imgs = ''.join('<img src="/photos/{}_{}.png" alt="Photo {} {}">'
+                       .format(i, j, i, j) for j in range(images))
+        pages["/section/{}/page{}.html".format(i % 97, i)] = links + imgs
+        for j in range(images):
+            photo_file = io.BytesIO()
+            Image.effect_noise((40, 30), 60).save(photo_file, 'PNG')
+            pages["/photos/{}_{}.png".format(i, j)] = ("image/png",
+                                                       photo_file.getvalue())
+    return pages
+
+
+def get_peak_memory():
+    """Return the peak memory of this process in MB. On Linux, ru_maxrss
+    keeps the size of the process this one was started from, which holds
+    the whole site, so the high water mark of this process is read from
+    /proc where it can be"""
+
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def crawl(start_url, page_lim, streaming, results):
+    """Crawl in this process and report its peak memory in MB"""
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        client = HttpClient()
+        crawler = Crawler(CrawlerUserInput(start_url, page_lim),
+                          client=client,
+                          scheduler=HostScheduler(
+                              client, target_concurrency=float('inf')),
+                          streaming=streaming, max_memory_links=10000)
+        start = time.perf_counter()
+        crawler.run()
+        elapsed = time.perf_counter() - start
+    results.put((get_peak_memory(), elapsed))
+
+
+def main(page_counts=(1000, 4000, 16000)):
+    context = multiprocessing.get_context('spawn')
+    with FixtureSite(make_pages(max(page_counts)), keep_alive=True) as site:
+        start_url = site.url("/section/0/page0.html")
+        for page_lim in page_counts:
+            for streaming in (False, True):
+                # Each crawl runs in a fresh process so that its peak memory
+                # is its own
+                results = context.Queue()
+                process = context.Process(target=crawl, args=(
+                    start_url, page_lim, streaming, results))
+                process.start()
+                peak, elapsed = results.get()
+                process.join()
+                print("{:>6} pages, {:<9}: peak {:6.1f} MB, {:.1f} s".format(
+                    page_lim, "streaming" if streaming else "batch", peak,
+                    elapsed))
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or (1000, 4000, 16000))
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+"""Measure what timing a stage costs, against printing a line for each item
+as the crawler used to"""
+
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from collage_maker.metrics import Metrics
+
+
+def main(items=200000):
+    metrics = Metrics()
+    start = time.perf_counter()
+    for i in range(items):
+        with metrics.time_stage('download'):
+            pass
+    timed = (time.perf_counter() - start) / items
+
+    # Printing to a buffer leaves out the cost of the terminal itself
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for i in range(items):
+            print("Downloading image")
+            print("Filename:", "image.png")
+            print("Url:", "http://example.com/image.png", '\n')
+    printed = (time.perf_counter() - start) / items
+
+    print("Timing a stage: {:.2f} us/item".format(timed * 1e6))
+    print("Printing per item: {:.2f} us/item".format(printed * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""Measure the time taken to hash an image and to look up its near
+duplicates as the number of hashes indexed grows"""
+
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+from crawler_collage import PERCEPTUAL_HASHES, MultiIndexHash, \
+    find_hash_distance
+
+
+class BKTree:
+    """Index hashes by their distance from one another so that the hashes
+    near a given one are found without comparing it to every hash.
+
+    Each node keeps its children by their distance from it. By the triangle
+    inequality, only children whose distance is within max_distance of the
+    query's distance to the node can hold a match.
+    """
+
+    def __init__(self, distance=find_hash_distance):
+        self.distance = distance
+        # Each node is a [hash, item, children] list
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item=None):
+        """Add a hash, and an item to return with it, to the tree"""
+
+        self.size += 1
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+        node = self.root
+        while True:
+            distance = self.distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def find(self, value, max_distance):
+        """Return the (distance, hash, item) of every hash within
+        max_distance of the value, nearest first"""
+
+        matches = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_value, item, children = nodes.pop()
+            distance = self.distance(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, node_value, item))
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def find_nearest(self, value, max_distance):
+        """Return the (distance, hash, item) of the hash nearest the value,
+        or None if none are within max_distance"""
+
+        matches = self.find(value, max_distance)
+        return matches[0] if matches else None
+
+
+def time_hashes(size=(1600, 1200), repeats=20):
+    """Print the time taken by each perceptual hash on a JPEG of the given
+    size"""
+
+    image_file = io.BytesIO()
+    Image.effect_mandelbrot(size, (-2, -0.6, 1, 1.2), 50).convert(
+        'RGB').save(image_file, 'JPEG')
+    for name, find_hash in PERCEPTUAL_HASHES.items():
+        start = time.perf_counter()
+        for i in range(repeats):
+            image_file.seek(0)
+            find_hash(image_file)
+        print("{} of a {}x{} JPEG: {:.2f} ms".format(
+            name, size[0], size[1],
+            (time.perf_counter() - start) / repeats * 1000))
+
+
+def time_index(index, query_hashes, max_distance):
+    """Return the time per lookup in the index"""
+
+    start = time.perf_counter()
+    for query in query_hashes:
+        index.find(query, max_distance)
+    return (time.perf_counter() - start) / len(query_hashes)
+
+
+def time_lookups(count, max_distance=4, queries=200):
+    """Return the time per lookup in a BK-tree, a multi-index hash and a
+    linear scan of count random hashes"""
+
+    generator = random.Random(count)
+    hashes = [generator.getrandbits(64) for i in range(count)]
+    tree = BKTree()
+    multi_index = MultiIndexHash(max_distance)
+    for value in hashes:
+        tree.add(value)
+        multi_index.add(value)
+    # Half of the queries are near an indexed hash
+    query_hashes = [hashes[i] ^ (1 << i % 64) if i % 2 else
+                    generator.getrandbits(64) for i in range(queries)]
+
+    tree_time = time_index(tree, query_hashes, max_distance)
+    multi_index_time = time_index(multi_index, query_hashes, max_distance)
+
+    start = time.perf_counter()
+    for query in query_hashes:
+        [value for value in hashes if
+         find_hash_distance(query, value) <= max_distance]
+    scan_time = (time.perf_counter() - start) / queries
+    return tree_time, multi_index_time, scan_time
+
+
+def main(counts=(1000, 10000, 100000)):
+    time_hashes()
+    for count in counts:
+        tree_time, multi_index_time, scan_time = time_lookups(count)
+        print("{:>7} hashes, ms/lookup: BK-tree {:.3f}, multi-index {:.3f}, "
+              "linear scan {:.3f}".format(count, tree_time * 1000,
+                                          multi_index_time * 1000,
+                                          scan_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+"""Measure the requests made and the parse time spent per visited page
+against a local fixture site"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from bs4 import BeautifulSoup
+from crawler_collage import Page
+from fixture_site import FixtureSite
+
+
+def make_html(links, images):
+    """Return a page body with the given number of links and images"""
+
+    parts = ['<html><body>']
+    for i in range(links):
+        parts.append('<p><a href="/page{}.html">Link {}</a></p>'.format(i, i))
+    for i in range(images):
+        parts.append('<img src="/img{}.png" alt="Image {}">'.format(i, i))
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def main(pages=50, links=200, images=50):
+    html = make_html(links, images)
+    site_pages = {"/page{}.html".format(i): html for i in range(pages)}
+
+    with FixtureSite(site_pages) as site:
+        start = time.perf_counter()
+        for i in range(pages):
+            page = Page(site.url("/page{}.html".format(i)))
+            page.collect_images(total_unnamed_image_count=0)
+        elapsed = time.perf_counter() - start
+        requests = site.get_request_count()
+
+    # The old pipeline parsed every page a second time for its images
+    start = time.perf_counter()
+    for i in range(pages):
+        BeautifulSoup(html, "html.parser").find_all('a')
+        BeautifulSoup(html, "html.parser").find_all('img')
+    double_parse = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(pages):
+        BeautifulSoup(html, "html.parser").find_all(['a', 'img'])
+    single_parse = time.perf_counter() - start
+
+    print("Pages visited:", pages)
+    print("Requests per page: {:.2f}".format(requests / pages))
+    print("Visit time per page: {:.2f} ms".format(elapsed / pages * 1000))
+    print("Parse time per page, two passes: {:.2f} ms".format(
+        double_parse / pages * 1000))
+    print("Parse time per page, one pass: {:.2f} ms".format(
+        single_parse / pages * 1000))
+
+
+if __name__ == '__main__':
+    main()
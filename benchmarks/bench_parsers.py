@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""Compare the time each parser backend takes to pull the links and images
+out of a corpus of html pages.
+
+Saved pages can be given as a folder of .html files on the command line.
+Otherwise a corpus of generated pages, the largest several MB like a long
+Wikipedia article, is used.
+"""
+
+import io
+import os
+import sys
+import time
+from email.message import Message
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from crawler_collage import PARSERS
+
+
+class SavedResponse:
+    """Stand in for a response whose body is held in memory"""
+
+    def __init__(self, body):
+        self.body = io.BytesIO(body)
+        self.headers = Message()
+        self.headers["Content-Type"] = "text/html; charset=utf-8"
+
+    def read(self, size=-1):
+        return self.body.read(size)
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+
+def make_page(sections):
+    """Return a page with the given number of article-like sections"""
+
+    parts = ['<html><head><title>Article</title></head><body>']
+    for i in range(sections):
+        parts.append('<h2 id="s{0}">Section {0}</h2><div class="text">'
+                     .format(i))
+        for j in range(5):
+            parts.append('<p>Some <b>bold</b> and <i>italic</i> text with a '
+                         '<a href="/wiki/Topic_{0}_{1}" title="Topic">link'
+                         '</a> and a reference<sup><a href="#cite{0}_{1}">'
+                         '[{1}]</a></sup>.</p>'.format(i, j))
+        parts.append('<table><tr><td><img src="//upload.example.org/{0}.png" '
+                     'alt="Figure {0}" width="200"></td><td>Caption &amp; '
+                     'notes</td></tr></table></div>'.format(i))
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+def load_corpus(folder=None):
+    """Return the name and body of each page in the corpus"""
+
+    if folder is None:
+        return [("generated-{}".format(sections), make_page(sections))
+                for sections in (20, 200, 2000)]
+
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(folder, name), 'rb') as page_file:
+                corpus.append((name, page_file.read()))
+    return corpus
+
+
+def time_parser(parser, body, repeats):
+    """Return the least time the parser took to read the body"""
+
+    best = None
+    for i in range(repeats):
+        response = SavedResponse(body)
+        start = time.perf_counter()
+        PARSERS[parser](response)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(folder=None, repeats=3):
+    corpus = load_corpus(folder)
+    parsers = sorted(PARSERS)
+    print("{:<24}{:>10}".format("page", "size") +
+          ''.join("{:>14}".format(parser) for parser in parsers))
+    totals = dict.fromkeys(parsers, 0.0)
+    for name, body in corpus:
+        row = "{:<24}{:>8}KB".format(name[:23], len(body) // 1024)
+        for parser in parsers:
+            elapsed = time_parser(parser, body, repeats)
+            totals[parser] += elapsed
+            row += "{:>12.1f}ms".format(elapsed * 1000)
+        print(row)
+    print("{:<34}".format("total") +
+          ''.join("{:>12.1f}ms".format(totals[parser] * 1000)
+                  for parser in parsers))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""Measure the memory held by the image records of a crawl, with fields in
+slots against the instance dictionaries they were kept in before"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from crawler_collage import ImageData
+
+
+class DictImageData:
+    """Stand in for an image record that keeps its fields in a dictionary of
+    its own, as every ImageData did before it had slots"""
+
+    __init__ = ImageData.__init__
+    make_name = ImageData.make_name
+    get_alt_text = ImageData.get_alt_text
+    is_unnamed = ImageData.is_unnamed
+
+
+def make_fields(count):
+    """Return the url and alt text of count images. The strings are made
+    before measuring, so what is measured is the records, their list and the
+    file names they make"""
+
+    return [("http://site.example.com/photos/{}.png".format(i),
+             "Picture {}".format(i)) for i in range(count)]
+
+
+def measure(record_type, fields):
+    """Return the bytes held by a list of records with the given fields and
+    the seconds taken to make it"""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = [record_type(image_url=url, alt_text=alt,
+                           unnamed_image_count=0) for url, alt in fields]
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    # The records are only freed once the memory they hold has been read
+    del records
+    tracemalloc.stop()
+    return held, elapsed
+
+
+def main(count=1000000):
+    fields = make_fields(count)
+    results = {}
+    for label, record_type in (("dict", DictImageData), ("slots", ImageData)):
+        held, elapsed = measure(record_type, fields)
+        results[label] = held
+        print("{:>8} {:<5} records: {:7.1f} MB, {:5.1f} bytes/record, "
+              "{:.2f} s".format(count, label, held / 2 ** 20, held / count,
+                                elapsed))
+    print("Slots save {:.1f} MB, {:.1f} bytes/record".format(
+        (results["dict"] - results["slots"]) / 2 ** 20,
+        (results["dict"] - results["slots"]) / count))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+"""Measure how the collage render scales with the number of worker
+processes, and check that every worker count gives the same collage"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+from collage_maker.collage_maker import make_collage
+
+
+def make_photos(folder, count=400, size=(1200, 900)):
+    """Save `count` JPEGs of varied shapes and return their paths"""
+
+    base = Image.effect_noise(size, 60).convert('RGB')
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, "photo{}.jpg".format(i))
+        width = size[0] - (i * 37) % (size[0] // 2)
+        height = size[1] - (i * 53) % (size[1] // 2)
+        base.crop((0, 0, width, height)).save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+def main(worker_counts=None, count=400):
+    if worker_counts is None:
+        cpus = os.cpu_count() or 1
+        worker_counts = sorted({1, 2, 4, 8, 16, 32, cpus} &
+                               set(range(1, cpus + 1)))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = make_photos(temp_dir, count)
+        reference = None
+        serial_time = None
+        for workers in worker_counts:
+            output = os.path.join(temp_dir, "collage.png")
+            start = time.perf_counter()
+            make_collage(paths, output, 2000, 120, workers=workers)
+            elapsed = time.perf_counter() - start
+            with Image.open(output) as collage:
+                pixels = collage.tobytes()
+            if reference is None:
+                reference, serial_time = pixels, elapsed
+            print("{:>2} workers: {:.2f} s, {:.1f}x, {}".format(
+                workers, elapsed, serial_time / elapsed,
+                "identical" if pixels == reference else "DIFFERENT"))
+
+
+if __name__ == '__main__':
+    main()
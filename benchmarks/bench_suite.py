@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""Time the crawl, download and collage stages end to end against a
+generated site served from a local server, and save the results so that
+runs of different versions can be compared.
+
+    python3 benchmarks/bench_suite.py --pages 100 --save before.json
+    python3 benchmarks/bench_suite.py --pages 100 --compare before.json
+
+A comparison exits with status 1 if any phase got slower by more than the
+threshold, so the suite can gate a change.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from collage_maker.collage_maker import make_collage, get_images, Settings
+from collage_maker.metrics import Metrics
+from crawler_collage import Crawler, CrawlerUserInput, HttpClient, \
+    HostScheduler
+from fixture_site import FixtureSite
+from fixture_web import SiteSpec, make_site
+
+# Version of the results file layout
+RESULTS_FORMAT = 1
+
+PHASES = ("crawl", "download", "collage")
+
+
+def find_git_commit():
+    """Return the commit the benchmarked code is at, or None outside git"""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_once(site, spec, settings):
+    """Crawl the site, download its images and make a collage of them in a
+    fresh folder. Return the seconds and items of each phase, and the
+    metrics of the run"""
+
+    metrics = Metrics()
+    client = HttpClient(metrics=metrics)
+    scheduler = HostScheduler(client)
+    if settings["impolite"]:
+        # Send requests as fast as the connection limits allow
+        scheduler = HostScheduler(client, target_concurrency=float('inf'))
+    crawler = Crawler(CrawlerUserInput(site.url("/page0.html"),
+                                       spec.page_count),
+                      client=client, scheduler=scheduler,
+                      download_workers=settings["download_workers"],
+                      metrics=metrics)
+    phases = {}
+
+    start = time.perf_counter()
+    crawler.visit_multiple_pages()
+    phases["crawl"] = (time.perf_counter() - start, crawler.pages_visited)
+
+    start = time.perf_counter()
+    crawler.download_all_images()
+    images = get_images(Settings(folder='./images'))
+    phases["download"] = (time.perf_counter() - start, len(images))
+
+    start = time.perf_counter()
+    make_collage(images, "collage.png", settings["width"],
+                 settings["init_height"], workers=settings["render_workers"],
+                 metrics=metrics)
+    phases["collage"] = (time.perf_counter() - start, len(images))
+
+    return phases, metrics
+
+
+def run_suite(spec, settings, repeats):
+    """Run the benchmark `repeats` times and return its results"""
+
+    site_pages = make_site(spec)
+    runs = []
+    old_dir = os.getcwd()
+    with FixtureSite(site_pages, latency=spec.latency,
+                     keep_alive=True) as site:
+        for repeat in range(repeats):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                os.chdir(temp_dir)
+                try:
+                    runs.append(run_once(site, spec, settings))
+                finally:
+                    os.chdir(old_dir)
+
+    results = {"format": RESULTS_FORMAT,
+               "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "environment": {"commit": find_git_commit(),
+                               "python": platform.python_version(),
+                               "platform": platform.platform(),
+                               "cpus": os.cpu_count()},
+               "site": spec.to_dict(), "settings": settings,
+               "repeats": repeats, "phases": {}, "stages": {}}
+
+    for phase in PHASES:
+        seconds = [phases[phase][0] for phases, metrics in runs]
+        items = runs[-1][0][phase][1]
+        median = statistics.median(seconds)
+        results["phases"][phase] = {
+            "seconds": median, "runs": seconds, "items": items,
+            "items_per_second": items / median if median else 0.0}
+    total = [sum(phases[phase][0] for phase in PHASES)
+             for phases, metrics in runs]
+    results["phases"]["total"] = {"seconds": statistics.median(total),
+                                  "runs": total}
+
+    stage_means = {}
+    for phases, metrics in runs:
+        for stage, histogram in metrics.to_dict()["stages"].items():
+            stage_means.setdefault(stage, []).append(histogram["mean"])
+    last_stages = runs[-1][1].to_dict()["stages"]
+    for stage, means in sorted(stage_means.items()):
+        results["stages"][stage] = {
+            "mean_ms": statistics.median(means) * 1000,
+            "count": last_stages[stage]["count"]}
+    results["counters"] = runs[-1][1].to_dict()["counters"]
+    return results
+
+
+def print_results(results):
+    for phase in PHASES:
+        phase_results = results["phases"][phase]
+        print("{:<9} {:>8.3f} s  {:>5} items  {:>9.1f} items/s".format(
+            phase, phase_results["seconds"], phase_results["items"],
+            phase_results["items_per_second"]))
+    print("{:<9} {:>8.3f} s".format("total",
+                                    results["phases"]["total"]["seconds"]))
+    for stage, stage_results in results["stages"].items():
+        print("  {:<9} {:>8.3f} ms mean over {} runs".format(
+            stage, stage_results["mean_ms"], stage_results["count"]))
+
+
+def compare_results(results, baseline, threshold):
+    """Print how each phase and stage changed from the baseline. Return True
+    if a phase got slower by more than the threshold"""
+
+    if results["site"] != baseline["site"] or \
+            results["settings"] != baseline["settings"]:
+        print("Warning: the baseline was run with other settings, so the "
+              "times may not be comparable")
+    print("Compared with {} ({}):".format(
+        baseline["environment"]["commit"] or "baseline",
+        baseline["created"]))
+
+    regressed = False
+    rows = [(phase, results["phases"][phase]["seconds"],
+             baseline["phases"][phase]["seconds"], True)
+            for phase in PHASES + ("total",)]
+    rows += [("  " + stage, stage_results["mean_ms"],
+              baseline["stages"][stage]["mean_ms"], False)
+             for stage, stage_results in results["stages"].items()
+             if stage in baseline["stages"]]
+    for name, new, old, gates in rows:
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "SLOWER"
+            regressed = regressed or gates
+        elif change < -threshold:
+            flag = "faster"
+        print("{:<11} {:>9.3f} -> {:>9.3f}  {:>+7.1%}  {}".format(
+            name, old, new, change, flag))
+    return regressed
+
+
+def main(args=None):
+    options = OptionParser(usage='%prog [options]',
+                           description='Benchmark the crawl, download and '
+                                       'collage stages offline.')
+    options.add_option('--pages', type='int', default=50,
+                       help='pages in the generated site')
+    options.add_option('--fan-out', dest='fan_out', type='int', default=5,
+                       help='links on each page')
+    options.add_option('--images', type='int', default=4,
+                       help='images on each page')
+    options.add_option('--image-size', dest='image_size', default='640x480',
+                       help='largest size of the images, as WIDTHxHEIGHT')
+    options.add_option('--latency', type='float', default=0.0,
+                       help='seconds the server waits before each response')
+    options.add_option('--seed', type='int', default=0,
+                       help='seed the site is generated from')
+    options.add_option('--repeats', type='int', default=3,
+                       help='runs to take the median of')
+    options.add_option('--download-workers', dest='download_workers',
+                       type='int', default=8)
+    options.add_option('--render-workers', dest='render_workers',
+                       type='int', default=1)
+    options.add_option('--impolite', action='store_true', default=False,
+                       help='do not space out requests to the server')
+    options.add_option('--save', help='save the results to this JSON file')
+    options.add_option('--compare',
+                       help='compare the results with a saved JSON file')
+    options.add_option('--threshold', type='float', default=0.1,
+                       help='share a phase may slow down by before the '
+                            'comparison fails')
+    opts, extra = options.parse_args(args)
+
+    image_size = tuple(int(side) for side in opts.image_size.split('x'))
+    spec = SiteSpec(page_count=opts.pages, fan_out=opts.fan_out,
+                    images_per_page=opts.images, image_size=image_size,
+                    latency=opts.latency, seed=opts.seed)
+    settings = {"download_workers": opts.download_workers,
+                "render_workers": opts.render_workers, "width": 1000,
+                "init_height": 100, "impolite": opts.impolite}
+
+    results = run_suite(spec, settings, opts.repeats)
+    print_results(results)
+    if opts.save:
+        with open(opts.save, 'w') as results_file:
+            json.dump(results, results_file, indent=1, sort_keys=True)
+    if opts.compare:
+        with open(opts.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare_results(results, baseline, opts.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
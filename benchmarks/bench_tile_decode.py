@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""Compare decoding large JPEGs at full resolution before resizing them to
+collage tiles against the reduced decodes used by render_tile.
+
+A folder of JPEGs can be given on the command line. Otherwise a folder of
+generated 4000x3000 photos is used.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+from collage_maker.collage_maker import find_image_size, render_tile
+
+
+def make_photos(folder, count=12, size=(4000, 3000)):
+    """Save `count` noisy photo-like JPEGs of `size` and return their
+    paths"""
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, "photo{}.jpg".format(i))
+        noise = Image.effect_noise(size, 40 + i).filter(
+            ImageFilter.GaussianBlur(3))
+        Image.merge('RGB', (noise, noise.rotate(90, expand=False),
+                            noise.transpose(Image.FLIP_LEFT_RIGHT))).save(
+            path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def render_full(img_path, tile_size):
+    """Return the image decoded at full resolution and then resized"""
+
+    with Image.open(img_path) as img:
+        img.load()
+        return img.resize(tile_size, Image.LANCZOS), img.size
+
+
+def render_reduced(img_path, tile_size):
+    """Return the tile from render_tile and the size it was decoded at"""
+
+    with Image.open(img_path) as img:
+        img.draft('RGB', tile_size)
+        decoded_size = img.size
+    return render_tile(img_path, tile_size), decoded_size
+
+
+def time_render(render, paths, tile_height):
+    """Return the tiles rendered, the time taken and the most pixels held by
+    any one decoded image"""
+
+    tiles = []
+    peak_pixels = 0
+    start = time.perf_counter()
+    for path in paths:
+        width, height = find_image_size(path)
+        tile_size = (max(1, width * tile_height // height), tile_height)
+        tile, decoded_size = render(path, tile_size)
+        tiles.append(tile)
+        peak_pixels = max(peak_pixels, decoded_size[0] * decoded_size[1])
+    return tiles, time.perf_counter() - start, peak_pixels
+
+
+def main(folder=None, tile_heights=(25, 100, 400)):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if folder is None:
+            paths = make_photos(temp_dir)
+        else:
+            paths = [os.path.join(folder, name) for name in
+                     sorted(os.listdir(folder))
+                     if name.lower().endswith(('.jpg', '.jpeg'))]
+
+        print("{} JPEGs".format(len(paths)))
+        for tile_height in tile_heights:
+            full_tiles, full_time, full_pixels = time_render(
+                render_full, paths, tile_height)
+            tiles, reduced_time, reduced_pixels = time_render(
+                render_reduced, paths, tile_height)
+            difference = max(max(ImageStat.Stat(ImageChops.difference(
+                full, tile)).mean) for full, tile in zip(full_tiles, tiles))
+            print("tiles {:>3}px high: full {:.2f} s, reduced {:.2f} s "
+                  "({:.1f}x), peak decoded {:.1f} -> {:.1f} MB, mean pixel "
+                  "difference {:.2f}/255".format(
+                      tile_height, full_time, reduced_time,
+                      full_time / reduced_time, full_pixels * 3 / 1e6,
+                      reduced_pixels * 3 / 1e6, difference))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
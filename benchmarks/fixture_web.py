@@ -0,0 +1,71 @@
+"""Generate a site graph of linked pages and photos for the benchmarks to
+crawl offline. The same parameters and seed always give the same site"""
+
+import io
+import random
+
+from PIL import Image
+
+
+class SiteSpec:
+    """Hold the shape of a generated site"""
+
+    def __init__(self, page_count=50, fan_out=5, images_per_page=4,
+                 image_size=(640, 480), latency=0.0, seed=0):
+        self.page_count = page_count
+        # Links on each page to other pages, most to nearby pages so that
+        # the crawl has to go deep as well as wide
+        self.fan_out = fan_out
+        self.images_per_page = images_per_page
+        # Images are made up to a quarter narrower or shorter than this
+        self.image_size = image_size
+        # Seconds the server waits before answering each request
+        self.latency = latency
+        self.seed = seed
+
+    def to_dict(self):
+        return {"page_count": self.page_count, "fan_out": self.fan_out,
+                "images_per_page": self.images_per_page,
+                "image_size": list(self.image_size),
+                "latency": self.latency, "seed": self.seed}
+
+
+def make_photo(generator, size):
+    """Return the JPEG bytes of a smooth, distinct picture of the given size.
+    A few random pixels are scaled up, so that no two pictures look alike to
+    the near-duplicate check"""
+
+    small = Image.frombytes('RGB', (8, 6), generator.randbytes(8 * 6 * 3))
+    photo = io.BytesIO()
+    small.resize(size, Image.BICUBIC).save(photo, 'JPEG', quality=85)
+    return photo.getvalue()
+
+
+def make_site(spec):
+    """Return the pages of a site with the given SiteSpec, in the form
+    FixtureSite serves"""
+
+    generator = random.Random(spec.seed)
+    width, height = spec.image_size
+    pages = {}
+    for i in range(spec.page_count):
+        targets = []
+        for j in range(spec.fan_out):
+            if j % 2:
+                # Every other link jumps anywhere in the site
+                targets.append(generator.randrange(spec.page_count))
+            else:
+                targets.append((i + j // 2 + 1) % spec.page_count)
+        parts = ['<html><body><h1>Page {}</h1>'.format(i)]
+        parts.extend('<p><a href="/page{}.html">Page {}</a></p>'.format(
+            target, target) for target in targets)
+        for j in range(spec.images_per_page):
+            path = "/images/photo{}_{}.jpg".format(i, j)
+            size = (width - generator.randrange(width // 4 + 1),
+                    height - generator.randrange(height // 4 + 1))
+            pages[path] = ("image/jpeg", make_photo(generator, size))
+            parts.append('<img src="{}" alt="Photo {} {}">'.format(path, i,
+                                                                   j))
+        parts.append('</body></html>')
+        pages["/page{}.html".format(i)] = ''.join(parts)
+    return pages
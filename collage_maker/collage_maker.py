@@ -7,48 +7,241 @@
 # slightly edited by Ryan Knightly
 # -----------------------------------------------------------------------
 
+import json
+import logging
+import math
 import os
+import queue
 import random
+import struct
+import threading
+import time
+import zlib
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from optparse import OptionParser
 
+from collage_maker.metrics import Metrics, shared_metrics
+
 WHITE = (248, 248, 255)
 
+# How many times larger than the tile an image may still be after it is
+# reduced by a whole factor and before the final resample. At 3 the result
+# cannot be told apart from resampling the full image
+REDUCING_GAP = 3.0
+
+# Modes that paste onto the RGB collage without being converted first
+PASTE_MODES = ('RGB', 'LA', 'RGBA', 'RGBa')
+
+# JPEG start of frame markers, which hold the size of the image
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA,
+                    0xCB, 0xCD, 0xCE, 0xCF}
 
-def make_collage(images, filename, width, init_height):
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_size(size, box):
     """
-    Make a collage image with a width equal to `width` from `images` and save
-    to `filename`.
+    Return the size an image of `size` is given by `Image.thumbnail(box)`,
+    which shrinks it to fit inside `box` while keeping its aspect ratio.
     """
-    if not images:
-        print('No images for collage found!')
-        return False
+    img_width, img_height = size
+    box_width, box_height = math.floor(box[0]), math.floor(box[1])
+    if box_width >= img_width and box_height >= img_height:
+        return size
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = img_width / img_height
+    if box_width / box_height >= aspect:
+        box_width = round_aspect(box_height * aspect,
+                                 key=lambda n: abs(aspect - n / box_height))
+    else:
+        box_height = round_aspect(
+            box_width / aspect,
+            key=lambda n: 0 if n == 0 else abs(aspect - box_width / n))
+    return box_width, box_height
+
+
+def probe_jpeg_size(img_file):
+    """
+    Return the size of the JPEG in `img_file`, read from its start of frame
+    segment, or None if it cannot be found. The file must be positioned just
+    after the start of image marker.
+    """
+    while True:
+        byte = img_file.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = img_file.read(1)
+        # skip fill bytes
+        while marker == b'\xff':
+            marker = img_file.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        # markers without a segment
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue
+        header = img_file.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack('>H', header)[0]
+        if marker in JPEG_SOF_MARKERS:
+            frame = img_file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        img_file.seek(length - 2, os.SEEK_CUR)
+
+
+def probe_image_size(img_path):
+    """
+    Return the size of a PNG, JPEG, GIF or WebP image read from its header
+    without decoding any pixels, or None if the format is not recognised.
+    """
+    with open(img_path, 'rb') as img_file:
+        head = img_file.read(32)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8 ' and len(head) >= 30:
+                width, height = struct.unpack('<HH', head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b'VP8L' and len(head) >= 25:
+                b0, b1, b2, b3 = head[21:25]
+                return (1 + (((b1 & 0x3F) << 8) | b0),
+                        1 + (((b3 & 0xF) << 10) | (b2 << 2) |
+                             ((b1 & 0xC0) >> 6)))
+            if chunk == b'VP8X' and len(head) >= 30:
+                return (1 + int.from_bytes(head[24:27], 'little'),
+                        1 + int.from_bytes(head[27:30], 'little'))
+            return None
+        if head[:2] == b'\xff\xd8':
+            img_file.seek(2)
+            return probe_jpeg_size(img_file)
+    return None
+
+
+def find_image_size(img_path):
+    """
+    Return the size of an image, probing its header and falling back to
+    Pillow for formats the probe does not know. Raises OSError if the image
+    cannot be read.
+    """
+    size = probe_image_size(img_path)
+    if size is None or not all(size):
+        with Image.open(img_path) as img:
+            size = img.size
+    return tuple(size)
 
-    margin_size = 2
+
+class SizeIndex:
+    """
+    Remember the size of each image in a file beside the images folder, so
+    that sizes are only probed again for files that have changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # map each image path to its mtime, file size and image size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    @staticmethod
+    def for_folder(folder):
+        """
+        Return the index kept beside `folder`.
+        """
+        return SizeIndex(os.path.normpath(folder) + '.sizes.json')
+
+    def load(self):
+        try:
+            with open(self.path) as index_file:
+                self.entries = json.load(index_file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump(self.entries, index_file, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+    def get_size(self, img_path):
+        """
+        Return the size of the image, from the index if the file has not
+        changed since it was last probed. Raises OSError if the image cannot
+        be read.
+        """
+        stat = os.stat(img_path)
+        entry = self.entries.get(img_path)
+        if entry is not None and entry[:2] == [stat.st_mtime_ns,
+                                               stat.st_size]:
+            self.hits += 1
+            return tuple(entry[2:])
+
+        self.misses += 1
+        size = find_image_size(img_path)
+        self.entries[img_path] = [stat.st_mtime_ns, stat.st_size] + list(size)
+        return size
+
+
+def read_image_sizes(images, size_index=None, metrics=None):
+    """
+    Return the path and size of each of `images` that can be read. Only the
+    header of each file is read, and not even that for images whose size is
+    already in `size_index`.
+    """
+    if metrics is None:
+        metrics = shared_metrics
+    image_sizes = []
+    for img_path in images:
+        try:
+            with metrics.time_stage('probe'):
+                if size_index is not None:
+                    size = size_index.get_size(img_path)
+                else:
+                    size = find_image_size(img_path)
+            image_sizes.append((img_path, size))
+        except OSError:
+            logger.warning('An image could not be used: %s', img_path)
+    return image_sizes
+
+
+def layout_rows(image_sizes, width, init_height, margin_size):
+    """
+    Split the images into rows for a collage of width `width`, using the
+    sizes found by `read_image_sizes`. Return the height the images were
+    fitted to and a list of (coef, image paths) for each row, where coef is
+    how much wider than `width` the row is at that height.
+
+    Rows are filled in order until they pass `width`. While any row holds
+    a single image, `init_height` is lowered by 10 and the rows are worked
+    out again. No image is opened.
+    """
     # run until a suitable arrangement of images is found
     while True:
-        # copy images to images_list
-        images_list = images[:]
         coefs_lines = []
         images_line = []
         x = 0
-        while images_list:
-            # get first image and resize to `init_height`
-            img_path = images_list.pop(0)
-            try:
-                img = Image.open(img_path)
-            except OSError:
-                print("An image could not be used")
-                print(img_path)
-                continue
-
-            img.thumbnail((width, init_height))
+        for img_path, size in image_sizes:
             # when `x` will go beyond the `width`, start the next line
             if x > width:
                 coefs_lines.append((float(x) / width, images_line))
                 images_line = []
                 x = 0
-            x += img.size[0] + margin_size
+            x += thumbnail_size(size, (width, init_height))[0] + margin_size
             images_line.append(img_path)
         # finally add the last line with images
         coefs_lines.append((float(x) / width, images_line))
@@ -57,47 +250,460 @@ def make_collage(images, filename, width, init_height):
         # less images
         if len(coefs_lines) <= 1:
             break
-        if any(map(lambda x: len(x[1]) <= 1, coefs_lines)):
+        if any(map(lambda x: len(x[1]) <= 1, coefs_lines)) and \
+                init_height > 10:
             # reduce `init_height`
             init_height -= 10
         else:
             break
 
+    return init_height, coefs_lines
+
+
+def find_tile_size(size, width, init_height, coef):
+    """
+    Return the size an image of `size` is drawn at in a row with `coef`.
+    """
+    # if need to enlarge an image - use `resize`, otherwise use `thumbnail`
+    k = (init_height / coef) / size[1]
+    if k > 1:
+        return int(size[0] * k), int(size[1] * k)
+    return thumbnail_size(size, (int(width / coef), int(init_height / coef)))
+
+
+def render_tile(img_path, tile_size):
+    """
+    Return the image at `img_path` resized to `tile_size`. JPEGs are decoded
+    at a reduced scale where that still leaves at least `tile_size` pixels,
+    and other images are reduced by a whole factor before the final
+    resample.
+    """
+    with Image.open(img_path) as img:
+        img.draft('RGB', tile_size)
+        return img.resize(tile_size, Image.LANCZOS,
+                          reducing_gap=REDUCING_GAP)
+
+
+def render_tile_buffers(jobs):
+    """
+    Render the tiles for a list of (image path, tile size) jobs in a worker
+    process. Return the mode, size and raw pixels of each, converted the way
+    `paste` would convert them so that the collage comes out the same as a
+    serial render, along with the seconds it took.
+    """
+    buffers = []
+    for job in jobs:
+        start = time.perf_counter()
+        tile = render_tile(*job)
+        if tile.mode not in PASTE_MODES:
+            tile = tile.convert('RGB')
+        buffers.append((tile.mode, tile.size, tile.tobytes(),
+                        time.perf_counter() - start))
+    return buffers
+
+
+def render_tiles(jobs, workers=1, thumbnails=None, metrics=None):
+    """
+    Yield the tile for each (image path, tile size) job in order, rendering
+    them on `workers` processes when more than one is asked for. Only a few
+    chunks of tiles per worker are in flight at once, so the tiles waiting
+    to be pasted never take much memory.
+
+    With a `thumbnails` cache, a tile is resized from a cached thumbnail at
+    least as large as it where there is one, and tiles read from disk are
+    added to the cache. Each tile is timed as a run of the 'resize' stage in
+    `metrics`.
+    """
+    if metrics is None:
+        metrics = shared_metrics
+    if thumbnails is not None:
+        cached = [thumbnails.contains_source(*job) for job in jobs]
+        disk_tiles = render_tiles([job for job, in_cache in
+                                   zip(jobs, cached) if not in_cache],
+                                  workers, metrics=metrics)
+        for (img_path, tile_size), in_cache in zip(jobs, cached):
+            img = None
+            if in_cache:
+                with metrics.time_stage('resize'):
+                    img = thumbnails.make_tile(img_path, tile_size)
+                    if img is None:
+                        # the thumbnail was evicted since it was looked up
+                        img = render_tile(img_path, tile_size)
+            else:
+                img = next(disk_tiles)
+                thumbnails.add(img_path, img)
+            yield img
+        return
+
+    if workers <= 1:
+        for job in jobs:
+            with metrics.time_stage('resize'):
+                img = render_tile(*job)
+            yield img
+        return
+
+    # hand the jobs out in chunks so that each worker gets several at once
+    chunksize = max(1, min(64, len(jobs) // (workers * 4)))
+    chunks = (jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(render_tile_buffers, chunk))
+            if len(pending) < workers * 2:
+                continue
+            for mode, size, data, seconds in pending.popleft().result():
+                metrics.observe('resize', seconds)
+                yield Image.frombytes(mode, size, data)
+        while pending:
+            for mode, size, data, seconds in pending.popleft().result():
+                metrics.observe('resize', seconds)
+                yield Image.frombytes(mode, size, data)
+
+
+class PngStreamWriter:
+    """
+    Write an RGB PNG a band of rows at a time, so that the whole image is
+    never held in memory.
+    """
+
+    # how much compressed data is gathered before it is written as a chunk
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, filename, width, height):
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(6)
+        self.pending = []
+        self.pending_size = 0
+        self.png_file = open(filename, 'wb')
+        self.png_file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bits per channel, RGB, no interlacing
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                              0, 0, 0))
+
+    def write_chunk(self, chunk_type, data):
+        self.png_file.write(struct.pack('>I', len(data)) + chunk_type + data)
+        self.png_file.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    def write_compressed(self, data, flush=False):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+        if self.pending_size >= self.CHUNK_SIZE or (flush and self.pending):
+            self.write_chunk(b'IDAT', b''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def write_band(self, band):
+        """
+        Append the rows of `band`, an RGB image as wide as the PNG.
+        """
+        row_size = self.width * 3
+        pixels = band.tobytes()
+        for start in range(0, len(pixels), row_size):
+            # each row starts with its filter type, 0 for none
+            self.write_compressed(self.compressor.compress(
+                b'\x00' + pixels[start:start + row_size]))
+        self.rows_written += band.size[1]
+
+    def close(self):
+        if self.rows_written != self.height:
+            self.png_file.close()
+            raise ValueError('{} rows were written to a PNG of height {}'
+                             .format(self.rows_written, self.height))
+        self.write_compressed(self.compressor.flush(), flush=True)
+        self.write_chunk(b'IEND', b'')
+        self.png_file.close()
+
+
+def make_collage(images, filename, width, init_height, size_index=None,
+                 workers=1, stream=False, thumbnails=None, metrics=None):
+    """
+    Make a collage image with a width equal to `width` from `images` and save
+    to `filename`. Image sizes are looked up in `size_index` if one is given,
+    and the tiles are rendered on `workers` processes, or from the
+    `thumbnails` cache where it holds a large enough copy. With `stream` the
+    collage is written as a PNG one row at a time instead of being built in
+    memory. The probe, resize, paste and save stages are timed in `metrics`.
+    """
+    if not images:
+        logger.warning('No images for collage found!')
+        return False
+    if metrics is None:
+        metrics = shared_metrics
+
+    margin_size = 2
+    # read the size of every image once, then lay the rows out from the
+    # sizes alone
+    image_sizes = read_image_sizes(images, size_index, metrics)
+    init_height, coefs_lines = layout_rows(image_sizes, width, init_height,
+                                           margin_size)
+
     # get output height
     out_height = 0
     for coef, imgs_line in coefs_lines:
         if imgs_line:
             out_height += int(init_height / coef) + margin_size
     if not out_height:
-        print('Height of collage could not be 0!')
+        logger.warning('Height of collage could not be 0!')
         return False
 
-    collage_image = Image.new('RGB', (width, int(out_height)), WHITE)
-
-    # put images to the collage
+    # work out where each image goes, then render and paste the tiles
+    sizes = dict(image_sizes)
+    jobs = []
+    positions = []
     y = 0
-    for coef, imgs_line in coefs_lines:
+    for row, (coef, imgs_line) in enumerate(coefs_lines):
         if imgs_line:
             x = 0
             for img_path in imgs_line:
-                img = Image.open(img_path)
-                # if need to enlarge an image - use `resize`, otherwise use
-                # `thumbnail`, it's faster
-                k = (init_height / coef) / img.size[1]
-                if k > 1:
-                    img = img.resize((int(img.size[0] * k),
-                                      int(img.size[1] * k)), Image.ANTIALIAS)
-                else:
-                    img.thumbnail((int(width / coef),
-                                   int(init_height / coef)), Image.ANTIALIAS)
-                if collage_image:
-                    collage_image.paste(img, (int(x), int(y)))
-                x += img.size[0] + margin_size
+                tile_size = find_tile_size(sizes[img_path], width,
+                                           init_height, coef)
+                jobs.append((img_path, tile_size))
+                positions.append((row, int(x), int(y)))
+                x += tile_size[0] + margin_size
             y += int(init_height / coef) + margin_size
-    collage_image.save(filename)
+    tiles = render_tiles(jobs, workers, thumbnails, metrics)
+    metrics.increment('tiles_rendered', len(jobs))
+
+    if stream:
+        write_collage_rows(filename, width, init_height, margin_size,
+                           coefs_lines, positions, tiles, metrics)
+        return True
+
+    collage_image = Image.new('RGB', (width, int(out_height)), WHITE)
+    for (row, x, y), img in zip(positions, tiles):
+        with metrics.time_stage('paste'):
+            collage_image.paste(img, (x, y))
+    with metrics.time_stage('save'):
+        collage_image.save(filename)
     return True
 
 
+def write_collage_rows(filename, width, init_height, margin_size, coefs_lines,
+                       positions, tiles, metrics=None):
+    """
+    Write the collage to `filename` as a PNG one row at a time. Each row is
+    pasted into a band of its own height and written out before the next
+    row is started, so only one row is held in memory.
+    """
+    band_heights = {row: int(init_height / coef) + margin_size
+                    for row, (coef, imgs_line) in enumerate(coefs_lines)
+                    if imgs_line}
+    if metrics is None:
+        metrics = shared_metrics
+    writer = PngStreamWriter(filename, width, sum(band_heights.values()))
+    band = None
+    band_row = None
+    for (row, x, y), img in zip(positions, tiles):
+        if row != band_row:
+            if band is not None:
+                with metrics.time_stage('save'):
+                    writer.write_band(band)
+            band_row = row
+            band = Image.new('RGB', (width, band_heights[row]), WHITE)
+        with metrics.time_stage('paste'):
+            band.paste(img, (x, 0))
+    with metrics.time_stage('save'):
+        if band is not None:
+            writer.write_band(band)
+        writer.close()
+
+
+class ThumbnailCache:
+    """
+    Hold decoded, downscaled copies of images in memory, keyed by image path
+    and height, so that an image is not decoded again for a tile that one of
+    its copies can be resized to. Once the copies held pass `max_bytes`, the
+    least recently used are dropped.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # map each (image path, height) to its copy, least recently used
+        # first, and each image path to the heights held for it
+        self.entries = OrderedDict()
+        self.heights = {}
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def find_bytes(img):
+        return img.size[0] * img.size[1] * len(img.getbands())
+
+    def find_source_key(self, img_path, tile_size):
+        """
+        Return the key of the smallest copy of the image at least as large
+        as `tile_size`, or None if there is none. The lock must be held.
+        """
+        best = None
+        for height in sorted(self.heights.get(img_path, ())):
+            img = self.entries[(img_path, height)]
+            if img.size[0] >= tile_size[0] and img.size[1] >= tile_size[1]:
+                best = (img_path, height)
+                break
+        return best
+
+    def contains_source(self, img_path, tile_size):
+        """
+        Return True if a copy of the image large enough for `tile_size` is
+        held, counting a hit or a miss.
+        """
+        with self.lock:
+            found = self.find_source_key(img_path, tile_size) is not None
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def make_tile(self, img_path, tile_size):
+        """
+        Return the tile resized from the smallest copy of the image large
+        enough for it, or None if no copy is held.
+        """
+        with self.lock:
+            key = self.find_source_key(img_path, tile_size)
+            if key is None:
+                return None
+            self.entries.move_to_end(key)
+            source = self.entries[key]
+        if source.size == tile_size:
+            return source
+        return source.resize(tile_size, Image.LANCZOS,
+                             reducing_gap=REDUCING_GAP)
+
+    def add(self, img_path, img):
+        """
+        Hold a copy of the image, then drop the least recently used copies
+        until the cache fits its budget.
+        """
+        img_bytes = self.find_bytes(img)
+        if img_bytes > self.max_bytes:
+            return
+        key = (img_path, img.size[1])
+        with self.lock:
+            if key in self.entries:
+                self.bytes_held -= self.find_bytes(self.entries[key])
+            self.entries[key] = img
+            self.entries.move_to_end(key)
+            self.heights.setdefault(img_path, set()).add(img.size[1])
+            self.bytes_held += img_bytes
+
+            while self.bytes_held > self.max_bytes:
+                (old_path, old_height), old_img = self.entries.popitem(
+                    last=False)
+                self.heights[old_path].discard(old_height)
+                if not self.heights[old_path]:
+                    del self.heights[old_path]
+                self.bytes_held -= self.find_bytes(old_img)
+                self.evictions += 1
+
+    def get_hit_rate(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        """
+        Log how well the cache did and how much it holds.
+        """
+        logger.info('thumbnails: %.0f%% hit rate (%d hits, %d misses), %d '
+                    'evicted, %.1f MB held of %.1f MB',
+                    self.get_hit_rate() * 100, self.hits, self.misses,
+                    self.evictions, self.bytes_held / (1024 * 1024),
+                    self.max_bytes / (1024 * 1024))
+
+
+class CollagePipeline:
+    """
+    Prepare images for the collage while they are still being collected.
+
+    Image paths are handed to `add` as each image is saved, and wait in a
+    bounded queue. A background thread probes the size of each one and
+    adds a thumbnail reduced to fit the initial row height to the thumbnail
+    cache. `finish` then lays out and renders the collage from the
+    thumbnails, so little image work is left once the last image arrives.
+    """
+
+    def __init__(self, settings, max_queued=64, metrics=None):
+        self.settings = settings
+        # stage timings and the depth of the queue are recorded here
+        self.metrics = metrics if metrics is not None else shared_metrics
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.size_index = SizeIndex.for_folder(settings.get_folder())
+        self.images = []
+        self.thumbnails = ThumbnailCache(settings.get_thumbnail_budget())
+        self.thread = threading.Thread(target=self.prepare_images,
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def add(self, img_path):
+        """
+        Queue an image for the collage, waiting while the queue is full.
+        """
+        self.queue.put(img_path)
+        self.metrics.set_depth('collage_queue', self.queue.qsize())
+
+    def prepare_images(self):
+        """
+        Probe and reduce each queued image until `finish` is called.
+        """
+        box = (self.settings.get_width(), self.settings.get_initial_height())
+        while True:
+            img_path = self.queue.get()
+            if img_path is None:
+                return
+            try:
+                with self.metrics.time_stage('probe'):
+                    size = self.size_index.get_size(img_path)
+                with self.metrics.time_stage('resize'):
+                    thumbnail = render_tile(img_path,
+                                            thumbnail_size(size, box))
+                self.thumbnails.add(img_path, thumbnail)
+            except OSError:
+                logger.warning('An image could not be used: %s', img_path)
+                continue
+            self.images.append(img_path)
+
+    def finish(self):
+        """
+        Wait for the queued images to be prepared, then make the collage.
+        Return True if it was made.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+        images = self.images[:]
+        if not images:
+            logger.warning('No images for making collage!')
+            return False
+        if self.settings.get_shuffle():
+            random.shuffle(images)
+
+        logger.info('making collage...')
+        res = make_collage(images, self.settings.get_output(),
+                           self.settings.get_width(),
+                           self.settings.get_initial_height(),
+                           self.size_index, self.settings.get_workers(),
+                           self.settings.get_stream(), self.thumbnails,
+                           self.metrics)
+        self.size_index.save()
+        self.thumbnails.report()
+        if not res:
+            logger.error('making collage failed!')
+            return False
+        logger.info('collage done!')
+        return True
+
+
 def get_images(settings):
     images = list(filter(is_image, os.listdir(settings.get_folder())))
     image_paths = [os.path.join(settings.get_folder(), image) for
@@ -118,12 +724,16 @@ class Settings:
     """Hold the settings passed in by the user"""
 
     def __init__(self, folder='./images', output='collage.png', width=1000,
-                 initial_height=25, shuffle=False):
+                 initial_height=25, shuffle=False, workers=1, stream=False,
+                 thumbnail_budget=256 * 1024 * 1024):
         self.folder = folder
         self.output = output
         self.width = width
         self.initial_height = initial_height
         self.shuffle = shuffle
+        self.workers = workers
+        self.stream = stream
+        self.thumbnail_budget = thumbnail_budget
 
     def get_folder(self):
         return self.folder
@@ -140,28 +750,49 @@ class Settings:
     def get_shuffle(self):
         return self.shuffle
 
+    def get_workers(self):
+        return self.workers
 
-def run(settings):
-    """Run the program with the given settings method"""
+    def get_stream(self):
+        return self.stream
+
+    def get_thumbnail_budget(self):
+        return self.thumbnail_budget
+
+
+def run(settings, metrics=None, thumbnails=None):
+    """
+    Run the program with the given settings method. Tiles are rendered from
+    the `thumbnails` cache where it can, so passing the same cache to each
+    run saves decoding the images again. A cache with the budget in the
+    settings is made if none is given.
+    """
     # get images
     images = get_images(settings)
 
     if not images:
-        print('No images for making collage! Please select other directory'
-              ' with images!')
+        logger.warning('No images for making collage! Please select other '
+                       'directory with images!')
         return
 
     # shuffle images if needed
     if settings.get_shuffle():
         random.shuffle(images)
 
-    print('making collage...')
+    logger.info('making collage...')
+    size_index = SizeIndex.for_folder(settings.get_folder())
+    if thumbnails is None:
+        thumbnails = ThumbnailCache(settings.get_thumbnail_budget())
     res = make_collage(images, settings.get_output(), settings.get_width(),
-                       settings.get_initial_height())
+                       settings.get_initial_height(), size_index,
+                       settings.get_workers(), settings.get_stream(),
+                       thumbnails, metrics)
+    size_index.save()
+    thumbnails.report()
     if not res:
-        print('making collage failed!')
+        logger.error('making collage failed!')
         return
-    print('collage done!')
+    logger.info('collage done!')
 
 
 def main():
@@ -181,36 +812,65 @@ def main():
                        type='int', help='initial height for resize the images')
     options.add_option('-s', '--shuffle', action='store_true', dest='shuffle',
                        help='enable images shuffle', default=False)
+    options.add_option('-j', '--workers', dest='workers', type='int',
+                       help='number of processes rendering the images',
+                       default=1)
+    options.add_option('--stream', action='store_true', dest='stream',
+                       help='write the collage a row at a time to save memory'
+                       ' (PNG output only)', default=False)
+    options.add_option('--thumbnail-budget', dest='thumbnail_budget',
+                       type='int', help='megabytes of decoded thumbnails to'
+                       ' keep in memory', default=256)
+    options.add_option('-v', '--verbose', action='store_true',
+                       dest='verbose', help='log every image', default=False)
+    options.add_option('--metrics', dest='metrics',
+                       help='save timings of each stage to this file, as '
+                       'Prometheus text if it ends in .prom and JSON '
+                       'otherwise')
+    options.add_option('--profile', dest='profile', action='append',
+                       default=[], help='run a stage (probe, resize, paste '
+                       'or save) under cProfile, saving <stage>.prof; may '
+                       'be given more than once')
 
     opts, args = options.parse_args()
+    logging.basicConfig(level=logging.DEBUG if opts.verbose else
+                        logging.INFO, format='%(message)s')
     settings = Settings(folder=opts.folder, output=opts.output,
                         width=opts.width, initial_height=opts.init_height,
-                        shuffle=opts.shuffle)
+                        shuffle=opts.shuffle, workers=opts.workers,
+                        stream=opts.stream,
+                        thumbnail_budget=opts.thumbnail_budget * 1024 * 1024)
     if not opts.width or not opts.init_height:
         options.print_help()
         return
 
-    run(settings=settings)
+    metrics = Metrics(profile_stages=opts.profile)
+    run(settings=settings, metrics=metrics)
+    metrics.report()
+    if opts.metrics:
+        metrics.save(opts.metrics)
+    if opts.profile:
+        metrics.save_profiles('.')
 
     # get images
     images = get_images(opts)
 
-    print("Images:", images)
+    logger.debug('Images: %s', images)
     if not images:
-        print('No images for making collage! Please select other directory'
-              ' with images!')
+        logger.warning('No images for making collage! Please select other '
+                       'directory with images!')
         return
 
     # shuffle images if needed
     if opts.shuffle:
         random.shuffle(images)
 
-    print('making collage...')
+    logger.info('making collage...')
     res = make_collage(images, opts.output, opts.width, opts.init_height)
     if not res:
-        print('making collage failed!')
+        logger.error('making collage failed!')
         return
-    print('collage done!')
+    logger.info('collage done!')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,276 @@
+"""
+Counters, queue depths and per-stage latency histograms shared by the crawl,
+download and render stages.
+"""
+
+import bisect
+import cProfile
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+# upper bounds in seconds of the buckets stage latencies are counted in
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Count observed values in buckets with the given upper bounds, keeping
+    their sum, the way a Prometheus histogram does.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # the last count is for values above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # the first bucket whose bound is at or above the value
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+        """
+        Return the number of values at or below each bound, then the total.
+        """
+        cumulative = []
+        running = 0
+        for count in self.counts:
+            running += count
+            cumulative.append(running)
+        return cumulative
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'buckets': dict(zip([str(bound) for bound in self.bounds] +
+                                    ['+Inf'],
+                                    self.get_cumulative_counts()))}
+
+
+class Metrics:
+    """
+    Collect counters, queue depths and per-stage latency histograms from the
+    crawl, download and render stages, for export as JSON or Prometheus
+    text.
+
+    Stages are timed with `time_stage`. Those named in `profile_stages` are
+    also run under cProfile, one profiler per stage and thread, and
+    `stage_hook`, if given, is called with the stage, its start time and its
+    duration so that a tracer can record it as a span.
+    """
+
+    def __init__(self, profile_stages=(), stage_hook=None):
+        self.profile_stages = set(profile_stages)
+        self.stage_hook = stage_hook
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.counters = {}
+        # map each queue to its last and largest depth
+        self.gauges = {}
+        self.histograms = {}
+        self.profilers = []
+        self.local = threading.local()
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_depth(self, name, depth):
+        """
+        Record the current depth of a queue, keeping the largest seen.
+        """
+        with self.lock:
+            largest = self.gauges.get(name, (0, 0))[1]
+            self.gauges[name] = (depth, max(largest, depth))
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    def find_profiler(self, stage):
+        """
+        Return this thread's profiler for the stage, or None if the stage is
+        not profiled or the thread is already profiling another stage.
+        """
+        if stage not in self.profile_stages or \
+                getattr(self.local, 'profiling', False):
+            return None
+        profilers = self.local.__dict__.setdefault('profilers', {})
+        if stage not in profilers:
+            profilers[stage] = cProfile.Profile()
+            with self.lock:
+                self.profilers.append((stage, profilers[stage]))
+        return profilers[stage]
+
+    def time_stage(self, stage):
+        """
+        Return a context manager that times the body of its `with` block as
+        one run of the stage.
+        """
+        return StageTimer(self, stage)
+
+    def finish_stage(self, stage, start, seconds):
+        self.observe(stage, seconds)
+        if self.stage_hook is not None:
+            self.stage_hook(stage, start, seconds)
+
+    def get_elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def get_rate(self, name):
+        """
+        Return how many times a second the counter went up since the metrics
+        were made.
+        """
+        with self.lock:
+            count = self.counters.get(name, 0)
+        return count / max(self.get_elapsed(), 1e-9)
+
+    def to_dict(self):
+        elapsed = max(self.get_elapsed(), 1e-9)
+        with self.lock:
+            return {
+                'elapsed_seconds': elapsed,
+                'counters': dict(self.counters),
+                'rates': {name: count / elapsed for name, count in
+                          self.counters.items()},
+                'queues': {name: {'depth': depth, 'max_depth': largest}
+                           for name, (depth, largest) in
+                           self.gauges.items()},
+                'stages': {stage: histogram.to_dict() for stage, histogram
+                           in self.histograms.items()}}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=1, sort_keys=True)
+
+    def to_prometheus(self, prefix='crawler_collage'):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = ['# TYPE {}_elapsed_seconds gauge'.format(prefix),
+                 '{}_elapsed_seconds {}'.format(prefix, self.get_elapsed())]
+        with self.lock:
+            for name, count in sorted(self.counters.items()):
+                lines.append('# TYPE {}_{}_total counter'.format(prefix,
+                                                                 name))
+                lines.append('{}_{}_total {}'.format(prefix, name, count))
+            if self.gauges:
+                for suffix, index in (('queue_depth', 0),
+                                      ('queue_max_depth', 1)):
+                    lines.append('# TYPE {}_{} gauge'.format(prefix, suffix))
+                    for name, depths in sorted(self.gauges.items()):
+                        lines.append('{}_{}{{queue="{}"}} {}'.format(
+                            prefix, suffix, name, depths[index]))
+            if self.histograms:
+                name = prefix + '_stage_seconds'
+                lines.append('# TYPE {} histogram'.format(name))
+            for stage, histogram in sorted(self.histograms.items()):
+                bounds = [str(bound) for bound in histogram.bounds] + ['+Inf']
+                for bound, count in zip(bounds,
+                                        histogram.get_cumulative_counts()):
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                        name, stage, bound, count))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(
+                    name, stage, histogram.total))
+                lines.append('{}_count{{stage="{}"}} {}'.format(
+                    name, stage, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """
+        Write the metrics to `path`, as Prometheus text if it ends in .prom
+        and as JSON otherwise.
+        """
+        with open(path, 'w') as metrics_file:
+            if path.endswith('.prom'):
+                metrics_file.write(self.to_prometheus())
+            else:
+                metrics_file.write(self.to_json())
+
+    def get_profile_stats(self, stage):
+        """
+        Return the pstats.Stats of every profiled run of the stage, or None
+        if it was not profiled.
+        """
+        with self.lock:
+            profilers = [profiler for profiled_stage, profiler in
+                         self.profilers if profiled_stage == stage]
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+    def save_profiles(self, folder):
+        """
+        Write the profile of each profiled stage to `folder` as
+        <stage>.prof, for reading with pstats or snakeviz.
+        """
+        os.makedirs(folder, exist_ok=True)
+        for stage in sorted(self.profile_stages):
+            stats = self.get_profile_stats(stage)
+            if stats is not None:
+                stats.dump_stats(os.path.join(folder, stage + '.prof'))
+
+    def report(self):
+        """
+        Log the rate of each counter and the mean latency of each stage.
+        """
+        metrics = self.to_dict()
+        for name, rate in sorted(metrics['rates'].items()):
+            logger.info('%s: %d (%.1f/s)', name, metrics['counters'][name],
+                        rate)
+        for stage, histogram in sorted(metrics['stages'].items()):
+            logger.info('%s: %d runs, %.2f ms mean', stage,
+                        histogram['count'], histogram['mean'] * 1000)
+
+
+class StageTimer:
+    """
+    Time one run of a stage for `Metrics`, profiling it if asked to.
+    """
+
+    __slots__ = ('metrics', 'stage', 'profiler', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.profiler = None
+
+    def __enter__(self):
+        if self.stage in self.metrics.profile_stages:
+            self.profiler = self.metrics.find_profiler(self.stage)
+            if self.profiler is not None:
+                try:
+                    self.profiler.enable()
+                    self.metrics.local.profiling = True
+                except ValueError:
+                    # another profiler is running, which cProfile does not
+                    # allow on every version of Python
+                    self.profiler = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.metrics.local.profiling = False
+        self.metrics.finish_stage(self.stage, self.start, seconds)
+
+
+# used by anything that is not given metrics of its own
+shared_metrics = Metrics()
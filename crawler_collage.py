@@ -2,13 +2,63 @@
 
 import urllib.request
 import urllib.parse
-from urllib import request, error
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urlsplit, urlunsplit
 from bs4 import BeautifulSoup
 import re
 import os
 from collage_maker import collage_maker
+from collage_maker.metrics import Metrics, shared_metrics
 import hashlib
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
+from email.message import Message
+import json
+import tempfile
+import shutil
+import gzip
+import http.client
+import io
+import zlib
+import base64
+import codecs
+import sys
+import logging
+import queue
+import sqlite3
+from html.parser import HTMLParser
+from optparse import OptionParser
+from urllib.robotparser import RobotFileParser
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of bytes read from a response or file at a time
+CHUNK_SIZE = 64 * 1024
+
+# Ports that are left out of a url when they are the default for its scheme
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+# Name the crawler gives servers and looks for in robots.txt
+USER_AGENT = "crawler-collage"
+
+logger = logging.getLogger(__name__)
 
 
 def verify_real_url(url):
@@ -18,6 +68,38 @@ def verify_real_url(url):
     return True if url[:4] == "http" else False
 
 
+def normalize_url(url):
+    """Return the url in a canonical form so that different spellings of the
+    same page compare equal. The canonical form is only for comparing links,
+    as a server may redirect it back to the url as written"""
+
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+
+    # Drop the port if it is the default one for the scheme
+    default_port = DEFAULT_PORTS.get(scheme)
+    if default_port and netloc.endswith(":" + default_port):
+        netloc = netloc[:-len(default_port) - 1]
+
+    # Treat /page/ and /page as the same, keeping the root as /
+    path = parts.path.rstrip("/") or "/"
+
+    # The fragment only points within a page, so it is dropped
+    return urlunsplit((scheme, netloc, path, parts.query, ""))
+
+
+def open_url(url, cache=None, client=None):
+    """Open a url, going through the cache if one is given and otherwise
+    through the given client, or the shared one if none is given"""
+
+    if cache is not None:
+        return cache.open(url)
+    if client is None:
+        client = shared_client
+    return client.open(url)
+
+
 def find_checksum(file_path):
     """Return the checksum of the file at the given file path"""
 
@@ -30,12 +112,127 @@ def find_checksum(file_path):
     return hash_md5.hexdigest()
 
 
+class TagExtractor(HTMLParser):
+    """Pick the hrefs of links and the src and alt text of images out of a
+    document as it is fed in, without building a tree"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs = []
+        self.image_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ('a', 'img'):
+            return
+        # Match BeautifulSoup, which gives attributes without a value as a
+        # blank string
+        attrs = {name: '' if value is None else value for name, value in
+                 attrs}
+        if tag == 'a':
+            if 'href' in attrs:
+                self.hrefs.append(attrs['href'])
+        else:
+            self.image_tags.append((attrs.get('src'), str(attrs.get('alt'))))
+
+    handle_startendtag = handle_starttag
+
+
+def find_charset(response, default='utf-8'):
+    """Return the character set given in a response's Content-Type"""
+
+    content_type = response.info()["Content-Type"] or ''
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset' and value.strip():
+            charset = value.strip().strip('"\'')
+            try:
+                codecs.lookup(charset)
+            except LookupError:
+                break
+            return charset
+    return default
+
+
+def extract_with_soup(response):
+    """Return the hrefs and image tags of a document parsed into a
+    BeautifulSoup tree with Python's html.parser"""
+
+    soup = BeautifulSoup(response, "html.parser")
+    hrefs = []
+    image_tags = []
+    # Pull both kinds of tag out of the document in a single walk
+    for tag in soup.findAll(['a', 'img']):
+        if tag.name == 'a':
+            try:
+                hrefs.append(tag['href'])
+            except KeyError:
+                pass
+        else:
+            image_tags.append((tag.get('src'), str(tag.get("alt"))))
+
+    return hrefs, image_tags
+
+
+def extract_with_lxml(response):
+    """Return the hrefs and image tags of a document parsed with lxml"""
+
+    if not response:
+        return [], []
+    # Leave lxml to find the encoding in the document if none is given
+    parser = lxml.html.HTMLParser(encoding=find_charset(response,
+                                                        default=None))
+    try:
+        document = lxml.html.document_fromstring(response.read(),
+                                                 parser=parser)
+    except (lxml.etree.ParserError, ValueError):
+        # The document is empty
+        return [], []
+
+    hrefs = []
+    image_tags = []
+    for tag in document.iter('a', 'img'):
+        if tag.tag == 'a':
+            href = tag.get('href')
+            if href is not None:
+                hrefs.append(href)
+        else:
+            image_tags.append((tag.get('src'), str(tag.get('alt'))))
+
+    return hrefs, image_tags
+
+
+def extract_with_stream(response):
+    """Return the hrefs and image tags of a document, feeding it to a
+    TagExtractor a chunk at a time as it is read"""
+
+    extractor = TagExtractor()
+    if response:
+        decoder = codecs.getincrementaldecoder(find_charset(response))(
+            errors='replace')
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            extractor.feed(decoder.decode(chunk))
+        extractor.feed(decoder.decode(b'', final=True))
+    extractor.close()
+
+    return extractor.hrefs, extractor.image_tags
+
+
+# Functions that pull the links and images out of a page, by name
+PARSERS = {"html.parser": extract_with_soup, "stream": extract_with_stream}
+if lxml is not None:
+    PARSERS["lxml"] = extract_with_lxml
+
+# Use the fastest backend that is installed
+DEFAULT_PARSER = "lxml" if lxml is not None else "stream"
+
+
 class CrawlerUserInput:
     """Get the page to crawl from the user"""
 
-    def __init__(self):
-        self.user_url = ""
-        self.user_page_lim = 0
+    def __init__(self, user_url="", user_page_lim=0):
+        # Both settings can be given up front instead of being asked for
+        self.user_url = user_url
+        self.user_page_lim = user_page_lim
 
     def find_user_url(self):
         """Get the url to start on from the user"""
@@ -73,18 +270,579 @@ class CrawlerUserInput:
         return self.user_page_lim
 
 
+class SpillFile:
+    """Hold the sets and queues that a streaming crawl moves out of memory,
+    in one SQLite file that is deleted when it is closed"""
+
+    def __init__(self, path=None):
+        if path is None:
+            spill_fd, path = tempfile.mkstemp(suffix='.spill.sqlite')
+            os.close(spill_fd)
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None,
+                                          check_same_thread=False)
+        # The file only lives as long as the crawl, so it is not made safe
+        # against crashes
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.table_count = 0
+
+    def make_table(self, columns, options=""):
+        """Create a table with the given column definitions and table options
+        and return its name"""
+
+        self.table_count += 1
+        name = "spill{}".format(self.table_count)
+        self.connection.execute("CREATE TABLE {} ({}) {}".format(
+            name, columns, options))
+        return name
+
+    def close(self):
+        self.connection.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SpillSet:
+    """A set of strings held in memory until it grows past max_memory_items,
+    and in a table of the spill file from then on"""
+
+    def __init__(self, spill_file, max_memory_items):
+        self.spill_file = spill_file
+        self.max_memory_items = max_memory_items
+        self.items = set()
+        self.table = None
+        self.size = 0
+
+    def spill(self):
+        """Move the items held in memory into the spill file"""
+
+        self.table = self.spill_file.make_table("item TEXT PRIMARY KEY",
+                                                "WITHOUT ROWID")
+        self.spill_file.connection.executemany(
+            "INSERT INTO {} VALUES (?)".format(self.table),
+            ((item,) for item in self.items))
+        self.size = len(self.items)
+        self.items = set()
+
+    def add(self, item):
+        if self.table is None:
+            self.items.add(item)
+            if len(self.items) > self.max_memory_items:
+                self.spill()
+            return
+        cursor = self.spill_file.connection.execute(
+            "INSERT OR IGNORE INTO {} VALUES (?)".format(self.table), (item,))
+        self.size += cursor.rowcount
+
+    def __contains__(self, item):
+        if self.table is None:
+            return item in self.items
+        return self.spill_file.connection.execute(
+            "SELECT 1 FROM {} WHERE item = ?".format(self.table),
+            (item,)).fetchone() is not None
+
+    def __len__(self):
+        return len(self.items) if self.table is None else self.size
+
+
+class SpillDict:
+    """A dict of strings to JSON values held in memory until it grows past
+    max_memory_items, and in a table of the spill file from then on"""
+
+    def __init__(self, spill_file, max_memory_items):
+        self.spill_file = spill_file
+        self.max_memory_items = max_memory_items
+        self.items = {}
+        self.table = None
+
+    def spill(self):
+        """Move the items held in memory into the spill file"""
+
+        self.table = self.spill_file.make_table(
+            "key TEXT PRIMARY KEY, value TEXT", "WITHOUT ROWID")
+        self.spill_file.connection.executemany(
+            "INSERT INTO {} VALUES (?, ?)".format(self.table),
+            ((key, json.dumps(value)) for key, value in self.items.items()))
+        self.items = {}
+
+    def __setitem__(self, key, value):
+        if self.table is None:
+            self.items[key] = value
+            if len(self.items) > self.max_memory_items:
+                self.spill()
+            return
+        self.spill_file.connection.execute(
+            "INSERT OR REPLACE INTO {} VALUES (?, ?)".format(self.table),
+            (key, json.dumps(value)))
+
+    def __len__(self):
+        if self.table is None:
+            return len(self.items)
+        return self.spill_file.connection.execute(
+            "SELECT COUNT(*) FROM {}".format(self.table)).fetchone()[0]
+
+    def get_sorted_items(self):
+        """Yield each key and value in the order of the keys, reading spilled
+        items from the file a row at a time"""
+
+        if self.table is None:
+            yield from sorted(self.items.items())
+            return
+        for key, value in self.spill_file.connection.execute(
+                "SELECT key, value FROM {} ORDER BY key".format(self.table)):
+            yield key, json.loads(value)
+
+
+class SpillQueue:
+    """A first in, first out queue of strings that keeps no more than
+    max_memory_items in memory, holding the rest in the spill file.
+
+    Once items are spilled, new items go to the file behind them, and the
+    oldest spilled items are read back in batches as the front of the queue
+    is used up, so the order is kept.
+    """
+
+    def __init__(self, spill_file, max_memory_items):
+        self.spill_file = spill_file
+        self.max_memory_items = max_memory_items
+        self.head = deque()
+        self.table = None
+        self.spilled = 0
+
+    def append(self, item):
+        if not self.spilled and len(self.head) < self.max_memory_items:
+            self.head.append(item)
+            return
+        if self.table is None:
+            self.table = self.spill_file.make_table(
+                "id INTEGER PRIMARY KEY, item TEXT")
+        self.spill_file.connection.execute(
+            "INSERT INTO {} (item) VALUES (?)".format(self.table), (item,))
+        self.spilled += 1
+
+    def refill(self):
+        """Read the oldest spilled items back into memory"""
+
+        connection = self.spill_file.connection
+        rows = connection.execute(
+            "SELECT id, item FROM {} ORDER BY id LIMIT ?".format(self.table),
+            (max(1, self.max_memory_items // 2),)).fetchall()
+        connection.execute("DELETE FROM {} WHERE id <= ?".format(self.table),
+                           (rows[-1][0],))
+        self.head.extend(item for row_id, item in rows)
+        self.spilled -= len(rows)
+
+    def popleft(self):
+        if not self.head and self.spilled:
+            self.refill()
+        return self.head.popleft()
+
+    def extendleft(self, items):
+        # Items put back at the front are few, so they are kept in memory
+        self.head.extendleft(items)
+
+    def __len__(self):
+        return len(self.head) + self.spilled
+
+    def __iter__(self):
+        yield from list(self.head)
+        if self.spilled:
+            for row in self.spill_file.connection.execute(
+                    "SELECT item FROM {} ORDER BY id".format(self.table)):
+                yield row[0]
+
+
+class Frontier:
+    """Hold the links waiting to be visited in the order they were found.
+
+    Every link ever added is remembered, so a link that has already been
+    queued or visited is never queued again. Links are remembered by their
+    normalized form but queued as they were written, so that /docs/ is not
+    fetched as /docs and redirected back.
+    Given a spill file, no more than max_memory_links of the queued and of
+    the seen links are kept in memory, and the rest are kept on disk.
+    """
+
+    def __init__(self, urls=(), spill_file=None, max_memory_links=100000):
+        if spill_file is None:
+            self.queue = deque()
+            self.seen = set()
+        else:
+            self.queue = SpillQueue(spill_file, max_memory_links)
+            self.seen = SpillSet(spill_file, max_memory_links)
+        self.extend(urls)
+
+    def add(self, url):
+        """Queue a link if it has not been seen before. Return True if it was
+        queued"""
+
+        key = normalize_url(url)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.queue.append(url)
+        return True
+
+    def extend(self, urls):
+        """Queue each of the links that has not been seen before"""
+
+        for url in urls:
+            self.add(url)
+
+    def pop(self):
+        """Remove and return the link that was queued first"""
+
+        return self.queue.popleft()
+
+    def requeue(self, urls):
+        """Put links that were taken but not visited back at the front of
+        the queue, in the given order"""
+
+        self.queue.extendleft(reversed(urls))
+
+    def get_seen_count(self):
+        """Return the number of distinct links ever queued"""
+
+        return len(self.seen)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __iter__(self):
+        return iter(self.queue)
+
+
+class HostState:
+    """Hold what the scheduler knows about a single host"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.robots = None
+        self.crawl_delay = 0.0
+        self.delay = 0.0
+        # Monotonic time at which the host may next be sent a request
+        self.next_time = 0.0
+
+
+class HostScheduler:
+    """Keep the crawl polite to each host it visits.
+
+    Each host's robots.txt is fetched once, through the client, and
+    disallowed pages are skipped. Requests to a host are spaced out by a
+    delay that is never shorter than the host's Crawl-delay. The delay
+    follows the host's response time, so that about target_concurrency
+    requests are outstanding on it. It is doubled, or set to the
+    Retry-After given, when the host answers 429 or 503. Requests to
+    different hosts do not wait on each other, and one scheduler can be
+    shared by crawls running on several threads.
+    """
+
+    THROTTLE_CODES = (429, 503)
+
+    def __init__(self, client=None, obey_robots=True, min_delay=0.0,
+                 max_delay=60.0, target_concurrency=4.0):
+        self.client = client if client is not None else shared_client
+        self.obey_robots = obey_robots
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target_concurrency = target_concurrency
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.pages_disallowed = 0
+        self.throttled_responses = 0
+
+    def get_host(self, url):
+        """Return the state of the host the url is on"""
+
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostState()
+            return self.hosts[host]
+
+    def read_robots(self, url):
+        """Fetch and parse the robots.txt of the url's host. Missing files
+        allow every page, and forbidden ones allow none"""
+
+        url_parts = urlparse(url)
+        robots_url = url_parts.scheme + "://" + url_parts.netloc + \
+            "/robots.txt"
+        robots = RobotFileParser(robots_url)
+        try:
+            with self.client.open(robots_url) as response:
+                lines = response.read().decode('utf-8', 'replace')
+            robots.parse(lines.splitlines())
+        except urllib.error.HTTPError as http_error:
+            if http_error.code in (401, 403):
+                robots.disallow_all = True
+            else:
+                robots.allow_all = True
+        except urllib.error.URLError:
+            robots.allow_all = True
+
+        return robots
+
+    def can_fetch(self, url):
+        """Return True if robots.txt lets the page be crawled, reading the
+        host's robots.txt the first time it is visited"""
+
+        if not self.obey_robots:
+            return True
+        state = self.get_host(url)
+        # Other pages of the host wait here until its robots.txt is read
+        with state.lock:
+            if state.robots is None:
+                state.robots = self.read_robots(url)
+                crawl_delay = state.robots.crawl_delay(USER_AGENT)
+                if crawl_delay:
+                    state.crawl_delay = float(crawl_delay)
+                    state.delay = max(state.delay, state.crawl_delay)
+
+        if state.robots.can_fetch(USER_AGENT, url):
+            return True
+        with self.lock:
+            self.pages_disallowed += 1
+        return False
+
+    def knows_host(self, url):
+        """Return True if the url's host can be checked against robots.txt
+        and have its turns booked without waiting on the network"""
+
+        return not self.obey_robots or self.get_host(url).robots is not None
+
+    def get_wait(self, url):
+        """Return the seconds until the url's host may be sent another
+        request"""
+
+        state = self.get_host(url)
+        with state.lock:
+            return max(0.0, state.next_time - time.monotonic())
+
+    def book_turn(self, url, max_wait=None):
+        """Book the next free slot of the url's host and return the monotonic
+        time it starts at. If the slot starts more than max_wait seconds from
+        now, return None without booking it"""
+
+        state = self.get_host(url)
+        with state.lock:
+            now = time.monotonic()
+            start = max(now, state.next_time)
+            if max_wait is not None and start - now > max_wait:
+                return None
+            # Booking the slot before it starts spaces out the requests
+            # waiting on the same host from each other
+            state.next_time = start + state.delay
+        return start
+
+    async def wait_turn(self, url):
+        """Wait until the url's host may be sent another request"""
+
+        start = self.book_turn(url)
+        now = time.monotonic()
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def record_response(self, url, latency, status, retry_after=None):
+        """Adjust the delay of the url's host after a response. Return True
+        if the host asked for the request to be tried again later"""
+
+        state = self.get_host(url)
+        with state.lock:
+            floor = max(self.min_delay, state.crawl_delay)
+            if status not in self.THROTTLE_CODES:
+                # Move halfway towards the delay that keeps
+                # target_concurrency requests outstanding
+                target = latency / self.target_concurrency
+                state.delay = min(max((state.delay + target) / 2, floor),
+                                  self.max_delay)
+                return False
+
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = max(state.delay * 2, 1.0)
+            state.delay = min(max(delay, floor), self.max_delay)
+            state.next_time = max(state.next_time,
+                                  time.monotonic() + state.delay)
+        with self.lock:
+            self.throttled_responses += 1
+        return True
+
+    def report(self):
+        """Log how the crawl was paced"""
+
+        logger.info("Politeness: %d pages disallowed by robots.txt, %d "
+                    "throttled responses", self.pages_disallowed,
+                    self.throttled_responses)
+        for host, state in sorted(self.hosts.items()):
+            logger.info("  %s: %.2f s between requests", host, state.delay)
+
+
+class HostQueues:
+    """Hold the links taken from the frontier that are waiting for their
+    host to be free, in a queue for each host.
+
+    Each link is numbered in the order it was taken, so that the hosts can
+    be served in that order and the links put back in the frontier as they
+    were.
+    """
+
+    def __init__(self):
+        # Map each host with waiting links to a deque of (number, url) pairs
+        self.queues = {}
+        self.links_taken = 0
+        self.count = 0
+
+    def number_link(self):
+        """Return the number of the next link taken from the frontier"""
+
+        self.links_taken += 1
+        return self.links_taken - 1
+
+    def add(self, host, number, url):
+        """Queue a link taken from the frontier behind its host's other
+        links"""
+
+        self.queues.setdefault(host, deque()).append((number, url))
+        self.count += 1
+
+    def put_back(self, host, number, url):
+        """Queue a link that was taken before at the front of its host's
+        links"""
+
+        self.queues.setdefault(host, deque()).appendleft((number, url))
+        self.count += 1
+
+    def has_links(self, host):
+        return host in self.queues
+
+    def peek(self, host):
+        """Return the number and url of the host's next link"""
+
+        return self.queues[host][0]
+
+    def pop(self, host):
+        """Remove and return the number and url of the host's next link"""
+
+        links = self.queues[host]
+        link = links.popleft()
+        if not links:
+            del self.queues[host]
+        self.count -= 1
+        return link
+
+    def get_hosts(self):
+        """Return the hosts with waiting links, the one whose next link was
+        taken first leading"""
+
+        return sorted(self.queues, key=lambda host: self.queues[host][0][0])
+
+    def take_all(self):
+        """Remove every waiting link and return them in the order they were
+        taken"""
+
+        links = sorted(link for links in self.queues.values()
+                       for link in links)
+        self.queues = {}
+        self.count = 0
+        return [url for number, url in links]
+
+    def __len__(self):
+        return self.count
+
+
 class Crawler:
     """Visit the web pages and collect the necessary information"""
 
-    def __init__(self, user_settings):
+    # A page is only started when its host's turn comes within this many
+    # seconds, so that pages waiting on a host do not hold connections
+    MAX_TURN_WAIT = 0.1
+
+    # While the image queue is full, whether the downloads are still running
+    # is checked this often, in seconds
+    DOWNLOAD_CHECK_INTERVAL = 0.5
+
+    def __init__(self, user_settings, max_connections=8,
+                 max_host_connections=4, download_workers=8, cache=None,
+                 checkpoint_path=None, checkpoint_interval=50, client=None,
+                 parser=DEFAULT_PARSER, image_ready=None,
+                 image_folder='./images', scheduler=None, max_retries=2,
+                 metrics=None, streaming=False, max_queued_images=256,
+                 max_memory_links=100000, spill_path=None):
         self.settings = user_settings
+        # Stage timings, counts and queue depths of the crawl are kept here
+        self.metrics = metrics if metrics is not None else shared_metrics
+        self.image_folder = image_folder
+        # Called with the path of each image as soon as it is downloaded
+        self.image_ready = image_ready
+        # The name of the backend in PARSERS that pages are read with
+        self.parser = parser
+        # Pages and images are fetched through the cache when one is given.
+        # All fetches share the client's pooled connections
+        self.cache = cache
+        if client is None:
+            client = cache.client if cache is not None else HttpClient()
+        self.client = client
+
+        # Paces the requests made to each host and applies robots.txt. Pages
+        # a host was too busy to serve are tried up to max_retries more times
+        if scheduler is None:
+            scheduler = HostScheduler(self.client)
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+        # The crawl state is saved to checkpoint_path every
+        # checkpoint_interval pages when a path is given
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_pages_visited = 0
+        # Records of the links taken and pages processed since the last
+        # checkpoint, and whether the checkpoint file belongs to this crawl
+        self.journal = []
+        self.checkpoint_started = False
         self.initial_page = self.settings.get_user_url()
         self.pages_to_visit = self.settings.get_user_page_lim()
 
+        # Limits on the number of pages fetched at the same time, overall and
+        # from any single host
+        self.max_connections = max_connections
+        self.max_host_connections = max_host_connections
+        self.download_workers = download_workers
+
+        # Links taken from the links to visit wait for their host to be free
+        # in a queue for each host. No more than max_memory_links wait at once
+        self.max_waiting_links = max_memory_links
+
+        # When streaming, images are handed to the downloader through a
+        # queue of max_queued_images as they are found instead of being kept,
+        # and no more than max_memory_links links, or image names and urls,
+        # are kept in memory. The rest go to a file at spill_path, or a
+        # temporary file, so memory stays flat however many pages are crawled
+        self.streaming = streaming
+        self.max_memory_links = max_memory_links
+        self.spill_file = None
+        self.image_queue = None
+        self.downloads = None
+        # The error that stopped the downloads, if one did
+        self.download_error = None
+        if streaming:
+            self.spill_file = SpillFile(spill_path)
+            self.image_queue = queue.Queue(maxsize=max_queued_images)
+
         # Initialise the collection of links to visit with the initial link
         # given by the user.
-        self.links_to_visit = [self.settings.get_user_url()]
+        self.links_to_visit = Frontier([self.settings.get_user_url()],
+                                       self.spill_file, max_memory_links)
         self.images = []     # The order of the images is irrelevant
+        # Index the file names and urls of the collected images so that
+        # duplicates are found without searching the whole list
+        if streaming:
+            self.image_names = SpillSet(self.spill_file, max_memory_links)
+            self.image_urls = SpillSet(self.spill_file, max_memory_links)
+        else:
+            self.image_names = set()
+            self.image_urls = set()
         self.total_unnamed_images = 0
         self.pages_visited = 0
 
@@ -92,25 +850,73 @@ class Crawler:
         """Visit the first link in the list of links to visit, remove it from
         the list, and call the functions necessary upon visitation"""
 
-        print("Visiting new page")
         can_visit = True
         # Return False if no more links can be visited, true if they can
         if len(self.links_to_visit) > 0:
-            url = self.links_to_visit.pop(0)
+            url = self.take_next_link()
             # Only visit valid link
             if url[:4] == "http":
-                page = Page(url)
-                page.collect_images(
-                    total_unnamed_image_count=self.total_unnamed_images)
-                self.total_unnamed_images += page.get_unnamed_images_on_page()
-                self.dump_data(page)
-                if page.get_could_visit():
-                    self.pages_visited += 1
+                logger.debug("Visiting %s", url)
+                self.process_page(Page(url, cache=self.cache,
+                                       client=self.client,
+                                       parser=self.parser,
+                                       metrics=self.metrics))
+                self.checkpoint_if_due()
+            else:
+                self.skip_link(url)
         else:
             can_visit = False
 
         return can_visit
 
+    def process_page(self, page):
+        """Collect the images of a page that has been fetched and update the
+        crawler with its data"""
+
+        page.collect_images(
+            total_unnamed_image_count=self.total_unnamed_images)
+        self.total_unnamed_images += page.get_unnamed_images_on_page()
+        with self.metrics.time_stage('dedup'):
+            self.dump_data(page)
+        if page.get_could_visit():
+            self.pages_visited += 1
+            self.metrics.increment('pages_visited')
+        else:
+            self.metrics.increment('pages_failed')
+        self.metrics.set_depth('frontier', len(self.links_to_visit))
+
+        if self.checkpoint_path is not None:
+            self.journal.append(
+                ["page", page.get_links(),
+                 [[image.image_url, image.alt_text,
+                   image.unnamed_image_count] for image in page.get_images()],
+                 page.get_unnamed_images_on_page(), page.get_could_visit(),
+                 page.url])
+
+    def take_next_link(self):
+        """Remove and return the first link to visit"""
+
+        if self.checkpoint_path is not None:
+            self.journal.append(["pop"])
+        return self.links_to_visit.pop()
+
+    def skip_link(self, url):
+        """Record that a link taken from the links to visit was passed over
+        without visiting its page"""
+
+        if self.checkpoint_path is not None:
+            self.journal.append(["skip", url])
+
+    def requeue_links(self, urls):
+        """Put links that were taken but not visited back at the front of the
+        links to visit"""
+
+        if not urls:
+            return
+        if self.checkpoint_path is not None:
+            self.journal.append(["requeue", urls])
+        self.links_to_visit.requeue(urls)
+
     def dump_data(self, page):
         """
         Take the data from a page and update the overall information held
@@ -118,50 +924,436 @@ class Crawler:
         """
 
         self.links_to_visit.extend(page.get_links())
-        # Only add the image to the list if none of the others have the same
-        # name
         for image in page.get_images():
-            already_added = False
-            for image_already_added in self.images:
-                if image_already_added.get_file_name() == \
-                        image.get_file_name():
-                    already_added = True
-            if not already_added:
-                self.images.append(image)
+            self.add_image(image)
+
+    def add_image(self, image):
+        """Add an image to the list of images unless one with the same file
+        name or url was added before. Return True if it was added. When
+        streaming, the image is queued for download instead, waiting while
+        the queue is full, so it must not be called on the event loop"""
+
+        if image.get_file_name() in self.image_names or \
+                image.get_image_url() in self.image_urls:
+            return False
+        self.image_names.add(image.get_file_name())
+        self.image_urls.add(image.get_image_url())
+        self.metrics.increment('images_found')
+        if self.streaming:
+            self.queue_image(image)
+            self.metrics.set_depth('image_queue', self.image_queue.qsize())
+        else:
+            self.images.append(image)
+        return True
+
+    def make_downloader(self, images):
+        # A streaming downloader keeps no more per-image state in memory
+        # than the crawl keeps links
+        max_memory_items = self.max_memory_links if self.streaming else None
+        return ImageDownloader(images, workers=self.download_workers,
+                               cache=self.cache, client=self.client,
+                               image_ready=self.image_ready,
+                               image_folder=self.image_folder,
+                               metrics=self.metrics,
+                               max_memory_items=max_memory_items)
+
+    def queue_image(self, image):
+        """Put an image, or the None that ends the downloads, on the image
+        queue, waiting while it is full. Raise RuntimeError if the downloads
+        have stopped, as the queue would never empty"""
+
+        while True:
+            try:
+                self.image_queue.put(image,
+                                     timeout=self.DOWNLOAD_CHECK_INTERVAL)
+                return
+            except queue.Full:
+                if not self.downloads.is_alive():
+                    raise RuntimeError("The image downloads stopped") \
+                        from self.download_error
+
+    def start_downloads(self):
+        """Start downloading the images put on the image queue while the
+        crawl goes on"""
+
+        downloader = self.make_downloader([])
+        self.downloads = threading.Thread(
+            target=self.download_queued, args=(downloader,), daemon=True)
+        self.downloads.start()
+
+    def download_queued(self, downloader):
+        """Download the images put on the image queue, keeping the error
+        that stops the downloads, if any, for the crawl to raise"""
+
+        try:
+            downloader.download_queued(self.image_queue)
+        except Exception as error:
+            self.download_error = error
+
+    def finish_downloads(self):
+        """Wait for the queued images to be downloaded. Raise RuntimeError if
+        the downloads stopped before they were done"""
+
+        if self.download_error is None:
+            self.queue_image(None)
+        self.downloads.join()
+        if self.download_error is not None:
+            raise RuntimeError("The image downloads stopped") \
+                from self.download_error
 
     def download_all_images(self):
         """Download all of the images on a page through the use of the image
         downloader
         """
 
-        downloader = ImageDownloader(self.images)
-        downloader.run()
+        self.make_downloader(self.images).run()
 
     def visit_multiple_pages(self):
         """Visit multiple pages and collect the information from each of them
         """
 
-        while self.pages_visited < self.settings.get_user_page_lim():
-            # Stop visiting pages if links to visit runs out
-            if not self.visit_next_page():
-                break
+        asyncio.run(self.crawl_pages())
+
+    async def crawl_pages(self):
+        """Fetch pages concurrently until the page limit is reached or the
+        links to visit run out.
+
+        Links are taken from the links to visit into a queue for each host.
+        A host's next link is fetched as soon as the host has a connection
+        free and its turn has come, so a host that is slow, or that asked to
+        be left alone, does not hold up the others. The pages of each host
+        are processed in the order their links were taken. A crawl of one
+        site therefore collects the same images as one that visits a page at
+        a time, unless the site asks for a page to be tried again. The pages
+        of different hosts are processed as they arrive.
+        """
+
+        loop = asyncio.get_running_loop()
+        page_lim = self.settings.get_user_page_lim()
+        waiting = HostQueues()
+        # The fetches started for each host, in order, until their pages are
+        # processed
+        started = {}
+        fetching = set()
+        attempts = {}
+        outstanding = 0
+
+        async def fetch_page(url, start):
+            if start is None:
+                # The host's robots.txt is read before its first turn is
+                # booked, so that its Crawl-delay applies from the start
+                if not await loop.run_in_executor(
+                        executor, self.scheduler.can_fetch, url):
+                    logger.debug("%s is disallowed by robots.txt", url)
+                    return None, False
+                start = self.scheduler.book_turn(url)
+            delay = start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            begin = loop.time()
+            page = await loop.run_in_executor(
+                executor, Page, url, self.cache, self.client, self.parser,
+                self.metrics)
+            retry = self.scheduler.record_response(
+                url, loop.time() - begin, page.status, page.retry_after)
+            return page, retry
+
+        def can_start():
+            return len(fetching) < self.max_connections and \
+                self.pages_visited + outstanding < page_lim
+
+        def start_fetch(host, number, url):
+            """Start fetching a page if its host is free. Return False if it
+            has to wait"""
+
+            nonlocal outstanding
+            host_fetches = started.setdefault(host, deque())
+            if len(host_fetches) >= self.max_host_connections:
+                return False
+            if self.scheduler.knows_host(url):
+                if not self.scheduler.can_fetch(url):
+                    logger.debug("%s is disallowed by robots.txt", url)
+                    self.skip_link(url)
+                    return True
+                start = self.scheduler.book_turn(url, self.MAX_TURN_WAIT)
+                if start is None:
+                    return False
+            elif host_fetches:
+                # Wait for the host's robots.txt to be read by its first page
+                return False
+            else:
+                start = None
+
+            logger.debug("Visiting %s", url)
+            task = loop.create_task(fetch_page(url, start))
+            host_fetches.append((task, number, url))
+            fetching.add(task)
+            outstanding += 1
+            return True
+
+        def start_fetches():
+            """Start fetching waiting links, then links to visit, while
+            connections are free and pages are still needed"""
+
+            for host in waiting.get_hosts():
+                while can_start() and waiting.has_links(host) and \
+                        start_fetch(host, *waiting.peek(host)):
+                    waiting.pop(host)
+            while can_start() and self.links_to_visit and \
+                    len(waiting) < self.max_waiting_links:
+                url = self.take_next_link()
+                # Only visit valid link
+                if url[:4] != "http":
+                    self.skip_link(url)
+                    continue
+                host = urlparse(url).netloc
+                number = waiting.number_link()
+                # Links of a host with links waiting go behind them
+                if waiting.has_links(host) or \
+                        not start_fetch(host, number, url):
+                    waiting.add(host, number, url)
+            self.metrics.set_depth('host_queues', len(waiting))
+
+        def find_wait():
+            """Return the seconds until a waiting host's turn comes, or None
+            if no waiting link could be started then"""
+
+            if not can_start():
+                return None
+            waits = [self.scheduler.get_wait(waiting.peek(host)[1]) for host
+                     in waiting.get_hosts()
+                     if len(started.get(host, ())) <
+                     self.max_host_connections and
+                     self.scheduler.knows_host(waiting.peek(host)[1])]
+            return min(waits) if waits else None
+
+        async def process_fetched(host):
+            """Process the host's pages that have been fetched, in the order
+            their fetches were started"""
+
+            nonlocal outstanding
+            host_fetches = started[host]
+            while host_fetches and host_fetches[0][0].done():
+                task, number, url = host_fetches.popleft()
+                outstanding -= 1
+                page, retry = task.result()
+                if page is None:
+                    self.skip_link(url)
+                elif retry and attempts.get(url, 0) < self.max_retries:
+                    # The host asked to be left alone for a while, so the
+                    # page waits for its next turn
+                    attempts[url] = attempts.get(url, 0) + 1
+                    waiting.put_back(host, number, url)
+                else:
+                    attempts.pop(url, None)
+                    if self.streaming:
+                        # Processing waits while the image queue is full, so
+                        # it runs off the event loop, which keeps the fetches
+                        # under way and the turns of the hosts going
+                        await loop.run_in_executor(None, self.process_page,
+                                                   page)
+                    else:
+                        self.process_page(page)
+                    self.checkpoint_if_due()
+            if not host_fetches:
+                del started[host]
+
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            while True:
+                start_fetches()
+                if not fetching:
+                    # Stop when no more pages are needed or no links are left
+                    wait = find_wait()
+                    if wait is None:
+                        break
+                    await asyncio.sleep(wait)
+                    continue
+                done, pending = await asyncio.wait(
+                    fetching, timeout=find_wait(),
+                    return_when=asyncio.FIRST_COMPLETED)
+                fetching.difference_update(done)
+                for host in list(started):
+                    await process_fetched(host)
+
+        # Links still waiting for their host go back to the links to visit
+        self.requeue_links(waiting.take_all())
+
+    def checkpoint_if_due(self):
+        """Save the crawl state if enough pages were visited since the last
+        checkpoint"""
+
+        if self.checkpoint_path is None:
+            return
+        if self.pages_visited - self.checkpoint_pages_visited >= \
+                self.checkpoint_interval:
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        """Append the links taken and pages processed since the last
+        checkpoint to the checkpoint file.
+
+        The file is a series of gzipped json lines that replay the crawl, so
+        each checkpoint only writes what changed. Every checkpoint ends with
+        a marker line, and a resumed crawl ignores anything after the last
+        marker, such as a checkpoint cut off part way through.
+        """
+
+        if self.checkpoint_started:
+            mode = 'at'
+        else:
+            # Start a new file for a crawl that was not resumed
+            mode = 'wt'
+            self.journal.insert(0, ["start", self.initial_page])
+            self.checkpoint_started = True
+        self.journal.append(["checkpoint"])
+
+        with gzip.open(self.checkpoint_path, mode,
+                       compresslevel=1) as checkpoint_file:
+            checkpoint_file.writelines(json.dumps(record,
+                                                  separators=(',', ':')) +
+                                       '\n' for record in self.journal)
+        self.journal = []
+        self.checkpoint_pages_visited = self.pages_visited
+
+    def read_checkpoint(self):
+        """Return the records of the checkpoint file up to its last complete
+        checkpoint"""
+
+        records = []
+        pending = []
+        try:
+            with gzip.open(self.checkpoint_path, 'rt') as checkpoint_file:
+                for line in checkpoint_file:
+                    record = json.loads(line)
+                    if record[0] == "checkpoint":
+                        records.extend(pending)
+                        pending = []
+                    else:
+                        pending.append(record)
+        except (EOFError, OSError, ValueError):
+            # The last checkpoint was not written completely
+            pass
+
+        return records
+
+    def resume(self):
+        """Replay the checkpoint file to restore the crawl state. Return True
+        if the crawl was resumed, or False if there is no checkpoint for the
+        same starting url"""
+
+        if self.checkpoint_path is None or \
+                not os.path.exists(self.checkpoint_path):
+            return False
+        records = self.read_checkpoint()
+        if not records or records[0] != ["start", self.initial_page]:
+            return False
+
+        # Links taken from the links to visit whose pages were not processed
+        # yet, in the order they were taken
+        taken = OrderedDict()
+        for record in records[1:]:
+            if record[0] == "pop":
+                taken[self.links_to_visit.pop()] = None
+                continue
+            if record[0] == "skip":
+                taken.pop(record[1], None)
+                continue
+            if record[0] == "requeue":
+                for url in record[1]:
+                    taken.pop(url, None)
+                self.links_to_visit.requeue(record[1])
+                continue
+            links, images, unnamed_images, could_visit = record[1:5]
+            # Pages were once recorded without their url, when they were
+            # always processed in the order their links were taken
+            url = record[5] if len(record) > 5 else next(iter(taken), None)
+            taken.pop(url, None)
+            self.total_unnamed_images += unnamed_images
+            self.links_to_visit.extend(links)
+            for image_url, alt_text, unnamed_image_count in images:
+                self.add_image(ImageData(
+                    image_url=image_url, alt_text=alt_text,
+                    unnamed_image_count=unnamed_image_count))
+            if could_visit:
+                self.pages_visited += 1
+        # Pages that were being fetched when the checkpoint was saved are
+        # fetched again
+        self.requeue_links(list(taken))
+
+        self.checkpoint_pages_visited = self.pages_visited
+        self.checkpoint_started = True
+        logger.info("Resuming crawl after %d pages", self.pages_visited)
+        return True
+
+    def remove_checkpoint(self):
+        """Delete the checkpoint file once the crawl has finished"""
+
+        if self.checkpoint_path is not None and \
+                os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
 
     def run(self):
         """Run the necessary functions for the crawler to finish its job"""
 
-        self.visit_multiple_pages()
-        self.download_all_images()
+        if self.streaming:
+            # Images found again while resuming are downloaded again too
+            self.start_downloads()
+            try:
+                self.resume()
+                self.visit_multiple_pages()
+            finally:
+                try:
+                    self.finish_downloads()
+                finally:
+                    self.spill_file.close()
+        else:
+            self.resume()
+            self.visit_multiple_pages()
+        if self.checkpoint_path is not None:
+            # Record the finished crawl so that a failed download phase does
+            # not visit the pages again
+            self.save_checkpoint()
+        if not self.streaming:
+            self.download_all_images()
+        if self.cache is not None:
+            self.cache.save()
+            self.cache.report()
+        self.client.report()
+        self.scheduler.report()
+        self.remove_checkpoint()
 
 
 class Page:
     """Store the information of a single page"""
 
-    def __init__(self, url):
+    __slots__ = ('url', 'cache', 'client', 'metrics', 'parser',
+                 'unnamed_images_on_page', 'url_base', 'could_visit',
+                 'status', 'retry_after', 'hrefs', 'image_tags', 'images')
+
+    def __init__(self, url, cache=None, client=None, parser=DEFAULT_PARSER,
+                 metrics=None):
         self.url = url
+        self.cache = cache
+        self.client = client
+        self.metrics = metrics if metrics is not None else shared_metrics
+        # The name of the function in PARSERS used to read the page
+        self.parser = parser
         self.unnamed_images_on_page = 0
         self.url_base = self.get_url_base()
-        self.links = self.collect_links()
         self.could_visit = True
+        # The status the server answered with, or None if it could not be
+        # reached, and how long it asked to be left alone for if it was too
+        # busy
+        self.status = 200
+        self.retry_after = None
+
+        # The page is downloaded and parsed a single time. The hrefs and the
+        # image tags are kept from that one pass for both collection methods.
+        # Absolute links are only made when asked for, so a page waiting in a
+        # batch holds one list of its links rather than two
+        self.hrefs = []
+        self.image_tags = []
+        self.read_page()
 
         # Hold images as blank list until the method is called so that the
         # number of unnamed images can be passed in
@@ -178,33 +1370,48 @@ class Page:
 
         return main_website_url
 
-    def collect_links(self):
-        """Collect all links from a page"""
+    def read_page(self):
+        """Download and parse the page once, keeping the hrefs of its links
+        and the src and alt text of its images"""
 
-        page_request = request.Request(self.url)
         try:
-            response = request.urlopen(page_request)
+            with self.metrics.time_stage('fetch'):
+                response = open_url(self.url, cache=self.cache,
+                                    client=self.client)
 
-        except urllib.error.HTTPError:
-            print("A page was unreachable")
+        except urllib.error.HTTPError as http_error:
+            logger.warning("%s was unreachable: HTTP %d", self.url,
+                           http_error.code)
             self.could_visit = False
+            self.status = http_error.code
+            self.retry_after = http_error.headers["Retry-After"]
+            response = ""
+        except urllib.error.URLError as url_error:
+            # The server could not be reached at all, so there is no status
+            logger.warning("%s was unreachable: %s", self.url,
+                           url_error.reason)
+            self.could_visit = False
+            self.status = None
             response = ""
 
-        # Specify the parser to use
-        soup = BeautifulSoup(response, "html.parser")
-
-        # Grab all of the links with BeautifulSoup and only keep the ones with
-        # "www." to ensure that self-referencing links are not collected
-        # links = {link['href'] for link in soup.findAll('a')}
+        # The body is read as it is parsed, so parsing includes its transfer
+        try:
+            with self.metrics.time_stage('parse'):
+                self.hrefs, self.image_tags = PARSERS[self.parser](response)
+        except (OSError, http.client.HTTPException) as reason:
+            logger.warning("%s could not be read: %s", self.url, reason)
+            self.could_visit = False
+        finally:
+            if response:
+                # Closing the response lets the cache keep the page it read.
+                # A body that was not read to the end is not kept
+                response.close()
 
-        links = []
-        for link in soup.findAll('a'):
-            try:
-                links.append(link['href'])
-            except KeyError:
-                pass
+    def collect_links(self):
+        """Collect all links from a page"""
 
-        abs_links = [self.verify_abs_url(test_url=link) for link in links]
+        abs_links = [self.verify_abs_url(test_url=link) for link in
+                     self.hrefs]
         legit_links = list(filter(verify_real_url, abs_links))
 
         return legit_links
@@ -214,30 +1421,17 @@ class Page:
         ImageData object
         """
         current_unnamed_image_count = total_unnamed_image_count
-        page_request = urllib.request.Request(self.url)
-        try:
-            response = urllib.request.urlopen(page_request)
-        except urllib.error.HTTPError:
-            self.could_visit = False
-            print("Some images were unreachable")
-            response = ""
-
-        # Specify the parser to use
-        soup = BeautifulSoup(response, "html.parser")
 
         images = []
 
         # Keep a count of the images with no designated file name
 
-        for img in soup.findAll('img'):
-            temp = img.get('src')
-
-            image_url = self.verify_abs_url(test_url=temp)
+        for src, image_alt_text in self.image_tags:
+            image_url = self.verify_abs_url(test_url=src)
 
             # If the link is not a normal link, forget it
             if image_url[:4] != "http":
                 continue
-            image_alt_text = str(img.get("alt"))
             image = ImageData(image_url=image_url, alt_text=image_alt_text,
                               unnamed_image_count=current_unnamed_image_count)
             if image.is_unnamed():
@@ -252,14 +1446,14 @@ class Page:
         return it
         """
 
-        abs_img_url = urljoin(self.get_url_base(), test_url)
+        abs_img_url = urljoin(self.url_base, test_url)
 
         return abs_img_url
 
     def get_links(self):
         """Return the set of all links on the page"""
 
-        return self.links
+        return self.collect_links()
 
     def get_images(self):
         """Return the set of all images on the page"""
@@ -278,7 +1472,13 @@ class Page:
 
 
 class ImageData:
-    """Contain the information related to a single image"""
+    """Contain the information related to a single image.
+
+    A crawl can hold millions of images, so they keep their fields in slots
+    rather than a dictionary of their own
+    """
+
+    __slots__ = ('image_url', 'alt_text', 'unnamed_image_count', 'file_name')
 
     def __init__(self, image_url, alt_text, unnamed_image_count):
         self.image_url = image_url
@@ -298,6 +1498,19 @@ class ImageData:
 
         return file_name
 
+    def __eq__(self, other):
+        if not isinstance(other, ImageData):
+            return NotImplemented
+        return (self.image_url, self.alt_text, self.unnamed_image_count) == \
+            (other.image_url, other.alt_text, other.unnamed_image_count)
+
+    def __hash__(self):
+        return hash((self.image_url, self.alt_text, self.unnamed_image_count))
+
+    def __repr__(self):
+        return "ImageData({!r}, {!r}, {!r})".format(
+            self.image_url, self.alt_text, self.unnamed_image_count)
+
     def get_image_url(self):
         """Return the absolute url that the image can be found at"""
 
@@ -344,7 +1557,7 @@ class Directory:
     def clear_dir(self):
         """Empty the directory"""
 
-        print("Clearing directory")
+        logger.debug("Clearing %s", self.path)
         file_names = [name for name in os.listdir(self.path) if
                       os.path.isfile(os.path.join(self.path, name))]
 
@@ -359,14 +1572,1018 @@ class Directory:
         return self.path
 
 
+class PooledResponse:
+    """Wrap a response read over a pooled connection. The connection goes
+    back to its pool once the body has been read to the end and the response
+    is closed. A response closed early has the rest of its body read first
+    if its Content-Length leaves no more than MAX_DRAIN bytes, and its
+    connection is discarded otherwise"""
+
+    MAX_DRAIN = 64 * 1024
+
+    def __init__(self, client, key, connection, response):
+        self.client = client
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.headers = response.msg
+        self.complete = False
+        self.closed = False
+
+        # Decode compressed bodies as they are read
+        self.decoder = client.make_decoder(
+            response.getheader("Content-Encoding"))
+        self.decoded = b''
+        if self.decoder is not None:
+            # The length given is that of the compressed body, so it is left
+            # out along with the encoding
+            self.headers = Message()
+            for name, value in response.msg.items():
+                if name.lower() not in ("content-length",
+                                        "content-encoding"):
+                    self.headers[name] = value
+
+    def read(self, size=-1):
+        if self.decoder is None:
+            data = self.response.read() if size is None or size < 0 else \
+                self.response.read(size)
+            if size is None or size < 0 or not data:
+                self.complete = True
+            self.client.metrics.increment('bytes_fetched', len(data))
+            return data
+
+        while not self.complete and (size is None or size < 0 or
+                                     len(self.decoded) < size):
+            raw = self.response.read(CHUNK_SIZE)
+            if raw:
+                self.client.metrics.increment('bytes_fetched', len(raw))
+                self.decoded += self.decoder.decompress(raw)
+            else:
+                self.decoded += self.decoder.flush()
+                self.complete = True
+
+        if size is None or size < 0:
+            size = len(self.decoded)
+        data, self.decoded = self.decoded[:size], self.decoded[size:]
+        return data
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.response.status
+
+    def drain(self):
+        """Read the rest of a body that was not read to the end, if it is
+        short enough, so that the connection can be used again"""
+
+        remaining = self.response.length
+        if remaining is None or remaining > self.MAX_DRAIN:
+            return
+        try:
+            while True:
+                data = self.response.read(CHUNK_SIZE)
+                if not data:
+                    break
+                self.client.metrics.increment('bytes_fetched', len(data))
+        except (OSError, http.client.HTTPException):
+            return
+        self.complete = True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.complete and not self.response.will_close:
+            self.drain()
+        reusable = self.complete and not self.response.will_close
+        self.response.close()
+        self.client.release(self.key, self.connection, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BrotliDecoder:
+    """Give a brotli decompressor the same methods as a zlib one"""
+
+    def __init__(self):
+        self.decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self.decompressor.process(data)
+
+    def flush(self):
+        return b''
+
+
+class HttpClient:
+    """Fetch urls over persistent connections, keeping a pool of idle
+    connections for each host.
+
+    Responses follow redirects and raise urllib.error.HTTPError for other
+    error statuses, like urllib.request.urlopen. Compressed bodies are
+    decoded when decode_content is True. The share of requests made over a
+    reused connection and the latency of each host are kept as stats.
+
+    Requests go through the proxies given as a scheme to proxy url map, or
+    by default those in the http_proxy, https_proxy and no_proxy
+    environment variables, as with urlopen. Https urls are tunnelled
+    through the proxy with CONNECT.
+    """
+
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+    MAX_REDIRECTS = 10
+
+    def __init__(self, max_idle_per_host=8, timeout=30, decode_content=True,
+                 metrics=None, proxies=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.proxies = urllib.request.getproxies() if proxies is None else \
+            proxies
+        # The bytes received over the network are counted here
+        self.metrics = metrics if metrics is not None else shared_metrics
+        self.timeout = timeout
+        self.decode_content = decode_content
+        self.lock = threading.Lock()
+        # Map each (scheme, host, port) to its idle connections
+        self.pools = {}
+
+        self.requests_made = 0
+        self.connections_reused = 0
+        # Map each host to its total response time and number of requests
+        self.host_latencies = {}
+
+    def get_accept_encoding(self):
+        """Return the encodings the client asks servers to use"""
+
+        if not self.decode_content:
+            return "identity"
+        return "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+    def make_decoder(self, content_encoding):
+        """Return a decoder for a body with the given Content-Encoding, or
+        None if the body is read as it is"""
+
+        if not self.decode_content or content_encoding is None:
+            return None
+        content_encoding = content_encoding.strip().lower()
+        if content_encoding == "gzip":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if content_encoding == "deflate":
+            return zlib.decompressobj()
+        if content_encoding == "br" and brotli is not None:
+            return BrotliDecoder()
+        return None
+
+    def find_proxy(self, scheme, host):
+        """Return the parts of the url of the proxy that requests to the host
+        go through, or None if they go straight to it"""
+
+        proxy = self.proxies.get(scheme)
+        if not proxy or \
+                urllib.request.proxy_bypass_environment(host, self.proxies):
+            return None
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        return urlsplit(proxy)
+
+    @staticmethod
+    def get_proxy_headers(proxy):
+        """Return the headers that authenticate with a proxy"""
+
+        if proxy.username is None:
+            return {}
+        credentials = "{}:{}".format(urllib.parse.unquote(proxy.username),
+                                     urllib.parse.unquote(proxy.password or
+                                                          ""))
+        return {"Proxy-Authorization": "Basic " + base64.b64encode(
+            credentials.encode("utf-8")).decode("ascii")}
+
+    def acquire(self, key):
+        """Return an idle connection for the key and whether it was reused,
+        making a new connection if none is idle"""
+
+        with self.lock:
+            idle = self.pools.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+        proxy = self.find_proxy(scheme, host)
+        if proxy is not None:
+            # Connections to a proxy are still pooled by the host they
+            # reach, since a tunnel only leads to one host
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(
+                    proxy.hostname, proxy.port or 80, timeout=self.timeout)
+                connection.set_tunnel(host, port,
+                                      headers=self.get_proxy_headers(proxy))
+            else:
+                connection = http.client.HTTPConnection(
+                    proxy.hostname, proxy.port or 80, timeout=self.timeout)
+        elif scheme == "https":
+            connection = http.client.HTTPSConnection(host, port,
+                                                     timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port,
+                                                    timeout=self.timeout)
+        return connection, False
+
+    def release(self, key, connection, reusable):
+        """Return a connection to its pool, or close it if it cannot be used
+        again or the pool is full"""
+
+        if reusable:
+            with self.lock:
+                idle = self.pools.setdefault(key, [])
+                if len(idle) < self.max_idle_per_host:
+                    idle.append(connection)
+                    return
+        connection.close()
+
+    def send(self, url, headers):
+        """Send a GET request for the url and return the pooled response"""
+
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError("unknown url type: " + scheme)
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        request_headers = {"Host": parts.netloc,
+                           "Accept-Encoding": self.get_accept_encoding(),
+                           "User-Agent": USER_AGENT}
+        proxy = self.find_proxy(scheme, parts.hostname)
+        if proxy is not None and scheme == "http":
+            # A proxy is asked for the whole url rather than the path
+            path = urlunsplit((scheme, parts.netloc, parts.path or "/",
+                               parts.query, ""))
+            request_headers.update(self.get_proxy_headers(proxy))
+        request_headers.update(headers)
+
+        connection, reused = self.acquire(key)
+        start = time.perf_counter()
+        try:
+            try:
+                connection.request("GET", path, headers=request_headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                if not reused:
+                    raise
+                # The server closed the idle connection, so try a new one
+                connection.close()
+                connection, reused = self.acquire(key)
+                start = time.perf_counter()
+                connection.request("GET", path, headers=request_headers)
+                response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as reason:
+            connection.close()
+            raise urllib.error.URLError(reason)
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            self.requests_made += 1
+            if reused:
+                self.connections_reused += 1
+            total, count = self.host_latencies.get(parts.netloc, (0.0, 0))
+            self.host_latencies[parts.netloc] = (total + latency, count + 1)
+
+        return PooledResponse(self, key, connection, response)
+
+    def open(self, url, headers=None):
+        """Return a response for the url, following redirects. Error
+        statuses, including 304 Not Modified, raise HTTPError"""
+
+        headers = dict(headers or {})
+        for redirect in range(self.MAX_REDIRECTS + 1):
+            response = self.send(url, headers)
+            status = response.getcode()
+            if status < 300:
+                return response
+
+            # Read the body so that the connection can be used again
+            body = response.read()
+            response.close()
+            location = response.info()["Location"]
+            if status in self.REDIRECT_CODES and location:
+                url = urljoin(url, location)
+                continue
+            raise urllib.error.HTTPError(url, status, response.response.reason,
+                                         response.info(), io.BytesIO(body))
+
+        raise urllib.error.HTTPError(url, status, "Too many redirects",
+                                     response.info(), io.BytesIO(b''))
+
+    def get_reuse_ratio(self):
+        """Return the share of requests made over a reused connection"""
+
+        with self.lock:
+            if not self.requests_made:
+                return 0.0
+            return self.connections_reused / self.requests_made
+
+    def get_host_latencies(self):
+        """Return the mean time in seconds each host took to respond"""
+
+        with self.lock:
+            return {host: total / count for host, (total, count) in
+                    self.host_latencies.items()}
+
+    def report(self):
+        """Log how often connections were reused and how quickly each host
+        responded"""
+
+        logger.info("Connections: %d requests, %.0f%% over a reused "
+                    "connection", self.requests_made,
+                    self.get_reuse_ratio() * 100)
+        for host, latency in sorted(self.get_host_latencies().items()):
+            logger.info("  %s: %.0f ms", host, latency * 1000)
+
+
+# Used for fetches that are not given a client of their own
+shared_client = HttpClient()
+
+
+class CachedResponse:
+    """Stand in for a response whose body is read from the cache"""
+
+    def __init__(self, body_path, headers):
+        self.body_file = open(body_path, 'rb')
+        self.headers = Message()
+        for name, value in headers.items():
+            self.headers[name] = value
+
+    def read(self, size=-1):
+        return self.body_file.read(size)
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        self.body_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CachingResponse:
+    """Wrap a response so that its body is copied into the cache as it is
+    read. The copy is only kept if the whole body was read"""
+
+    def __init__(self, cache, url, response):
+        self.cache = cache
+        self.url = url
+        self.response = response
+        self.temp_fd, self.temp_path = tempfile.mkstemp(
+            dir=cache.folder.get_path(), suffix='.tmp')
+        self.temp_file = os.fdopen(self.temp_fd, 'wb')
+        self.complete = False
+        self.closed = False
+
+    def read(self, size=-1):
+        data = self.response.read(size)
+        self.temp_file.write(data)
+        if size is None or size < 0 or not data:
+            self.complete = True
+        return data
+
+    def info(self):
+        return self.response.info()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.response.close()
+        self.temp_file.close()
+        if self.complete:
+            self.cache.store(self.url, self.response.info(), self.temp_path)
+        else:
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HttpCache:
+    """Keep the pages and images fetched on disk between runs.
+
+    Stored responses are revalidated with If-None-Match and
+    If-Modified-Since, and served from disk when the server answers 304 Not
+    Modified. Only responses with an ETag or Last-Modified header are kept.
+    Once the bodies held pass max_size bytes, the least recently used ones
+    are evicted.
+
+    Responses whose bodies are kept elsewhere, such as images in an
+    ImageStore, are opened with open_validated. Only their validators and
+    the checksum of their body are kept here, for no more than
+    max_validators urls, dropping the least recently used ones.
+    """
+
+    # Headers that are stored along with the body of a response
+    KEPT_HEADERS = ("ETag", "Last-Modified", "Content-Type")
+
+    def __init__(self, path='./cache', max_size=256 * 1024 * 1024,
+                 client=None, max_validators=100000):
+        self.folder = Directory(path)
+        self.client = client if client is not None else shared_client
+        self.index_path = os.path.join(path, 'index.json')
+        self.validators_path = os.path.join(path, 'validators.json')
+        self.max_size = max_size
+        self.max_validators = max_validators
+        self.lock = threading.Lock()
+
+        # Map each url to its stored headers and size, least recently used
+        # first
+        self.entries = OrderedDict()
+        self.total_size = 0
+        # Map each url whose body is kept elsewhere to its stored headers
+        # and the checksum and size of its body, least recently used first
+        self.validators = OrderedDict()
+        self.load()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self):
+        """Read the index of stored responses, dropping any whose body is
+        missing and deleting any body that is not in the index"""
+
+        try:
+            with open(self.index_path) as index_file:
+                entries = json.load(index_file)
+        except (OSError, ValueError):
+            entries = []
+
+        for url, headers, size in entries:
+            if os.path.exists(self.find_body_path(url)):
+                self.entries[url] = (headers, size)
+                self.total_size += size
+        self.remove_unindexed()
+
+        try:
+            with open(self.validators_path) as validators_file:
+                validators = json.load(validators_file)
+        except (OSError, ValueError):
+            validators = []
+        for url, headers, checksum, size in validators[-self.max_validators:]:
+            self.validators[url] = (headers, checksum, size)
+
+    def remove_unindexed(self):
+        """Delete the bodies, and the partly written files, that a run which
+        stopped before saving the index left behind. Nothing would ever evict
+        them, so the cache would grow past max_size"""
+
+        kept = {os.path.basename(self.find_body_path(url)) for url in
+                self.entries}
+        kept.update([os.path.basename(self.index_path),
+                     os.path.basename(self.validators_path)])
+        folder = self.folder.get_path()
+        for name in os.listdir(folder):
+            if name not in kept:
+                os.remove(os.path.join(folder, name))
+
+    def save(self):
+        """Write the index of stored responses to disk"""
+
+        # Hold the lock throughout so that crawls sharing the cache do not
+        # write the index at the same time
+        with self.lock:
+            entries = [[url, headers, size] for url, (headers, size) in
+                       self.entries.items()]
+            validators = [[url, headers, checksum, size] for
+                          url, (headers, checksum, size) in
+                          self.validators.items()]
+            for path, records in [(self.index_path, entries),
+                                  (self.validators_path, validators)]:
+                temp_path = path + '.tmp'
+                with open(temp_path, 'w') as index_file:
+                    json.dump(records, index_file)
+                os.replace(temp_path, path)
+
+    def find_body_path(self, url):
+        """Return the path the body of the response for a url is kept at"""
+
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder.get_path(), key)
+
+    def open(self, url):
+        """Return a response for the url, served from disk if the stored copy
+        is still current. Errors other than 304 Not Modified are raised"""
+
+        conditions = {}
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry is not None:
+            headers = entry[0]
+            if "ETag" in headers:
+                conditions["If-None-Match"] = headers["ETag"]
+            if "Last-Modified" in headers:
+                conditions["If-Modified-Since"] = headers["Last-Modified"]
+
+        try:
+            response = self.client.open(url, headers=conditions)
+        except urllib.error.HTTPError as http_error:
+            if http_error.code != 304 or entry is None:
+                raise
+            http_error.close()
+            stored = self.open_stored(url)
+            if stored is not None:
+                return stored
+            # The stored copy was evicted while the request was made
+            response = self.client.open(url)
+
+        with self.lock:
+            self.misses += 1
+        if response.info()["ETag"] is None and \
+                response.info()["Last-Modified"] is None:
+            return response
+        return CachingResponse(self, url, response)
+
+    def open_validated(self, url, is_kept):
+        """Open a url whose body is kept outside the cache. Return the
+        response and None, or None and the checksum and size recorded with
+        record_kept if the server answers 304 Not Modified, in which case the
+        body is not sent again. is_kept is called with a checksum and
+        returns whether that body is still kept. Errors other than 304 Not
+        Modified are raised"""
+
+        conditions = {}
+        with self.lock:
+            entry = self.validators.get(url)
+        if entry is not None and is_kept(entry[1]):
+            headers = entry[0]
+            if "ETag" in headers:
+                conditions["If-None-Match"] = headers["ETag"]
+            if "Last-Modified" in headers:
+                conditions["If-Modified-Since"] = headers["Last-Modified"]
+
+        try:
+            response = self.client.open(url, headers=conditions)
+        except urllib.error.HTTPError as http_error:
+            if http_error.code != 304 or not conditions:
+                raise
+            http_error.close()
+            with self.lock:
+                self.hits += 1
+                if url in self.validators:
+                    self.validators.move_to_end(url)
+            return None, entry[1:]
+
+        with self.lock:
+            self.misses += 1
+        return response, None
+
+    def record_kept(self, url, headers, checksum, size):
+        """Keep the validators of a response whose body is kept elsewhere
+        under the given checksum, so that it can be revalidated by
+        open_validated. Any body stored for the url is dropped"""
+
+        kept_headers = {name: headers[name] for name in self.KEPT_HEADERS
+                        if headers[name] is not None}
+        if "ETag" not in kept_headers and "Last-Modified" not in kept_headers:
+            return
+
+        with self.lock:
+            self.validators[url] = (kept_headers, checksum, size)
+            self.validators.move_to_end(url)
+            if len(self.validators) > self.max_validators:
+                self.validators.popitem(last=False)
+            if url in self.entries:
+                self.total_size -= self.entries.pop(url)[1]
+                os.remove(self.find_body_path(url))
+
+    def open_stored(self, url):
+        """Return the stored response for a url, marking it as the most
+        recently used. Return None if it is no longer stored"""
+
+        with self.lock:
+            if url not in self.entries:
+                return None
+            self.hits += 1
+            self.entries.move_to_end(url)
+            headers, size = self.entries[url]
+        headers = dict(headers, **{"Content-Length": str(size)})
+        return CachedResponse(self.find_body_path(url), headers)
+
+    def store(self, url, headers, temp_path):
+        """Keep the body at temp_path as the stored response for a url, then
+        evict the least recently used responses until the cache fits"""
+
+        size = os.path.getsize(temp_path)
+        if size > self.max_size:
+            os.remove(temp_path)
+            return
+        kept_headers = {name: headers[name] for name in self.KEPT_HEADERS
+                        if headers[name] is not None}
+
+        with self.lock:
+            os.replace(temp_path, self.find_body_path(url))
+            if url in self.entries:
+                self.total_size -= self.entries[url][1]
+            self.entries[url] = (kept_headers, size)
+            self.entries.move_to_end(url)
+            self.total_size += size
+
+            while self.total_size > self.max_size:
+                old_url, (old_headers, old_size) = self.entries.popitem(
+                    last=False)
+                self.total_size -= old_size
+                self.evictions += 1
+                os.remove(self.find_body_path(old_url))
+
+    def report(self):
+        """Log how well the cache did during the run"""
+
+        logger.info("Cache: %d hits, %d misses, %d evicted, %.2f MB held",
+                    self.hits, self.misses, self.evictions,
+                    self.total_size / (1024 * 1024))
+
+
+def load_hash_pixels(image_path, width, height):
+    """Return the image at image_path in greyscale, shrunk to the given
+    size, as rows of pixel values"""
+
+    with Image.open(image_path) as image:
+        # JPEGs are decoded at a fraction of their size when only a few
+        # pixels are wanted
+        image.draft('L', (width * 4, height * 4))
+        image = image.convert('L').resize((width, height), Image.BOX)
+        if numpy is not None:
+            return numpy.asarray(image, dtype=numpy.float32)
+        pixels = list(image.tobytes())
+        return [pixels[row * width:(row + 1) * width]
+                for row in range(height)]
+
+
+def pack_bits(bits):
+    """Return the int whose binary digits are the given truth values, the
+    first being the most significant"""
+
+    if numpy is not None:
+        return int.from_bytes(numpy.packbits(bits).tobytes(), 'big') >> \
+            (-len(bits) % 8)
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bool(bit)
+    return value
+
+
+def find_dhash(image_path, hash_size=8):
+    """Return the difference hash of an image: one bit for each pair of
+    horizontally neighbouring pixels in a small greyscale copy, set where the
+    left pixel is brighter"""
+
+    pixels = load_hash_pixels(image_path, hash_size + 1, hash_size)
+    if numpy is not None:
+        return pack_bits((pixels[:, :-1] > pixels[:, 1:]).ravel())
+    return pack_bits([row[i] > row[i + 1] for row in pixels
+                      for i in range(hash_size)])
+
+
+def make_dct_matrix(size):
+    """Return the matrix that takes the type II discrete cosine transform of
+    a vector of the given size"""
+
+    k = numpy.arange(size).reshape(-1, 1)
+    n = numpy.arange(size).reshape(1, -1)
+    return numpy.cos(numpy.pi * (2 * n + 1) * k / (2 * size))
+
+
+def find_phash(image_path, hash_size=8, scale=4):
+    """Return the perceptual hash of an image: one bit for each of the
+    lowest frequencies of a small greyscale copy, set where the frequency is
+    stronger than their median"""
+
+    if numpy is None:
+        raise ImportError("numpy is needed for the phash method")
+    size = hash_size * scale
+    pixels = load_hash_pixels(image_path, size, size)
+    dct_matrix = make_dct_matrix(size)
+    frequencies = (dct_matrix @ pixels @ dct_matrix.T)[:hash_size, :hash_size]
+    # The first value is the mean brightness, which would skew the median
+    median = numpy.median(frequencies.ravel()[1:])
+    return pack_bits((frequencies > median).ravel())
+
+
+# Perceptual hashes, each taking the path to an image and returning an int
+PERCEPTUAL_HASHES = {"dhash": find_dhash, "phash": find_phash}
+
+
+def find_hash_distance(first, second):
+    """Return the number of bits two hashes differ in"""
+
+    return (first ^ second).bit_count()
+
+
+class MultiIndexHash:
+    """Index hashes of hash_bits bits so that those within max_distance of a
+    given one are found by looking up a few exact keys.
+
+    Each hash is split into max_distance + 1 parts. Two hashes that differ
+    in no more than max_distance bits must agree on at least one part, so
+    only the hashes sharing a part with the query are compared. This keeps
+    lookups fast for the small distances used to spot near duplicates,
+    where a BK-tree still visits much of its tree.
+    """
+
+    def __init__(self, max_distance, hash_bits=64):
+        self.max_distance = max_distance
+        part_count = max_distance + 1
+        # Split the bits as evenly as possible, as (shift, mask) pairs
+        self.parts = []
+        shift = 0
+        for part in range(part_count):
+            width = hash_bits // part_count + (part < hash_bits % part_count)
+            self.parts.append((shift, (1 << width) - 1))
+            shift += width
+        # One table for each part, mapping its value to the entries with it
+        self.tables = [{} for part in self.parts]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def split(self, value):
+        """Return the value of each part of a hash"""
+
+        return [(value >> shift) & mask for shift, mask in self.parts]
+
+    def check_distance(self, max_distance):
+        """Return the distance to search within, which may not be more than
+        the one the index was made for"""
+
+        if max_distance is None:
+            return self.max_distance
+        if max_distance > self.max_distance:
+            raise ValueError("The index only finds hashes within {} "
+                             "bits".format(self.max_distance))
+        return max_distance
+
+    def add(self, value, item=None):
+        """Add a hash, and an item to return with it, to the index"""
+
+        self.size += 1
+        entry = (value, item)
+        for table, part in zip(self.tables, self.split(value)):
+            table.setdefault(part, []).append(entry)
+
+    def find(self, value, max_distance=None):
+        """Return the (distance, hash, item) of every hash within
+        max_distance of the value, nearest first. The distance may not be
+        more than the one the index was made for"""
+
+        max_distance = self.check_distance(max_distance)
+        matches = {}
+        for table, part in zip(self.tables, self.split(value)):
+            for entry in table.get(part, ()):
+                # An entry sharing several parts is found more than once
+                if id(entry) not in matches:
+                    distance = find_hash_distance(value, entry[0])
+                    if distance <= max_distance:
+                        matches[id(entry)] = (distance,) + entry
+                    else:
+                        matches[id(entry)] = None
+        return sorted((match for match in matches.values() if match),
+                      key=lambda match: match[0])
+
+    def find_nearest(self, value, max_distance=None):
+        """Return the (distance, hash, item) of the hash nearest the value,
+        or None if none are within max_distance"""
+
+        matches = self.find(value, max_distance)
+        return matches[0] if matches else None
+
+
+class SpillHashIndex(MultiIndexHash):
+    """A MultiIndexHash held in memory until it grows past
+    max_memory_items, and in a table of the spill file from then on, with
+    a database index on each part of the hashes"""
+
+    def __init__(self, max_distance, spill_file, max_memory_items,
+                 hash_bits=64):
+        super().__init__(max_distance, hash_bits)
+        self.spill_file = spill_file
+        self.max_memory_items = max_memory_items
+        self.table = None
+
+    def spill(self):
+        """Move the hashes held in memory into the spill file"""
+
+        part_names = ["part{}".format(i) for i in range(len(self.parts))]
+        self.table = self.spill_file.make_table(
+            ", ".join(["hash TEXT", "item TEXT"] +
+                      [name + " INTEGER" for name in part_names]))
+        for name in part_names:
+            self.spill_file.connection.execute(
+                "CREATE INDEX {0}_{1} ON {0} ({1})".format(self.table, name))
+        # Every entry is in each table once, so the first table holds them
+        # all
+        for entries in self.tables[0].values():
+            for value, item in entries:
+                self.insert(value, item)
+        self.tables = [{} for part in self.parts]
+
+    def insert(self, value, item):
+        # Hashes are unsigned and may not fit in an SQLite integer
+        self.spill_file.connection.execute(
+            "INSERT INTO {} VALUES ({})".format(
+                self.table, ", ".join("?" * (len(self.parts) + 2))),
+            [format(value, 'x'), item] + self.split(value))
+
+    def add(self, value, item=None):
+        if self.table is None:
+            super().add(value, item)
+            if self.size > self.max_memory_items:
+                self.spill()
+            return
+        self.insert(value, item)
+        self.size += 1
+
+    def find(self, value, max_distance=None):
+        if self.table is None:
+            return super().find(value, max_distance)
+        max_distance = self.check_distance(max_distance)
+        rows = self.spill_file.connection.execute(
+            "SELECT hash, item FROM {} WHERE {}".format(
+                self.table, " OR ".join("part{} = ?".format(i) for i in
+                                        range(len(self.parts)))),
+            self.split(value)).fetchall()
+        matches = []
+        for stored_hash, item in rows:
+            stored_hash = int(stored_hash, 16)
+            distance = find_hash_distance(value, stored_hash)
+            if distance <= max_distance:
+                matches.append((distance, stored_hash, item))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class ImageStore:
+    """Keep each distinct image once on disk, named by its checksum.
+
+    The images folder only holds links to the stored images under their
+    alt text names, so an image found on several pages or in several runs
+    is written a single time. A manifest records which stored image each
+    name points to. Several images folders may share one store, each with a
+    manifest of its own.
+
+    Given a spill file, no more than max_memory_items entries of the
+    manifest are kept in memory and the rest are held in the file.
+    """
+
+    def __init__(self, path='./image_store', manifest_path=None,
+                 spill_file=None, max_memory_items=100000):
+        self.folder = Directory(path)
+        if manifest_path is None:
+            manifest_path = os.path.join(path, 'manifest.json')
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        # Map each file name in the images folder to its checksum and url
+        if spill_file is None:
+            self.manifest = {}
+        else:
+            self.manifest = SpillDict(spill_file, max_memory_items)
+
+    def find_blob_path(self, checksum):
+        """Return the path the image with the given checksum is kept at"""
+
+        return os.path.join(self.folder.get_path(), checksum)
+
+    def contains(self, checksum):
+        """Return True if an image with the given checksum is stored"""
+
+        return os.path.exists(self.find_blob_path(checksum))
+
+    def make_temp_file(self):
+        """Return an open file and its path for an image being downloaded,
+        kept beside the stored images so it can be moved into place"""
+
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.folder.get_path(),
+                                              suffix='.tmp')
+        return os.fdopen(temp_fd, 'wb'), temp_path
+
+    def add(self, temp_path, checksum):
+        """Store the downloaded image at temp_path under its checksum. Return
+        True if it was new, or False if the same image was already stored"""
+
+        if self.contains(checksum):
+            os.remove(temp_path)
+            return False
+        os.replace(temp_path, self.find_blob_path(checksum))
+        return True
+
+    def link(self, checksum, image_path, image_url):
+        """Make the stored image available at image_path and record it in
+        the manifest"""
+
+        blob_path = self.find_blob_path(checksum)
+        try:
+            os.link(blob_path, image_path)
+        except OSError:
+            # Fall back to a copy where hard links are not supported
+            shutil.copyfile(blob_path, image_path)
+
+        with self.lock:
+            self.manifest[os.path.basename(image_path)] = {
+                "checksum": checksum, "url": image_url}
+
+    def save(self):
+        """Write the manifest to disk"""
+
+        with self.lock:
+            if isinstance(self.manifest, dict):
+                entries = sorted(self.manifest.items())
+            else:
+                entries = self.manifest.get_sorted_items()
+            # Write an entry at a time so that a spilled manifest is never
+            # read into memory whole
+            with open(self.manifest_path, 'w') as manifest_file:
+                manifest_file.write("{")
+                for i, (name, entry) in enumerate(entries):
+                    manifest_file.write("{}\n {}: {}".format(
+                        "," if i else "", json.dumps(name),
+                        json.dumps(entry, sort_keys=True)))
+                manifest_file.write("\n}\n")
+
+
 class ImageDownloader:
     """Download the images at the given url"""
 
-    def __init__(self, img_objects):
+    def __init__(self, img_objects, workers=1, min_size=101, max_size=None,
+                 cache=None, store=None, client=None, image_ready=None,
+                 image_folder='./images', perceptual_hash="dhash",
+                 max_hash_distance=4, metrics=None, max_memory_items=None):
+        # Fail here rather than on every image once downloads have started
+        if perceptual_hash == "phash" and numpy is None:
+            raise ImportError("numpy is needed for the phash method")
         self.imgs = img_objects
-        self.image_folder = Directory('./images')
+        self.workers = workers
+        self.metrics = metrics if metrics is not None else shared_metrics
+        self.cache = cache
+        self.client = client
+        # Called with the path of each image once it is in the images folder
+        self.image_ready = image_ready
+        # When max_memory_items is given, no more than that many checksums,
+        # perceptual hashes or manifest entries are kept in memory, and the
+        # rest go to a temporary file, so memory stays flat however many
+        # images are downloaded
+        self.spill_file = None
+        if max_memory_items is not None:
+            self.spill_file = SpillFile()
+
+        # The images folder is only a set of links into the store, so
+        # clearing it does not lose any downloaded images. Its manifest is
+        # kept beside it
+        if store is None:
+            store = ImageStore(manifest_path=os.path.normpath(image_folder) +
+                               '.manifest.json', spill_file=self.spill_file,
+                               max_memory_items=max_memory_items)
+        self.store = store
+        self.image_folder = Directory(image_folder)
         self.image_folder.clear_dir()
-        self.image_checksums = set()
+        if self.spill_file is None:
+            self.image_checksums = set()
+        else:
+            self.image_checksums = SpillSet(self.spill_file, max_memory_items)
+
+        # Images whose perceptual hashes differ in no more than
+        # max_hash_distance bits are taken to be the same picture, and only
+        # the first is kept. No perceptual hashes are taken when
+        # perceptual_hash is None
+        self.perceptual_hash = perceptual_hash
+        self.max_hash_distance = max_hash_distance
+        if self.spill_file is None:
+            self.image_hashes = MultiIndexHash(max_hash_distance)
+        else:
+            self.image_hashes = SpillHashIndex(
+                max_hash_distance, self.spill_file, max_memory_items)
+
+        # Images smaller than min_size bytes are treated as blank, and images
+        # larger than max_size bytes are abandoned. No maximum is applied
+        # when max_size is None
+        self.min_size = min_size
+        self.max_size = max_size
+
+        # Guard the checksums and the totals shared between workers
+        self.lock = threading.Lock()
+        self.images_downloaded = 0
+        self.images_reused = 0
+        self.near_duplicates = 0
+        self.bytes_downloaded = 0
+        # Images not yet started, reported as the depth of the queue
+        self.images_pending = 0
 
     def find_image_path(self, image):
         """Return the full relative path of the image given"""
@@ -385,71 +2602,297 @@ class ImageDownloader:
         # Don't download any images that would overwrite an existing one
         if os.path.exists(self.find_image_path(image)):
             valid = False
-            return valid
 
-        # Ignore any images that are unreachable for any reason
-        try:
-            image_request = urllib.request.urlopen(image.get_image_url())
-        except urllib.error.HTTPError:
-            print("Image unreachable")
-            valid = False
-            return valid
+        return valid
 
-        # Ignore blank images
-        try:
-            web_file_size = int(image_request.info()["Content-Length"])
-        except TypeError:
-            # The length of the photo is not provided. Take no risks
-            valid = False
+    def verify_size(self, image_size):
+        """Return True if an image of the given number of bytes is within the
+        size limits, False otherwise. An unknown size is given as None and is
+        accepted, leaving the limits to be checked while the body streams in
+        """
+
+        valid = True
+
+        if image_size is None:
             return valid
 
         # ID blank images by having unreasonably small file size
-        if web_file_size <= 100:
+        if image_size < self.min_size:
+            valid = False
+        elif self.max_size is not None and image_size > self.max_size:
             valid = False
-            return valid
-
-        # If nothing wrong was detected, return the true value assigned in the
-        # beginning
 
         return valid
 
-    def download_images(self):
-        """Download all of the images in the list of image objects"""
-        print("Pictures to download:", len([img.get_file_name() for img
-                                            in self.imgs]))
-        for img in self.imgs:
-            print("Downloading image")
-            image_path = self.find_image_path(img)
-            prior_amount = len(os.listdir("./images"))
-
-            if not self.verify_download(img):
-                print("Image unvalidated")
-                continue
+    @staticmethod
+    def find_content_length(image_request):
+        """Return the Content-Length given with a response, or None if it is
+        missing or unreadable"""
 
-            image_request = urllib.request.urlopen(img.get_image_url())
+        try:
+            return int(image_request.info()["Content-Length"])
+        except (TypeError, ValueError):
+            return None
+
+    def save_image(self, image_request):
+        """Stream the body of a response into a temporary file beside the
+        store, finding its checksum in the same pass. Return the checksum,
+        size and temporary path of the image, or None if the body fell
+        outside the size limits, in which case nothing is kept.
+        """
 
-            image_file = open(image_path, "wb")
+        hash_md5 = hashlib.md5()
+        image_size = 0
+        # Hold the first chunks in memory until the image is known not to be
+        # blank, so that blank images never touch the disk
+        pending_chunks = []
+        image_file = None
+        temp_path = None
+        saved = False
+        try:
+            for chunk in iter(lambda: image_request.read(CHUNK_SIZE), b''):
+                image_size += len(chunk)
+                # Give up as soon as the body grows past the maximum
+                if self.max_size is not None and image_size > self.max_size:
+                    return None
+                hash_md5.update(chunk)
+                if image_file is None:
+                    pending_chunks.append(chunk)
+                    if image_size >= self.min_size:
+                        image_file, temp_path = self.store.make_temp_file()
+                        image_file.writelines(pending_chunks)
+                        pending_chunks = None
+                else:
+                    image_file.write(chunk)
+
+            saved = image_file is not None
+        finally:
+            image_request.close()
+            if image_file is not None:
+                image_file.close()
+                if not saved:
+                    os.remove(temp_path)
+
+        if not saved:
+            return None
+
+        return hash_md5.hexdigest(), image_size, temp_path
+
+    def find_perceptual_hash(self, checksum):
+        """Return the perceptual hash of the stored image with the given
+        checksum, or None if it is not taken or the image cannot be read"""
+
+        if self.perceptual_hash is None:
+            return None
+        try:
+            return PERCEPTUAL_HASHES[self.perceptual_hash](
+                self.store.find_blob_path(checksum))
+        except (OSError, ValueError, SyntaxError,
+                Image.DecompressionBombError):
+            # Not an image Pillow can read, or one too large to decode
+            # safely, so only exact copies are caught
+            return None
+
+    def download_image(self, img):
+        """Download a single image with one request, checking its size against
+        the limits from the headers or, failing that, from the streamed body
+        """
 
-            image_file.write(image_request.read())
-            image_file.close()
+        image_path = self.find_image_path(img)
+
+        if not self.verify_download(img):
+            logger.debug("Image skipped, %s already exists", image_path)
+            return
+
+        with self.metrics.time_stage('download'):
+            saved_image = self.fetch_image(img)
+        if saved_image is None:
+            return
+        image_checksum, image_size, temp_path = saved_image
+
+        with self.metrics.time_stage('dedup'):
+            # An image the server says is unchanged is linked from the store
+            # as it is, without being written again
+            new_blob = temp_path is not None and \
+                self.store.add(temp_path, image_checksum)
+            duplicate = self.check_duplicate(image_checksum, image_size,
+                                             new_blob)
+        if not duplicate:
+            self.store.link(image_checksum, image_path, img.get_image_url())
+            self.metrics.increment('images_downloaded')
+            if self.image_ready is not None:
+                self.image_ready(image_path)
+
+        logger.debug("Saved %s from %s", img.get_file_name(),
+                     img.get_image_url())
+
+    def fetch_image(self, img):
+        """Download an image into a temporary file beside the store. Return
+        its checksum, size and temporary path, or None if it could not be
+        fetched or fell outside the size limits. The path is None if the
+        image is already in the store and the server says it is unchanged"""
 
-            image_checksum = find_checksum(image_path)
+        # Ignore any images that are unreachable for any reason
+        try:
+            if self.cache is None:
+                image_request = open_url(img.get_image_url(),
+                                         client=self.client)
+                kept = None
+            else:
+                # The store keeps the bodies of images, so the cache only
+                # keeps what is needed to revalidate them
+                image_request, kept = self.cache.open_validated(
+                    img.get_image_url(), self.store.contains)
+        except urllib.error.HTTPError as http_error:
+            logger.warning("%s was unreachable: HTTP %d",
+                           img.get_image_url(), http_error.code)
+            return None
+        except urllib.error.URLError as url_error:
+            logger.warning("%s was unreachable: %s", img.get_image_url(),
+                           url_error.reason)
+            return None
+
+        if kept is not None:
+            image_checksum, image_size = kept
+            if not self.verify_size(image_size):
+                logger.debug("%s is outside the size limits",
+                             img.get_image_url())
+                return None
+            return image_checksum, image_size, None
+
+        if not self.verify_size(self.find_content_length(image_request)):
+            image_request.close()
+            logger.debug("%s is outside the size limits", img.get_image_url())
+            return None
 
-            # Delete the file if an identical image was downloaded earlier.
-            # It must be downloaded already to check if it is already in the
-            # folder
-            if image_checksum in self.image_checksums:
-                os.remove(image_path)
+        try:
+            saved_image = self.save_image(image_request)
+        except (OSError, http.client.HTTPException) as reason:
+            logger.warning("%s could not be read: %s", img.get_image_url(),
+                           reason)
+            return None
+        if saved_image is None:
+            logger.debug("%s is outside the size limits", img.get_image_url())
+        elif self.cache is not None:
+            self.cache.record_kept(img.get_image_url(), image_request.info(),
+                                   saved_image[0], saved_image[1])
+        return saved_image
+
+    def check_duplicate(self, image_checksum, image_size, new_blob):
+        """Record a stored image and return True if it is an exact or near
+        duplicate of an image already kept"""
+
+        # Only the first image with a given checksum is linked into the
+        # images folder, so identical images appear in the collage once
+        with self.lock:
+            duplicate = image_checksum in self.image_checksums
             self.image_checksums.add(image_checksum)
+            self.bytes_downloaded += image_size
+        # The same picture at another size or in another format has a
+        # different checksum but a nearby perceptual hash
+        image_hash = None if duplicate else \
+            self.find_perceptual_hash(image_checksum)
+        with self.lock:
+            if image_hash is not None and not duplicate:
+                if self.image_hashes.find_nearest(image_hash,
+                                                  self.max_hash_distance):
+                    duplicate = True
+                    self.near_duplicates += 1
+                    self.metrics.increment('near_duplicates')
+                else:
+                    self.image_hashes.add(image_hash, image_checksum)
+            if not duplicate:
+                self.images_downloaded += 1
+                if not new_blob:
+                    self.images_reused += 1
+        return duplicate
+
+    def download_listed_image(self, img):
+        """Download one of the listed images, counting down those left"""
+
+        with self.lock:
+            self.images_pending -= 1
+            self.metrics.set_depth('download_queue', self.images_pending)
+        self.download_image(img)
 
-            later_amount = len(os.listdir("./images"))
-            if not later_amount > prior_amount:
-                print("[WARNING] Image not downloaded------------------------")
+    def download_images(self):
+        """Download all of the images in the list of image objects, using
+        several workers at once if more than one was requested
+        """
+        logger.info("Pictures to download: %d", len(self.imgs))
+        self.images_pending = len(self.imgs)
+        start = time.perf_counter()
 
-            print("Filename:", img.get_file_name())
-            print("Url:", img.get_image_url(), '\n')
+        try:
+            if self.workers > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    # Consume the results so that any errors are raised here
+                    list(executor.map(self.download_listed_image, self.imgs))
+            else:
+                for img in self.imgs:
+                    self.download_listed_image(img)
+
+            self.report_throughput(time.perf_counter() - start)
+            self.store.save()
+        finally:
+            self.close_spill_file()
+        logger.info("Images downloaded")
+
+    def download_queued(self, image_queue):
+        """Download the images put on the queue, on every worker, until None
+        is taken from it"""
+
+        logger.info("Downloading images as they are found")
+        start = time.perf_counter()
+
+        def download_until_done():
+            while True:
+                img = image_queue.get()
+                if img is None:
+                    # Put the marker back for the other workers to find
+                    image_queue.put(None)
+                    return
+                try:
+                    self.download_image(img)
+                except Exception:
+                    # A worker that stopped would leave the crawl waiting on
+                    # a full queue, so carry on with the next image
+                    logger.exception("%s could not be downloaded",
+                                     img.get_image_url())
 
-        print("Images downloaded")
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                workers = [executor.submit(download_until_done)
+                           for i in range(self.workers)]
+                for worker in workers:
+                    worker.result()
+
+            self.report_throughput(time.perf_counter() - start)
+            self.store.save()
+        finally:
+            self.close_spill_file()
+        logger.info("Images downloaded")
+
+    def close_spill_file(self):
+        """Delete the file the spilled checksums, hashes and manifest entries
+        were held in, once the manifest has been saved"""
+
+        if self.spill_file is not None:
+            self.spill_file.close()
+
+    def report_throughput(self, elapsed):
+        """Log how quickly the images were downloaded"""
+
+        elapsed = max(elapsed, 1e-9)
+        megabytes = self.bytes_downloaded / (1024 * 1024)
+        logger.info("Downloaded %d images (%.2f MB) in %.2f s: %.1f "
+                    "images/s, %.2f MB/s", self.images_downloaded, megabytes,
+                    elapsed, self.images_downloaded / elapsed,
+                    megabytes / elapsed)
+        logger.info("%d of the images were already in the store",
+                    self.images_reused)
+        logger.info("%d near duplicate images were left out",
+                    self.near_duplicates)
 
     def run(self):
         """Clear the folder out and download all of the images"""
@@ -458,12 +2901,28 @@ class ImageDownloader:
 
 
 class CollageMaker:
-    def __init__(self, user_input):
+    def __init__(self, user_input, pipelined=True, metrics=None):
         self.user_input = user_input
+        self.metrics = metrics
         self.ensure_folder_exists()
 
+        # When pipelined, images are prepared for the collage as they are
+        # downloaded instead of after every download has finished
+        self.pipeline = None
+        if pipelined:
+            self.pipeline = collage_maker.CollagePipeline(
+                self.user_input.get_settings(), metrics=metrics).start()
+
+    def add_image(self, image_path):
+        """Hand a downloaded image to the collage pipeline"""
+
+        self.pipeline.add(image_path)
+
     def run(self):
-        collage_maker.run(self.user_input.get_settings())
+        if self.pipeline is not None:
+            self.pipeline.finish()
+        else:
+            collage_maker.run(self.user_input.get_settings(), self.metrics)
 
     def ensure_folder_exists(self):
         collage_directory = Directory(path='./collages')
@@ -482,6 +2941,8 @@ class CollageUserInput:
         self.width = 1000
         self.initial_height = 25
         self.shuffle = False
+        # Render the collage on every core
+        self.workers = os.cpu_count() or 1
 
         self.settings = self.find_settings()
 
@@ -490,7 +2951,8 @@ class CollageUserInput:
                                           output=self.output,
                                           width=self.width,
                                           initial_height=self.initial_height,
-                                          shuffle=self.shuffle)
+                                          shuffle=self.shuffle,
+                                          workers=self.workers)
         return settings
 
     def find_output_name(self):
@@ -520,19 +2982,217 @@ class CollageUserInput:
 class Program:
     """Hold the main program"""
 
-    def __init__(self):
+    def __init__(self, metrics=None):
         self.crawler_user_input = CrawlerUserInput()
         self.crawler_user_input.request_user_settings()
 
-        self.crawler = Crawler(self.crawler_user_input)
-
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
         self.collage_input = CollageUserInput()
-        self.collage = CollageMaker(user_input=self.collage_input)
+        self.collage = CollageMaker(user_input=self.collage_input,
+                                    metrics=metrics)
+
+        client = HttpClient(metrics=metrics)
+        self.crawler = Crawler(self.crawler_user_input,
+                               cache=HttpCache('./cache', client=client),
+                               checkpoint_path='./crawl_checkpoint.json.gz',
+                               image_ready=self.collage.add_image,
+                               metrics=metrics)
 
     def run(self):
         self.crawler.run()
         self.collage.run()
+        self.metrics.report()
+
+
+def make_job_names(urls):
+    """Return a distinct name for the crawl of each url, made from its host
+    and path"""
+
+    names = []
+    for url in urls:
+        url_parts = urlparse(url)
+        name = re.sub(r'[^\w.-]+', '_', url_parts.netloc + url_parts.path)
+        name = name.strip('_.')[:60] or "crawl"
+        unique_name = name
+        count = 1
+        while unique_name in names:
+            count += 1
+            unique_name = "{}_{}".format(name, count)
+        names.append(unique_name)
+
+    return names
+
+
+def crawl_and_collage(urls, page_limit=5, output_dir='./collages',
+                      images_dir='./images', max_jobs=4, width=1000,
+                      initial_height=25, collage_workers=1, client=None,
+                      cache=None, checkpoint_dir=None, scheduler=None,
+                      metrics=None, streaming=False):
+    """Crawl from each of the seed urls and make a collage of the images
+    found, without asking the user for anything.
+
+    Up to max_jobs crawls run at once. They share one client, so
+    connections are reused across jobs, one cache, and one scheduler, so
+    that seeds on the same host are paced together. Each crawl downloads
+    into a folder of its own under images_dir and its collage is saved in
+    output_dir, both named after the url. Crawls are checkpointed in
+    checkpoint_dir if one is given, and resumed from there when run again.
+    The stages of every crawl are timed together in metrics. With
+    streaming, images are downloaded while the pages are crawled and memory
+    use does not grow with the page limit.
+
+    Return a dict mapping each url to the path of its collage, or to None if
+    no collage could be made.
+    """
+
+    if isinstance(urls, str):
+        urls = [urls]
+    for url in urls:
+        if not verify_real_url(url):
+            raise ValueError("Invalid url given: " + url)
+
+    if metrics is None:
+        metrics = Metrics()
+    if client is None:
+        client = cache.client if cache is not None else \
+            HttpClient(metrics=metrics)
+    if cache is None:
+        cache = HttpCache('./cache', client=client)
+    if scheduler is None:
+        scheduler = HostScheduler(client)
+    Directory(output_dir)
+    if checkpoint_dir is not None:
+        Directory(checkpoint_dir)
+
+    def run_job(url, name):
+        collage_settings = collage_maker.Settings(
+            folder=os.path.join(images_dir, name),
+            output=os.path.join(output_dir, name + ".png"), width=width,
+            initial_height=initial_height, workers=collage_workers)
+        pipeline = collage_maker.CollagePipeline(collage_settings,
+                                                 metrics=metrics).start()
+
+        checkpoint_path = None
+        if checkpoint_dir is not None:
+            checkpoint_path = os.path.join(checkpoint_dir, name + ".json.gz")
+        crawler = Crawler(CrawlerUserInput(url, page_limit), cache=cache,
+                          client=client, checkpoint_path=checkpoint_path,
+                          scheduler=scheduler, image_ready=pipeline.add,
+                          metrics=metrics, streaming=streaming,
+                          image_folder=collage_settings.get_folder())
+        crawler.run()
+        if pipeline.finish():
+            return collage_settings.get_output()
+        return None
+
+    collages = {}
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        jobs = [(url, executor.submit(run_job, url, name)) for url, name in
+                zip(urls, make_job_names(urls))]
+        for url, job in jobs:
+            # One failed crawl should not stop the others in a batch
+            try:
+                collages[url] = job.result()
+            except Exception as job_error:
+                logger.error("Crawl of %s failed: %s", url, job_error)
+                collages[url] = None
+
+    return collages
+
+
+def save_metrics(metrics, opts):
+    """Save the metrics and stage profiles the command line asked for"""
+
+    if opts.metrics:
+        metrics.save(opts.metrics)
+    if opts.profile:
+        metrics.save_profiles('.')
+
+
+def main(args=None):
+    """Crawl the urls given on the command line, or ask for a url if there
+    are none"""
+
+    options = OptionParser(usage='%prog [options] [URL ...]',
+                           description='Make collages of the images found '
+                                       'by crawling from each URL. With no '
+                                       'URL, the settings are asked for.')
+    options.add_option('-p', '--pages', dest='pages', type='int', default=5,
+                       help='number of pages to crawl from each URL')
+    options.add_option('-o', '--output-dir', dest='output_dir',
+                       default='./collages',
+                       help='folder the collages are saved in')
+    options.add_option('-d', '--images-dir', dest='images_dir',
+                       default='./images',
+                       help='folder the images of each crawl are saved under')
+    options.add_option('-j', '--jobs', dest='jobs', type='int', default=4,
+                       help='number of crawls to run at once')
+    options.add_option('-w', '--width', dest='width', type='int',
+                       default=1000, help='width of each collage')
+    options.add_option('--init-height', dest='init_height', type='int',
+                       default=25, help='initial height of the images')
+    options.add_option('--render-workers', dest='render_workers', type='int',
+                       default=1,
+                       help='processes rendering each collage')
+    options.add_option('--checkpoint-dir', dest='checkpoint_dir',
+                       help='folder to checkpoint and resume crawls in')
+    options.add_option('--streaming', action='store_true', dest='streaming',
+                       default=False,
+                       help='download images while crawling and keep the '
+                            'links to visit on disk, so that memory does '
+                            'not grow with the page limit')
+    options.add_option('-v', '--verbose', action='store_true',
+                       dest='verbose', default=False,
+                       help='log every page and image')
+    options.add_option('-q', '--quiet', action='store_true', dest='quiet',
+                       default=False, help='only log warnings and errors')
+    options.add_option('--metrics', dest='metrics',
+                       help='save counts, queue depths and stage timings to '
+                            'this file, as Prometheus text if it ends in '
+                            '.prom and JSON otherwise')
+    options.add_option('--profile', dest='profile', action='append',
+                       default=[],
+                       help='run a stage (fetch, parse, dedup, download, '
+                            'probe, resize, paste or save) under cProfile, '
+                            'saving <stage>.prof; may be given more than '
+                            'once')
+
+    opts, urls = options.parse_args(args)
+    level = logging.INFO
+    if opts.verbose:
+        level = logging.DEBUG
+    elif opts.quiet:
+        level = logging.WARNING
+    logging.basicConfig(level=level, format='%(message)s')
+    metrics = Metrics(profile_stages=opts.profile)
+
+    if not urls:
+        Program(metrics).run()
+        save_metrics(metrics, opts)
+        return 0
+
+    for url in urls:
+        if not verify_real_url(url):
+            options.error("invalid url given: " + url)
+
+    collages = crawl_and_collage(urls, page_limit=opts.pages,
+                                 output_dir=opts.output_dir,
+                                 images_dir=opts.images_dir,
+                                 max_jobs=opts.jobs, width=opts.width,
+                                 initial_height=opts.init_height,
+                                 collage_workers=opts.render_workers,
+                                 checkpoint_dir=opts.checkpoint_dir,
+                                 metrics=metrics, streaming=opts.streaming)
+    metrics.report()
+    save_metrics(metrics, opts)
+    for url, collage in collages.items():
+        print(url, "->", collage or "no collage made")
+
+    # Fail if any crawl made no collage, so batch schedulers notice
+    return 0 if all(collages.values()) else 1
+
 
 if __name__ == "__main__":
-    crawler_collage = Program()
-    crawler_collage.run()
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""A small local web site used by the tests and benchmarks in place of a
+live server"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FixtureSite:
+    """Serve a fixed set of pages from a local HTTP server and count the
+    requests made for each of them"""
+
+    def __init__(self, pages, latency=0.0, keep_alive=False, statuses=None):
+        # Pages map a path such as "/index.html" to either a string of html,
+        # a (content type, bytes) pair, or a (content type, bytes, headers)
+        # triple. A header given as None is left out of the response
+        self.pages = pages
+        # Statuses map a path to the error statuses its first requests are
+        # answered with, each a code or a (code, headers) pair
+        self.statuses = {path: list(codes) for path, codes in
+                         (statuses or {}).items()}
+        self.latency = latency
+        self.keep_alive = keep_alive
+        self.connection_count = 0
+        self.request_counts = {}
+        # The path and time of every request, in the order they arrived
+        self.request_times = []
+        self.not_modified_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    def make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections open between requests
+            protocol_version = "HTTP/1.1" if site.keep_alive else "HTTP/1.0"
+            # The headers and body are sent separately, so without this a
+            # kept-alive connection stalls on delayed acknowledgements
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                site.count_connection()
+
+            def do_GET(self):
+                site.count_request(self.path)
+                try:
+                    if site.latency:
+                        time.sleep(site.latency)
+                    self.send_page()
+                finally:
+                    site.finish_request()
+
+            def send_page(self):
+                status = site.next_status(self.path)
+                if status is not None:
+                    code, headers = status if isinstance(status, tuple) \
+                        else (status, {})
+                    self.send_response(code)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.path not in site.pages:
+                    self.send_error(404)
+                    return
+                content = site.pages[self.path]
+                if isinstance(content, str):
+                    content = ("text/html", content.encode("utf-8"))
+                content_type, body = content[:2]
+                headers = {"Content-Type": content_type,
+                           "Content-Length": str(len(body))}
+                if len(content) > 2:
+                    headers.update(content[2])
+                if self.is_not_modified(headers):
+                    site.count_not_modified()
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                for name, value in headers.items():
+                    if value is not None:
+                        self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def is_not_modified(self, headers):
+                """Return True if the request's validators match the page"""
+
+                etag = headers.get("ETag")
+                last_modified = headers.get("Last-Modified")
+                if etag and self.headers["If-None-Match"] == etag:
+                    return True
+                return bool(last_modified) and \
+                    self.headers["If-Modified-Since"] == last_modified
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def count_request(self, path):
+        with self.lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+            self.request_times.append((path, time.monotonic()))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def next_status(self, path):
+        """Return the error status the next request for a path is answered
+        with, or None if the page is served"""
+
+        with self.lock:
+            codes = self.statuses.get(path)
+            return codes.pop(0) if codes else None
+
+    def get_request_times(self, path):
+        """Return the times at which a path was requested"""
+
+        with self.lock:
+            return [request_time for request_path, request_time in
+                    self.request_times if request_path == path]
+
+    def count_connection(self):
+        with self.lock:
+            self.connection_count += 1
+
+    def count_not_modified(self):
+        with self.lock:
+            self.not_modified_count += 1
+
+    def finish_request(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def get_request_count(self, path=None):
+        """Return the number of requests made for a path, or for the whole
+        site if no path is given"""
+
+        with self.lock:
+            if path is None:
+                return sum(self.request_counts.values())
+            return self.request_counts.get(path, 0)
+
+    def url(self, path):
+        """Return the absolute url of a path on the site"""
+
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}{}".format(host, port, path)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
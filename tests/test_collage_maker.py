@@ -0,0 +1,321 @@
+from unittest import TestCase
+
+
+class ImageFolderTestCase(TestCase):
+    """Write the images of each test to a temporary directory"""
+
+    def setUp(self):
+        import tempfile
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_images(self, sizes, extension='.png'):
+        """Save a plain image of each size and return their paths"""
+        import os
+        from PIL import Image
+
+        paths = []
+        for i, size in enumerate(sizes):
+            path = os.path.join(self.temp_dir.name, str(i) + extension)
+            Image.new('RGB', size, (i * 40 % 256, 80, 160)).save(path)
+            paths.append(path)
+        return paths
+
+
+class TestThumbnailSize(TestCase):
+
+    def test_matches_pillow(self):
+        from PIL import Image
+        from collage_maker.collage_maker import thumbnail_size
+
+        for size in [(640, 480), (31, 997), (1000, 1), (50, 20), (333, 334)]:
+            for box in [(1000, 25), (40, 40), (7, 1000), (2000, 2000)]:
+                img = Image.new('RGB', size)
+                img.thumbnail(box)
+                self.assertEqual(thumbnail_size(size, box), img.size,
+                                 "Thumbnail size of {} in {} was wrong"
+                                 .format(size, box))
+
+
+class TestLayoutRows(TestCase):
+
+    def test_layout_without_images(self):
+        from collage_maker.collage_maker import layout_rows
+
+        # The paths do not exist, so the layout must work from sizes alone
+        image_sizes = [("{}.png".format(i), (60, 60)) for i in range(5)]
+        init_height, coefs_lines = layout_rows(image_sizes, width=100,
+                                               init_height=100,
+                                               margin_size=2)
+
+        # Rows of two leave the fifth image alone until the images are
+        # small enough for three to fit in the first row
+        self.assertEqual(init_height, 40,
+                         "Height was not lowered until no row was alone")
+        self.assertEqual(coefs_lines,
+                         [(1.26, ["0.png", "1.png", "2.png"]),
+                          (0.84, ["3.png", "4.png"])],
+                         "Images were split into the wrong rows")
+
+
+class TestMakeCollage(ImageFolderTestCase):
+
+    def test_collage_made(self):
+        import os
+        from PIL import Image
+        from collage_maker.collage_maker import make_collage
+
+        paths = self.make_images([(120, 80), (60, 90), (200, 100),
+                                  (50, 50), (90, 30)])
+        output = os.path.join(self.temp_dir.name, 'collage.png')
+        self.assertTrue(make_collage(paths, output, 200, 50),
+                        "Collage was not made")
+        with Image.open(output) as collage:
+            self.assertEqual(collage.size[0], 200,
+                             "Collage was not the width asked for")
+
+
+class TestProbeImageSize(ImageFolderTestCase):
+
+    def test_formats(self):
+        from collage_maker.collage_maker import probe_image_size
+
+        for extension in ['.png', '.jpg', '.gif', '.webp']:
+            for size in [(37, 211), (640, 480)]:
+                path = self.make_images([size], extension)[0]
+                self.assertEqual(probe_image_size(path), size,
+                                 "Size of {} image was probed wrongly"
+                                 .format(extension))
+
+    def test_lossless_webp_and_progressive_jpeg(self):
+        import os
+        from PIL import Image
+        from collage_maker.collage_maker import probe_image_size
+
+        img = Image.new('RGB', (123, 45), (10, 20, 30))
+        webp_path = os.path.join(self.temp_dir.name, 'lossless.webp')
+        img.save(webp_path, lossless=True)
+        jpeg_path = os.path.join(self.temp_dir.name, 'progressive.jpg')
+        img.save(jpeg_path, progressive=True, exif=b'Exif\x00\x00' + b'0' * 64)
+
+        self.assertEqual(probe_image_size(webp_path), (123, 45),
+                         "Size of lossless WebP was probed wrongly")
+        self.assertEqual(probe_image_size(jpeg_path), (123, 45),
+                         "Size of progressive JPEG was probed wrongly")
+
+
+class TestSizeIndex(ImageFolderTestCase):
+
+    def test_sizes_reused(self):
+        import os
+        from PIL import Image
+        from collage_maker.collage_maker import SizeIndex, read_image_sizes
+
+        paths = self.make_images([(10, 20), (30, 40)])
+        index_path = os.path.join(self.temp_dir.name, 'images.sizes.json')
+        size_index = SizeIndex(index_path)
+        read_image_sizes(paths, size_index)
+        size_index.save()
+
+        # Change one of the images so that only it is probed again
+        Image.new('RGB', (50, 60)).save(paths[1])
+        os.utime(paths[1], ns=(0, 0))
+        size_index = SizeIndex(index_path)
+        self.assertEqual(read_image_sizes(paths, size_index),
+                         [(paths[0], (10, 20)), (paths[1], (50, 60))],
+                         "Sizes were not read correctly from the index")
+        self.assertEqual((size_index.hits, size_index.misses), (1, 1),
+                         "Unchanged image was probed again")
+
+
+class TestRenderTile(ImageFolderTestCase):
+
+    def test_reduced_decode_matches_full(self):
+        from PIL import Image, ImageChops, ImageStat
+        from collage_maker.collage_maker import render_tile
+
+        for extension in ['.jpg', '.png']:
+            path = self.make_images([(1600, 1200)], extension)[0]
+            tile = render_tile(path, (80, 60))
+            with Image.open(path) as img:
+                full = img.convert('RGB').resize((80, 60), Image.LANCZOS)
+
+            self.assertEqual(tile.size, (80, 60),
+                             "Tile was not drawn at the size asked for")
+            self.assertLess(max(ImageStat.Stat(ImageChops.difference(
+                full, tile.convert('RGB'))).mean), 2,
+                "Reduced {} decode looks different".format(extension))
+
+
+class TestParallelRender(ImageFolderTestCase):
+
+    def test_matches_serial_render(self):
+        import os
+        from PIL import Image
+        from collage_maker.collage_maker import make_collage
+
+        paths = self.make_images([(300 + i * 37, 200 + i * 53)
+                                  for i in range(8)], '.jpg')
+        paths += self.make_images([(120, 90), (90, 200)], '.png')
+        # A palette image must come out the same as it would be pasted
+        palette_path = os.path.join(self.temp_dir.name, 'palette.gif')
+        Image.new('P', (150, 100), 3).save(palette_path)
+        paths.append(palette_path)
+
+        outputs = []
+        for workers in [1, 3]:
+            output = os.path.join(self.temp_dir.name,
+                                  'collage{}.png'.format(workers))
+            self.assertTrue(make_collage(paths, output, 400, 60,
+                                         workers=workers),
+                            "Collage was not made")
+            with Image.open(output) as collage:
+                outputs.append(collage.tobytes())
+
+        self.assertEqual(outputs[0], outputs[1],
+                         "Parallel render differs from the serial one")
+
+
+class TestStreamedCollage(ImageFolderTestCase):
+
+    def test_matches_collage_in_memory(self):
+        import os
+        from PIL import Image
+        from collage_maker import collage_maker
+
+        paths = self.make_images([(300 + i * 37, 200 + i * 53)
+                                  for i in range(12)], '.jpg')
+        outputs = []
+        for stream in [False, True]:
+            output = os.path.join(self.temp_dir.name,
+                                  'collage{}.png'.format(stream))
+            self.assertTrue(collage_maker.make_collage(
+                paths, output, 500, 60, stream=stream),
+                "Collage was not made")
+            with Image.open(output) as collage:
+                collage.load()
+                outputs.append((collage.mode, collage.size,
+                                collage.tobytes()))
+
+        self.assertEqual(outputs[0], outputs[1],
+                         "Streamed collage differs from the one built in"
+                         " memory")
+
+    def test_band_written_in_chunks(self):
+        import os
+        from PIL import Image
+        from collage_maker.collage_maker import PngStreamWriter
+
+        path = os.path.join(self.temp_dir.name, 'bands.png')
+        band = Image.effect_noise((300, 200), 50).convert('RGB')
+        writer = PngStreamWriter(path, 300, 600)
+        writer.CHUNK_SIZE = 1000
+        for i in range(3):
+            writer.write_band(band)
+        writer.close()
+
+        with Image.open(path) as written:
+            self.assertEqual(written.crop((0, 400, 300, 600)).tobytes(),
+                             band.tobytes(),
+                             "Bands were not written to the PNG correctly")
+
+
+class TestCollagePipeline(ImageFolderTestCase):
+
+    def test_collage_from_pipeline(self):
+        import os
+        from PIL import Image
+        from collage_maker.collage_maker import CollagePipeline, Settings
+
+        paths = self.make_images([(300 + i * 37, 200 + i * 53)
+                                  for i in range(10)], '.jpg')
+        broken_path = os.path.join(self.temp_dir.name, 'broken.png')
+        with open(broken_path, 'wb') as broken_file:
+            broken_file.write(b'not an image')
+
+        output = os.path.join(self.temp_dir.name, 'collage.png')
+        settings = Settings(folder=self.temp_dir.name, output=output,
+                            width=500, initial_height=60)
+        pipeline = CollagePipeline(settings, max_queued=2).start()
+        for path in paths + [broken_path]:
+            pipeline.add(path)
+
+        self.assertTrue(pipeline.finish(), "Collage was not made")
+        self.assertEqual(pipeline.images, paths,
+                         "Images were not prepared in the order they came")
+        self.assertEqual(sorted(pipeline.thumbnails.heights), sorted(paths),
+                         "Thumbnails were not made for the images")
+        self.assertGreater(pipeline.thumbnails.hits, 0,
+                           "No tile was resized from a thumbnail")
+        with Image.open(output) as collage:
+            self.assertEqual(collage.size[0], 500,
+                             "Collage was not the width asked for")
+
+
+class TestRun(ImageFolderTestCase):
+
+    def test_thumbnails_reused_across_runs(self):
+        import os
+        from collage_maker.collage_maker import Settings, ThumbnailCache, run
+
+        paths = self.make_images([(300 + i * 37, 200 + i * 53)
+                                  for i in range(6)])
+        # Keep the collage out of the folder it is made from
+        output_dir = os.path.join(self.temp_dir.name, 'output')
+        os.mkdir(output_dir)
+        settings = Settings(folder=self.temp_dir.name,
+                            output=os.path.join(output_dir, 'collage.png'),
+                            width=500, initial_height=60)
+        thumbnails = ThumbnailCache(settings.get_thumbnail_budget())
+        run(settings, thumbnails=thumbnails)
+        self.assertEqual((thumbnails.hits, thumbnails.misses),
+                         (0, len(paths)), "Tiles were not decoded once")
+
+        run(settings, thumbnails=thumbnails)
+        self.assertEqual(thumbnails.hits, len(paths),
+                         "A second run decoded the images again")
+        self.assertTrue(os.path.exists(settings.get_output()),
+                        "Collage was not made")
+
+
+class TestThumbnailCache(TestCase):
+
+    def test_tiles_from_larger_thumbnails(self):
+        from PIL import Image
+        from collage_maker.collage_maker import ThumbnailCache
+
+        thumbnails = ThumbnailCache()
+        thumbnails.add("a.png", Image.new('RGB', (200, 100)))
+        thumbnails.add("a.png", Image.new('RGB', (60, 30)))
+
+        self.assertTrue(thumbnails.contains_source("a.png", (50, 25)),
+                        "Larger thumbnail was not found")
+        self.assertEqual(thumbnails.make_tile("a.png", (50, 25)).size,
+                         (50, 25), "Tile was resized to the wrong size")
+        self.assertFalse(thumbnails.contains_source("a.png", (400, 200)),
+                         "Thumbnail smaller than the tile was used")
+        self.assertFalse(thumbnails.contains_source("b.png", (10, 10)),
+                         "Thumbnail of another image was used")
+        self.assertEqual((thumbnails.hits, thumbnails.misses), (1, 2),
+                         "Hits and misses were miscounted")
+
+    def test_budget(self):
+        from PIL import Image
+        from collage_maker.collage_maker import ThumbnailCache
+
+        # Room for two 10x10 RGB thumbnails
+        thumbnails = ThumbnailCache(max_bytes=600)
+        for name in ["a.png", "b.png", "c.png"]:
+            thumbnails.add(name, Image.new('RGB', (10, 10)))
+            if name == "b.png":
+                # Use the first thumbnail so that the second is the oldest
+                thumbnails.make_tile("a.png", (10, 10))
+
+        self.assertEqual(list(thumbnails.entries),
+                         [("a.png", 10), ("c.png", 10)],
+                         "Least recently used thumbnail was not dropped")
+        self.assertEqual(thumbnails.bytes_held, 600,
+                         "Bytes held were miscounted")
@@ -1,6 +1,25 @@
 from unittest import TestCase
 
 
+class CrawlTestCase(TestCase):
+    """Run each test from a temporary directory so that the images folder,
+    image store and manifest a crawl writes are throwaway ones"""
+
+    def setUp(self):
+        import os
+        import tempfile
+
+        self.old_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        import os
+
+        os.chdir(self.old_dir)
+        self.temp_dir.cleanup()
+
+
 class BasicSettings:
     """Contain a basic user input to use in test cases"""
 
@@ -27,7 +46,7 @@ class TestVisitPage(TestCase, BasicSettings):
         BasicSettings.__init__(self)
         crawler = Crawler(user_settings=self.settings)
         crawler.visit_next_page()
-        self.assertEqual(crawler.links_to_visit,
+        self.assertEqual(list(crawler.links_to_visit),
                          ["http://rknightly.github.io/one.html",
                           "http://rknightly.github.io/two.two.html",
                           "http://rknightly.github.io/three.html",
@@ -42,9 +61,8 @@ class TestVisitPage(TestCase, BasicSettings):
 
         # Ensure that the attributes of the expected image are equal to the
         # attributes of the image popped from the set of images
-        self.assertTrue(crawler.images.pop().__dict__ ==
-                        expected_image.__dict__,
-                        "Image was incorrectly collected from single page")
+        self.assertEqual(crawler.images.pop(), expected_image,
+                         "Image was incorrectly collected from single page")
 
 
 class TestDumpData(TestCase, BasicSettings):
@@ -61,7 +79,7 @@ class TestDumpData(TestCase, BasicSettings):
         test_page.collect_images(total_unnamed_image_count=5)
         crawler.dump_data(test_page)
 
-        self.assertEqual(crawler.links_to_visit,
+        self.assertEqual(list(crawler.links_to_visit),
                          # Link of page should still be present because the
                          # dump was performed in isolation, without a different
                          # action that would have removed any links
@@ -80,12 +98,36 @@ class TestDumpData(TestCase, BasicSettings):
 
         # Ensure that the attributes of the expected image are equal to the
         # attributes of the image popped from the set of images
-        self.assertTrue(crawler.images.pop().__dict__ ==
-                        expected_image.__dict__,
-                        "Image was incorrectly dumped")
+        self.assertEqual(crawler.images.pop(), expected_image,
+                         "Image was incorrectly dumped")
 
 
-class TestDownloadAllImages(TestCase, BasicSettings):
+class TestAddImage(TestCase, BasicSettings):
+    """Ensure that duplicate images are left out of the crawler's images"""
+
+    def test_duplicates_skipped(self):
+        from crawler_collage import Crawler, ImageData
+
+        BasicSettings.__init__(self)
+        crawler = Crawler(user_settings=self.settings)
+        first = ImageData(image_url="http://a.com/1.png", alt_text="First",
+                          unnamed_image_count=0)
+        same_name = ImageData(image_url="http://a.com/2.png",
+                              alt_text="First", unnamed_image_count=0)
+        same_url = ImageData(image_url="http://a.com/1.png",
+                             alt_text="Other", unnamed_image_count=0)
+        second = ImageData(image_url="http://a.com/3.png", alt_text="Second",
+                           unnamed_image_count=0)
+
+        self.assertEqual([crawler.add_image(image) for image in
+                          [first, same_name, same_url, second]],
+                         [True, False, False, True],
+                         "Duplicate images were not recognized")
+        self.assertEqual(crawler.images, [first, second],
+                         "Images were not kept in the order they were added")
+
+
+class TestDownloadAllImages(CrawlTestCase, BasicSettings):
     """Ensure that all images are downloaded when the download all images
     method is called"""
 
@@ -128,5 +170,319 @@ class TestDownloadAllImages(TestCase, BasicSettings):
     def test_multiple_pages(self):
         pass
 
-class TestVisitMultiplePages(TestCase):
-    pass
\ No newline at end of file
+
+def make_fixture_pages(page_count):
+    """Return a small linked site where every page links to the next few
+    pages, to a missing page, and holds a mix of named and unnamed images"""
+
+    pages = {}
+    for i in range(page_count):
+        links = ''.join('<a href="/page{}.html">Next</a>'.format(j) for j in
+                        range(i + 1, min(i + 4, page_count)))
+        pages["/page{}.html".format(i)] = (
+            links + '<a href="/missing.html">Missing</a>'
+            '<img src="/named{}.png" alt="Picture {}">'
+            '<img src="/unnamed{}.png" alt="">'.format(i, i, i))
+    return pages
+
+
+class TestVisitMultiplePages(CrawlTestCase):
+    """Ensure that the concurrent crawl visits the same pages and collects
+    the same images as visiting one page at a time"""
+
+    @staticmethod
+    def make_settings(url, page_lim):
+        from crawler_collage import CrawlerUserInput
+
+        settings = CrawlerUserInput()
+        settings.user_url = url
+        settings.user_page_lim = page_lim
+        return settings
+
+    def test_matches_serial_crawl(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        with FixtureSite(make_fixture_pages(20)) as site:
+            settings = self.make_settings(site.url("/page0.html"), 7)
+
+            serial_crawler = Crawler(settings)
+            while serial_crawler.pages_visited < 7:
+                if not serial_crawler.visit_next_page():
+                    break
+
+            crawler = Crawler(settings)
+            crawler.visit_multiple_pages()
+
+        self.assertEqual(crawler.pages_visited, 7,
+                         "Page limit was not honored exactly")
+        self.assertEqual(crawler.images, serial_crawler.images,
+                         "Concurrent crawl collected different images")
+        self.assertEqual(list(crawler.links_to_visit),
+                         list(serial_crawler.links_to_visit),
+                         "Concurrent crawl left different links to visit")
+
+    def test_host_connection_limit(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        with FixtureSite(make_fixture_pages(20), latency=0.05) as site:
+            settings = self.make_settings(site.url("/page0.html"), 12)
+            crawler = Crawler(settings, max_connections=8,
+                              max_host_connections=3)
+            crawler.visit_multiple_pages()
+
+            self.assertGreater(site.max_in_flight, 1,
+                               "Pages were not fetched concurrently")
+            self.assertLessEqual(site.max_in_flight, 3,
+                                 "Host connection limit was exceeded")
+
+    def test_unreachable_link_skipped(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        pages = {"/a.html": '<a href="http://127.0.0.1:1/dead.html">Dead</a>'
+                            '<a href="/b.html">B</a>',
+                 "/b.html": '<img src="/b.png" alt="Picture B">'}
+        with FixtureSite(pages) as site:
+            crawler = Crawler(self.make_settings(site.url("/a.html"), 3))
+            crawler.visit_multiple_pages()
+
+        self.assertEqual(crawler.pages_visited, 2,
+                         "A dead link stopped the other pages of its batch")
+        self.assertEqual([image.get_image_url() for image in crawler.images],
+                         [site.url("/b.png")],
+                         "The images of a page beside a dead link were lost")
+
+
+class TestCheckpoint(CrawlTestCase):
+    """Ensure that a crawl resumed from a checkpoint carries on where the
+    first one stopped"""
+
+    def test_resume_matches_full_crawl(self):
+        import os
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        checkpoint_path = os.path.join(self.temp_dir.name, 'crawl.json.gz')
+        make_settings = TestVisitMultiplePages.make_settings
+        with FixtureSite(make_fixture_pages(20)) as site:
+            start_url = site.url("/page0.html")
+            full_crawler = Crawler(make_settings(start_url, 7))
+            full_crawler.visit_multiple_pages()
+            # Each crawler reads robots.txt once, so only pages are counted
+            requests_for_full_crawl = site.get_request_count() - \
+                site.get_request_count("/robots.txt")
+
+            # Stop a crawl partway through, leaving its checkpoint behind
+            first_crawler = Crawler(make_settings(start_url, 4),
+                                    checkpoint_path=checkpoint_path,
+                                    checkpoint_interval=1)
+            first_crawler.visit_multiple_pages()
+            self.assertTrue(os.path.exists(checkpoint_path),
+                            "No checkpoint was saved")
+
+            crawler = Crawler(make_settings(start_url, 7),
+                              checkpoint_path=checkpoint_path)
+            self.assertTrue(crawler.resume(), "Crawl was not resumed")
+            crawler.visit_multiple_pages()
+
+            self.assertEqual(site.get_request_count() -
+                             site.get_request_count("/robots.txt"),
+                             2 * requests_for_full_crawl,
+                             "Pages were fetched again after resuming")
+
+        self.assertEqual(crawler.pages_visited, 7,
+                         "Page limit was not honored after resuming")
+        self.assertEqual(crawler.images, full_crawler.images,
+                         "Resumed crawl collected different images")
+        self.assertEqual(list(crawler.links_to_visit),
+                         list(full_crawler.links_to_visit),
+                         "Resumed crawl left different links to visit")
+
+    def test_other_start_url_not_resumed(self):
+        import os
+        from crawler_collage import Crawler
+
+        checkpoint_path = os.path.join(self.temp_dir.name, 'crawl.json.gz')
+        make_settings = TestVisitMultiplePages.make_settings
+        Crawler(make_settings("http://a.com/", 1),
+                checkpoint_path=checkpoint_path).save_checkpoint()
+
+        crawler = Crawler(make_settings("http://b.com/", 1),
+                          checkpoint_path=checkpoint_path)
+        self.assertFalse(crawler.resume(),
+                         "Checkpoint of a different crawl was resumed")
+
+
+class TestStreaming(CrawlTestCase):
+    """Ensure that a streaming crawl downloads the same images as one that
+    collects every image first"""
+
+    def test_matches_batch_crawl(self):
+        import io
+        import json
+        import os
+        from PIL import Image
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        pages = make_fixture_pages(20)
+        for i in range(20):
+            for name in ["named", "unnamed"]:
+                png = io.BytesIO()
+                Image.effect_noise((30, 20), 60).save(png, 'PNG')
+                pages["/{}{}.png".format(name, i)] = ("image/png",
+                                                      png.getvalue())
+        make_settings = TestVisitMultiplePages.make_settings
+
+        with FixtureSite(pages) as site:
+            settings = make_settings(site.url("/page0.html"), 12)
+            batch_crawler = Crawler(settings, image_folder='batch')
+            batch_crawler.run()
+
+            ready = []
+            crawler = Crawler(settings, image_folder='streamed',
+                              image_ready=ready.append, streaming=True,
+                              max_queued_images=2, max_memory_links=3)
+            crawler.run()
+
+        self.assertEqual(crawler.pages_visited, 12)
+        self.assertEqual(len(os.listdir('batch')), 24)
+        self.assertEqual(crawler.images, [],
+                         "A streaming crawl kept its images")
+        self.assertEqual(sorted(os.listdir('streamed')),
+                         sorted(os.listdir('batch')),
+                         "A streaming crawl downloaded other images")
+        self.assertEqual(len(ready), len(os.listdir('batch')),
+                         "Streamed images were not reported")
+        self.assertFalse(os.path.exists(crawler.spill_file.path),
+                         "The spill file was left behind")
+        with open('streamed.manifest.json') as manifest_file:
+            self.assertEqual(sorted(json.load(manifest_file)),
+                             sorted(os.listdir('streamed')),
+                             "A spilled manifest was not saved whole")
+
+    def test_full_queue_does_not_stall_crawl(self):
+        import asyncio
+        import time
+        from unittest import mock
+        from crawler_collage import Crawler, ImageDownloader
+        from fixture_site import FixtureSite
+
+        def slow_download(downloader, image):
+            time.sleep(0.2)
+
+        gaps = []
+
+        async def crawl_with_heartbeat(crawler):
+            # The heartbeat is late by as long as the event loop is held up
+            crawl = asyncio.ensure_future(crawler.crawl_pages())
+            last = time.monotonic()
+            while not crawl.done():
+                await asyncio.sleep(0.01)
+                gaps.append(time.monotonic() - last)
+                last = time.monotonic()
+            await crawl
+
+        make_settings = TestVisitMultiplePages.make_settings
+        with FixtureSite(make_fixture_pages(6)) as site:
+            crawler = Crawler(make_settings(site.url("/page0.html"), 6),
+                              streaming=True, max_queued_images=1)
+            with mock.patch.object(ImageDownloader, 'download_image',
+                                   slow_download):
+                crawler.start_downloads()
+                try:
+                    asyncio.run(crawl_with_heartbeat(crawler))
+                finally:
+                    crawler.finish_downloads()
+                    crawler.spill_file.close()
+
+        self.assertEqual(crawler.pages_visited, 6)
+        self.assertLess(max(gaps), 0.15,
+                        "A full image queue stalled the event loop")
+
+    def test_stopped_downloads_raised(self):
+        import threading
+        from unittest import mock
+        from crawler_collage import Crawler, ImageDownloader
+        from fixture_site import FixtureSite
+
+        def fail(downloader, image_queue):
+            raise OSError("No space left on device")
+
+        errors = []
+
+        def run_crawl():
+            try:
+                crawler.run()
+            except RuntimeError as error:
+                errors.append(error)
+
+        make_settings = TestVisitMultiplePages.make_settings
+        with FixtureSite(make_fixture_pages(6)) as site:
+            crawler = Crawler(make_settings(site.url("/page0.html"), 6),
+                              streaming=True, max_queued_images=1)
+            with mock.patch.object(ImageDownloader, 'download_queued', fail):
+                # The crawl runs on a thread of its own so that a hang fails
+                # the test instead of stopping it
+                crawl = threading.Thread(target=run_crawl, daemon=True)
+                crawl.start()
+                crawl.join(timeout=20)
+
+        self.assertFalse(crawl.is_alive(),
+                         "The crawl hung after the downloads stopped")
+        self.assertIsInstance(errors[0].__cause__, OSError,
+                              "The error that stopped the downloads was lost")
+
+
+class TestCrawlAndCollage(CrawlTestCase):
+    """Ensure that several crawls can be run without any user input"""
+
+    @staticmethod
+    def make_site(sections):
+        """Return pages for each section linking to pages with images"""
+        import io
+        from PIL import Image
+
+        pages = {}
+        for section in sections:
+            for i in range(3):
+                pages["/{}/page{}.html".format(section, i)] = (
+                    '<a href="/{}/page{}.html">Next</a>'
+                    '<img src="/{}/img{}.png" alt="{} {}">'.format(
+                        section, i + 1, section, i, section, i))
+                png = io.BytesIO()
+                Image.effect_noise((40 + i, 30), 50).save(png, 'PNG')
+                pages["/{}/img{}.png".format(section, i)] = (
+                    "image/png", png.getvalue())
+        return pages
+
+    def test_many_seeds(self):
+        import os
+        from crawler_collage import crawl_and_collage, HttpClient
+        from fixture_site import FixtureSite
+
+        with FixtureSite(self.make_site(["cats", "dogs"]),
+                         keep_alive=True) as site:
+            client = HttpClient()
+            urls = [site.url("/cats/page0.html"), site.url("/dogs/page0.html")]
+            collages = crawl_and_collage(urls, page_limit=3, max_jobs=2,
+                                         width=200, client=client)
+
+        self.assertEqual(sorted(collages), sorted(urls),
+                         "A seed url was not crawled")
+        for url, collage in collages.items():
+            self.assertTrue(collage and os.path.exists(collage),
+                            "No collage was made for " + url)
+            name = os.path.splitext(os.path.basename(collage))[0]
+            self.assertEqual(len(os.listdir(os.path.join('images', name))),
+                             3, "Images of a crawl were not kept apart")
+        self.assertGreater(client.get_reuse_ratio(), 0.5,
+                           "Crawls did not share pooled connections")
+
+    def test_invalid_url(self):
+        from crawler_collage import crawl_and_collage
+
+        with self.assertRaises(ValueError):
+            crawl_and_collage(["not a url"])
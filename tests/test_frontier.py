@@ -0,0 +1,109 @@
+from unittest import TestCase
+
+
+class TestNormalizeUrl(TestCase):
+
+    def test_fragment(self):
+        from crawler_collage import normalize_url
+        self.assertEqual(normalize_url("https://en.wikipedia.org/wiki/Lumbar"
+                                       "#History"),
+                         "https://en.wikipedia.org/wiki/Lumbar",
+                         "Fragment was not removed from the url")
+
+    def test_trailing_slash(self):
+        from crawler_collage import normalize_url
+        self.assertEqual(normalize_url("http://rknightly.github.io/docs/"),
+                         "http://rknightly.github.io/docs",
+                         "Trailing slash was not removed from the url")
+        self.assertEqual(normalize_url("http://rknightly.github.io"),
+                         "http://rknightly.github.io/",
+                         "Root of the site was not given a path of /")
+
+    def test_default_port(self):
+        from crawler_collage import normalize_url
+        self.assertEqual(normalize_url("HTTP://Example.COM:80/a?b=C"),
+                         "http://example.com/a?b=C",
+                         "Default port or case was not normalized")
+        self.assertEqual(normalize_url("https://example.com:8443/"),
+                         "https://example.com:8443/",
+                         "Non-default port was removed from the url")
+
+
+class TestFrontier(TestCase):
+
+    def test_order(self):
+        from crawler_collage import Frontier
+        frontier = Frontier(["http://a.com/1", "http://a.com/2"])
+        frontier.add("http://a.com/3")
+        self.assertEqual([frontier.pop() for i in range(len(frontier))],
+                         ["http://a.com/1", "http://a.com/2",
+                          "http://a.com/3"],
+                         "Links were not returned in the order queued")
+
+    def test_seen_links_not_queued(self):
+        from crawler_collage import Frontier
+        frontier = Frontier(["http://a.com/1"])
+        frontier.pop()
+        self.assertFalse(frontier.add("http://a.com/1#top"),
+                         "Visited link was queued again")
+        frontier.extend(["http://a.com/2", "http://a.com/2/",
+                         "http://a.com:80/2"])
+        self.assertEqual(list(frontier), ["http://a.com/2"],
+                         "Same link was queued more than once")
+        self.assertEqual(frontier.get_seen_count(), 2,
+                         "Seen links were miscounted")
+
+    def test_links_queued_as_written(self):
+        from crawler_collage import Frontier
+        frontier = Frontier(["http://a.com/docs/"])
+        frontier.add("http://a.com/docs")
+        self.assertEqual(list(frontier), ["http://a.com/docs/"],
+                         "A directory link was not fetched as written")
+
+
+class TestSpilledFrontier(TestCase):
+    """Ensure that a frontier held mostly on disk behaves like one held in
+    memory"""
+
+    def setUp(self):
+        from crawler_collage import SpillFile
+
+        self.spill_file = SpillFile()
+
+    def tearDown(self):
+        self.spill_file.close()
+
+    def test_matches_memory_frontier(self):
+        import random
+        from crawler_collage import Frontier
+
+        generator = random.Random(2)
+        frontier = Frontier()
+        spilled = Frontier(spill_file=self.spill_file, max_memory_links=5)
+        for step in range(2000):
+            if generator.random() < 0.6 or not len(frontier):
+                url = "http://a.com/{}".format(generator.randrange(500))
+                self.assertEqual(spilled.add(url), frontier.add(url),
+                                 "A link was queued differently")
+            else:
+                self.assertEqual(spilled.pop(), frontier.pop(),
+                                 "Links were popped in another order")
+            self.assertEqual(len(spilled), len(frontier))
+
+        self.assertEqual(list(spilled), list(frontier),
+                         "Queued links differ")
+        self.assertEqual(spilled.get_seen_count(), frontier.get_seen_count(),
+                         "Seen links were miscounted")
+        self.assertLessEqual(len(spilled.queue.head), 5,
+                             "More links than the budget were in memory")
+        self.assertFalse(spilled.seen.items,
+                         "Seen links were kept in memory past the budget")
+
+    def test_spill_file_removed(self):
+        import os
+
+        path = self.spill_file.path
+        self.assertTrue(os.path.exists(path))
+        self.spill_file.close()
+        self.assertFalse(os.path.exists(path),
+                         "The spill file was left behind")
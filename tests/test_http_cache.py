@@ -0,0 +1,140 @@
+from unittest import TestCase
+
+
+class CacheTestCase(TestCase):
+    """Keep the cache of each test in a temporary directory"""
+
+    def setUp(self):
+        import tempfile
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_cache(self, **kwargs):
+        from crawler_collage import HttpCache
+
+        return HttpCache(path=self.temp_dir.name, **kwargs)
+
+    @staticmethod
+    def read_url(cache, url):
+        response = cache.open(url)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+
+class TestRevalidation(CacheTestCase):
+
+    def test_not_modified_served_from_disk(self):
+        from fixture_site import FixtureSite
+
+        body = b"x" * 500
+        pages = {"/etag.png": ("image/png", body, {"ETag": '"v1"'}),
+                 "/dated.png": ("image/png", body,
+                                {"Last-Modified":
+                                 "Mon, 05 Oct 2026 10:00:00 GMT"})}
+        with FixtureSite(pages) as site:
+            cache = self.make_cache()
+            for path in pages:
+                self.read_url(cache, site.url(path))
+            cache.save()
+
+            # A new cache reads the index the first one saved
+            cache = self.make_cache()
+            for path in pages:
+                self.assertEqual(self.read_url(cache, site.url(path)), body,
+                                 "Stored body was served incorrectly")
+
+            self.assertEqual(site.not_modified_count, 2,
+                             "Stored responses were not revalidated")
+        self.assertEqual((cache.hits, cache.misses), (2, 0),
+                         "Cache hits and misses were miscounted")
+
+    def test_unvalidated_response_not_stored(self):
+        from fixture_site import FixtureSite
+
+        with FixtureSite({"/plain.html": "<p>Plain</p>"}) as site:
+            cache = self.make_cache()
+            self.read_url(cache, site.url("/plain.html"))
+            self.read_url(cache, site.url("/plain.html"))
+
+        self.assertEqual((cache.hits, cache.misses), (0, 2),
+                         "Response without validators was cached")
+
+    def test_partial_read_not_stored(self):
+        from fixture_site import FixtureSite
+
+        pages = {"/big.png": ("image/png", b"x" * 5000, {"ETag": '"v1"'})}
+        with FixtureSite(pages) as site:
+            cache = self.make_cache()
+            response = cache.open(site.url("/big.png"))
+            response.read(100)
+            response.close()
+
+        self.assertEqual(len(cache.entries), 0,
+                         "Partly read body was stored")
+
+
+class TestEviction(CacheTestCase):
+
+    def test_least_recently_used_evicted(self):
+        from fixture_site import FixtureSite
+
+        pages = {"/img{}.png".format(i): ("image/png", bytes([i]) * 400,
+                                          {"ETag": '"{}"'.format(i)})
+                 for i in range(3)}
+        with FixtureSite(pages) as site:
+            cache = self.make_cache(max_size=1000)
+            self.read_url(cache, site.url("/img0.png"))
+            self.read_url(cache, site.url("/img1.png"))
+            # Use the first image again so that the second is the oldest
+            self.read_url(cache, site.url("/img0.png"))
+            self.read_url(cache, site.url("/img2.png"))
+
+        self.assertEqual(list(cache.entries),
+                         [site.url("/img0.png"), site.url("/img2.png")],
+                         "Least recently used response was not evicted")
+        self.assertEqual(cache.evictions, 1, "Evictions were miscounted")
+        self.assertLessEqual(cache.total_size, 1000,
+                             "Cache grew past its size limit")
+
+    def test_least_recently_used_validators_dropped(self):
+        from email.message import Message
+
+        headers = Message()
+        headers["ETag"] = '"v1"'
+        cache = self.make_cache(max_validators=2)
+        for url in ["http://a/0.png", "http://a/1.png", "http://a/2.png"]:
+            cache.record_kept(url, headers, "checksum", 100)
+        cache.save()
+
+        self.assertEqual(list(self.make_cache(max_validators=2).validators),
+                         ["http://a/1.png", "http://a/2.png"],
+                         "Validators grew past their limit")
+
+    def test_unindexed_bodies_removed(self):
+        import os
+        from fixture_site import FixtureSite
+
+        pages = {"/img{}.png".format(i): ("image/png", bytes([i]) * 400,
+                                          {"ETag": '"{}"'.format(i)})
+                 for i in range(2)}
+        with FixtureSite(pages) as site:
+            cache = self.make_cache()
+            self.read_url(cache, site.url("/img0.png"))
+            cache.save()
+            # The run stops after storing another body but before saving
+            # the index
+            self.read_url(cache, site.url("/img1.png"))
+
+        cache = self.make_cache()
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)),
+                         sorted(['index.json', 'validators.json',
+                                 os.path.basename(cache.find_body_path(
+                                     site.url("/img0.png")))]),
+                         "A body missing from the index was left on disk")
+        self.assertEqual(cache.total_size, 400,
+                         "Stored bodies were miscounted")
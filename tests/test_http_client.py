@@ -0,0 +1,127 @@
+from unittest import TestCase
+
+
+class TestConnectionPool(TestCase):
+
+    def test_connections_reused(self):
+        from crawler_collage import HttpClient
+        from fixture_site import FixtureSite
+
+        pages = {"/page{}.html".format(i): "<p>Page {}</p>".format(i)
+                 for i in range(5)}
+        with FixtureSite(pages, keep_alive=True) as site:
+            client = HttpClient()
+            for path in sorted(pages):
+                with client.open(site.url(path)) as response:
+                    self.assertEqual(response.read(),
+                                     pages[path].encode("utf-8"),
+                                     "Body was read incorrectly")
+
+            self.assertEqual(site.connection_count, 1,
+                             "Connection was not kept alive")
+        self.assertEqual(client.get_reuse_ratio(), 0.8,
+                         "Connection reuse was miscounted")
+        self.assertEqual(list(client.get_host_latencies()),
+                         [site.url("")[len("http://"):]],
+                         "Host latency was not recorded")
+
+    def test_partial_read_not_reused(self):
+        from crawler_collage import HttpClient
+        from fixture_site import FixtureSite
+
+        pages = {"/big.png": ("image/png", b"x" * 200000),
+                 "/small.png": ("image/png", b"y" * 200)}
+        with FixtureSite(pages, keep_alive=True) as site:
+            client = HttpClient()
+            response = client.open(site.url("/big.png"))
+            response.read(100)
+            response.close()
+            with client.open(site.url("/small.png")) as response:
+                self.assertEqual(response.read(), b"y" * 200,
+                                 "Body after an abandoned one was wrong")
+
+            self.assertEqual(site.connection_count, 2,
+                             "Connection with unread body was reused")
+
+    def test_short_remainder_drained(self):
+        from crawler_collage import HttpClient
+        from fixture_site import FixtureSite
+
+        pages = {"/small.png": ("image/png", b"x" * 5000),
+                 "/unread.png": ("image/png", b"y" * 5000),
+                 "/next.png": ("image/png", b"z" * 200)}
+        with FixtureSite(pages, keep_alive=True) as site:
+            client = HttpClient()
+            response = client.open(site.url("/small.png"))
+            response.read(100)
+            response.close()
+            client.open(site.url("/unread.png")).close()
+            with client.open(site.url("/next.png")) as response:
+                self.assertEqual(response.read(), b"z" * 200,
+                                 "Body after a drained one was wrong")
+
+            self.assertEqual(site.connection_count, 1,
+                             "Connection with a short unread body was not "
+                             "reused")
+
+    def test_errors_raised(self):
+        import urllib.error
+        from crawler_collage import HttpClient
+        from fixture_site import FixtureSite
+
+        with FixtureSite({}, keep_alive=True) as site:
+            client = HttpClient()
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                client.open(site.url("/missing.html"))
+            self.assertEqual(raised.exception.code, 404,
+                             "Wrong error status raised")
+
+
+class TestProxies(TestCase):
+
+    def test_request_sent_through_proxy(self):
+        from crawler_collage import HttpClient
+        from fixture_site import FixtureSite
+
+        # The fixture site stands in for the proxy, which is asked for the
+        # whole url
+        url = "http://proxied.example/page.html"
+        with FixtureSite({url: "<p>Proxied</p>"}) as proxy:
+            client = HttpClient(proxies={"http": proxy.url("")})
+            with client.open(url) as response:
+                self.assertEqual(response.read(), b"<p>Proxied</p>",
+                                 "Body was read incorrectly")
+            self.assertEqual(proxy.get_request_count(url), 1,
+                             "Request did not go through the proxy")
+
+    def test_no_proxy_honored(self):
+        from crawler_collage import HttpClient
+        from fixture_site import FixtureSite
+
+        with FixtureSite({"/page.html": "<p>Direct</p>"}) as site:
+            client = HttpClient(proxies={"http": "http://127.0.0.1:1",
+                                         "no": "127.0.0.1"})
+            with client.open(site.url("/page.html")) as response:
+                self.assertEqual(response.read(), b"<p>Direct</p>",
+                                 "Host in no_proxy was sent to the proxy")
+
+
+class TestContentDecoding(TestCase):
+
+    def test_gzip_decoded(self):
+        import gzip
+        from crawler_collage import HttpClient
+        from fixture_site import FixtureSite
+
+        body = b"<p>Compressed</p>" * 1000
+        pages = {"/page.html": ("text/html", gzip.compress(body),
+                                {"Content-Encoding": "gzip"})}
+        with FixtureSite(pages) as site:
+            client = HttpClient()
+            with client.open(site.url("/page.html")) as response:
+                chunks = list(iter(lambda: response.read(1000), b''))
+                self.assertIsNone(response.info()["Content-Length"],
+                                  "Compressed length was kept")
+
+        self.assertEqual(b''.join(chunks), body,
+                         "Compressed body was not decoded")
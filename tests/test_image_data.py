@@ -42,3 +42,27 @@ class TestMakeName(TestCase):
                          "fighter_jet_no_1_best_in_Texas.png",
                          "Underscores were not properly inserted into the"
                          " name with several spaces")
+
+
+class TestCompactRecord(TestCase):
+
+    def test_no_instance_dict(self):
+        from crawler_collage import ImageData
+        image = ImageData(image_url="http://a.com/1.png", alt_text="One",
+                          unnamed_image_count=0)
+        self.assertFalse(hasattr(image, '__dict__'),
+                         "Images should keep their fields in slots")
+        with self.assertRaises(AttributeError):
+            image.extra = True
+
+    def test_equal_by_fields(self):
+        from crawler_collage import ImageData
+        image = ImageData(image_url="http://a.com/1.png", alt_text="One",
+                          unnamed_image_count=0)
+        same = ImageData(image_url="http://a.com/1.png", alt_text="One",
+                         unnamed_image_count=0)
+        other = ImageData(image_url="http://a.com/2.png", alt_text="One",
+                          unnamed_image_count=0)
+        self.assertEqual(image, same)
+        self.assertEqual(hash(image), hash(same))
+        self.assertNotEqual(image, other)
@@ -0,0 +1,360 @@
+from unittest import TestCase
+
+
+class ImageFolderTestCase(TestCase):
+    """Run each test from a temporary directory so that the images folder
+    the downloader clears is a throwaway one"""
+
+    def setUp(self):
+        import os
+        import tempfile
+
+        self.old_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        import os
+
+        os.chdir(self.old_dir)
+        self.temp_dir.cleanup()
+
+    @staticmethod
+    def make_site_images(count, size=2000):
+        """Return fixture pages holding `count` distinct image bodies"""
+
+        return {"/img{}.png".format(i): ("image/png",
+                                         bytes([i % 256]) * (size + i))
+                for i in range(count)}
+
+    @staticmethod
+    def make_image_data(site, paths):
+        from crawler_collage import ImageData
+
+        return [ImageData(image_url=site.url(path), alt_text="Image " + str(i),
+                          unnamed_image_count=0)
+                for i, path in enumerate(paths)]
+
+
+class TestDownloadImages(ImageFolderTestCase):
+
+    def test_parallel_download(self):
+        import os
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = self.make_site_images(6)
+        # Serve the same bytes under a second url
+        pages["/copy.png"] = pages["/img0.png"]
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, sorted(pages))
+            downloader = ImageDownloader(images, workers=4)
+            downloader.run()
+
+        self.assertEqual(len(os.listdir('./images')), 6,
+                         "Duplicate image was not removed")
+        self.assertEqual(downloader.images_downloaded, 6,
+                         "Downloaded images were miscounted")
+        for image in images:
+            path = downloader.find_image_path(image)
+            if os.path.exists(path):
+                with open(path, 'rb') as image_file:
+                    self.assertEqual(
+                        image_file.read(),
+                        pages[image.get_image_url()[len(site.url('')):]][1],
+                        "Image was not written to disk correctly")
+
+    def test_unreachable_image_skipped(self):
+        import os
+        from crawler_collage import ImageData, ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = self.make_site_images(2)
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, sorted(pages))
+            images.insert(1, ImageData(image_url="http://127.0.0.1:1/dead.png",
+                                       alt_text="Dead", unnamed_image_count=0))
+            downloader = ImageDownloader(images, workers=2)
+            downloader.run()
+
+        self.assertEqual(len(os.listdir('./images')), 2,
+                         "An unreachable image stopped the other downloads")
+
+
+class TestValidateDownload(ImageFolderTestCase):
+
+    def test_single_request_per_image(self):
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = self.make_site_images(3)
+        with FixtureSite(pages) as site:
+            downloader = ImageDownloader(self.make_image_data(site,
+                                                              sorted(pages)))
+            downloader.run()
+            for path in pages:
+                self.assertEqual(site.get_request_count(path), 1,
+                                 "Image was requested more than once")
+
+    def test_missing_content_length(self):
+        import os
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = {"/streamed.png": ("image/png", b'\x01' * 5000,
+                                   {"Content-Length": None}),
+                 "/blank.png": ("image/png", b'\x02' * 50,
+                                {"Content-Length": None})}
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, ["/streamed.png",
+                                                 "/blank.png"])
+            downloader = ImageDownloader(images)
+            downloader.run()
+
+        self.assertTrue(os.path.exists(downloader.find_image_path(images[0])),
+                        "Image without a Content-Length was not streamed")
+        self.assertFalse(os.path.exists(downloader.find_image_path(
+            images[1])), "Blank image without a Content-Length was kept")
+
+    def test_size_limits(self):
+        import os
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = {"/small.png": ("image/png", b'\x01' * 50),
+                 "/medium.png": ("image/png", b'\x02' * 5000),
+                 "/large.png": ("image/png", b'\x03' * 500000),
+                 "/unsized.png": ("image/png", b'\x04' * 500000,
+                                  {"Content-Length": None})}
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, sorted(pages))
+            downloader = ImageDownloader(images, max_size=100000)
+            downloader.run()
+
+        self.assertEqual(os.listdir('./images'),
+                         [images[1].get_file_name()],
+                         "Size limits were not applied to the downloads")
+
+
+class TestImageStore(ImageFolderTestCase):
+
+    def test_identical_images_stored_once(self):
+        import json
+        import os
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = self.make_site_images(2)
+        pages["/copy.png"] = pages["/img0.png"]
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, sorted(pages))
+            downloader = ImageDownloader(images)
+            downloader.run()
+
+            self.assertEqual(sorted(os.listdir('./image_store')),
+                             sorted(downloader.image_checksums),
+                             "Images were not stored once by checksum")
+            with open('./images.manifest.json') as manifest_file:
+                manifest = json.load(manifest_file)
+            self.assertEqual(sorted(manifest), sorted(os.listdir('./images')),
+                             "Manifest does not match the images folder")
+
+            # A second run finds every image already in the store
+            downloader = ImageDownloader(images)
+            downloader.run()
+
+        self.assertEqual(downloader.images_reused, 2,
+                         "Stored images were not reused across runs")
+        self.assertEqual(len(os.listdir('./images')), 2,
+                         "Images folder was not rebuilt from the store")
+
+    def test_unchanged_images_linked_from_store(self):
+        import os
+        from crawler_collage import HttpCache, ImageDownloader, ImageStore
+        from fixture_site import FixtureSite
+
+        class CountingStore(ImageStore):
+            temp_files = 0
+
+            def make_temp_file(self):
+                self.temp_files += 1
+                return super().make_temp_file()
+
+        pages = {"/img{}.png".format(i): ("image/png", bytes([i]) * 2000,
+                                          {"ETag": '"{}"'.format(i)})
+                 for i in range(2)}
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, sorted(pages))
+            cache = HttpCache('./cache')
+            ImageDownloader(images, cache=cache).run()
+            cache.save()
+
+            self.assertEqual(sorted(os.listdir('./cache')),
+                             ['index.json', 'validators.json'],
+                             "Image bodies were kept in the cache as well as "
+                             "in the store")
+
+            # A second run revalidates the images and links the stored ones
+            store = CountingStore(manifest_path='./images.manifest.json')
+            downloader = ImageDownloader(images, cache=HttpCache('./cache'),
+                                         store=store)
+            downloader.run()
+
+            self.assertEqual(site.not_modified_count, 2,
+                             "Stored images were not revalidated")
+        self.assertEqual(store.temp_files, 0,
+                         "Unchanged images were written to disk again")
+        self.assertEqual(downloader.images_reused, 2,
+                         "Stored images were not reused")
+        self.assertEqual(len(os.listdir('./images')), 2,
+                         "Images folder was not rebuilt from the store")
+
+
+class TestImageReady(ImageFolderTestCase):
+
+    def test_saved_images_reported(self):
+        import os
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = self.make_site_images(3)
+        pages["/copy.png"] = pages["/img0.png"]
+        ready = []
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, sorted(pages))
+            downloader = ImageDownloader(images, workers=2,
+                                         image_ready=ready.append)
+            downloader.run()
+
+        # Either copy of the duplicate image may be the one kept
+        self.assertEqual(sorted(ready),
+                         sorted(os.path.join('./images', name) for name in
+                                os.listdir('./images')),
+                         "Saved images were not each reported once")
+        self.assertEqual(len(ready), 3, "Duplicate image was reported")
+
+
+class TestNearDuplicates(ImageFolderTestCase):
+
+    @staticmethod
+    def encode(image, image_format):
+        import io
+
+        image_file = io.BytesIO()
+        image.convert('RGB').save(image_file, image_format)
+        return image_file.getvalue()
+
+    def test_resized_copies_left_out(self):
+        import os
+        from PIL import Image
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        picture = Image.effect_mandelbrot((240, 160), (-2, -0.6, 1, 1.2),
+                                          50)
+        other = Image.linear_gradient('L').resize((240, 160))
+        pages = {"/picture.png": ("image/png", self.encode(picture, 'PNG')),
+                 "/small.jpg": ("image/jpeg", self.encode(
+                     picture.resize((120, 80)), 'JPEG')),
+                 "/other.png": ("image/png", self.encode(other, 'PNG'))}
+        paths = ["/picture.png", "/small.jpg", "/other.png"]
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, paths)
+            downloader = ImageDownloader(images)
+            downloader.run()
+
+        self.assertEqual(sorted(os.listdir('./images')),
+                         sorted([images[0].get_file_name(),
+                                 images[2].get_file_name()]),
+                         "A resized copy of an image was kept")
+        self.assertEqual(downloader.near_duplicates, 1,
+                         "Near duplicate images were miscounted")
+
+    def test_hashes_match_across_methods(self):
+        import io
+        from PIL import Image
+        from crawler_collage import PERCEPTUAL_HASHES, find_hash_distance
+
+        picture = Image.effect_mandelbrot((240, 160), (-2, -0.6, 1, 1.2),
+                                          50)
+        other = Image.linear_gradient('L').resize((240, 160))
+        for name, find_hash in PERCEPTUAL_HASHES.items():
+            picture_hash, copy_hash, other_hash = [
+                find_hash(io.BytesIO(self.encode(image, image_format)))
+                for image, image_format in [(picture, 'PNG'),
+                                            (picture.resize((100, 66)),
+                                             'JPEG'),
+                                            (other, 'PNG')]]
+            self.assertLessEqual(find_hash_distance(picture_hash, copy_hash),
+                                 4, name + " of a resized copy moved")
+            self.assertGreater(find_hash_distance(picture_hash, other_hash),
+                               10, name + " of another image was close")
+
+    def test_dhash_without_numpy(self):
+        import io
+        from unittest import mock
+        from PIL import Image
+        import crawler_collage
+
+        picture = io.BytesIO(self.encode(Image.effect_mandelbrot(
+            (240, 160), (-2, -0.6, 1, 1.2), 50), 'PNG'))
+        expected = crawler_collage.find_dhash(picture)
+        with mock.patch.object(crawler_collage, 'numpy', None):
+            self.assertEqual(crawler_collage.find_dhash(picture), expected,
+                             "dhash differs when numpy is missing")
+
+    def test_phash_without_numpy(self):
+        from unittest import mock
+        import crawler_collage
+
+        with mock.patch.object(crawler_collage, 'numpy', None):
+            with self.assertRaises(ImportError):
+                crawler_collage.ImageDownloader([], perceptual_hash="phash")
+
+    def test_decompression_bomb_kept_as_exact_copy(self):
+        import os
+        from unittest import mock
+        from PIL import Image
+        from crawler_collage import ImageDownloader
+        from fixture_site import FixtureSite
+
+        pages = self.make_site_images(2)
+        pages["/big.png"] = ("image/png", self.encode(
+            Image.linear_gradient('L'), 'PNG'))
+        with FixtureSite(pages) as site:
+            images = self.make_image_data(site, sorted(pages))
+            downloader = ImageDownloader(images, workers=2)
+            # Any image larger than 100 pixels is taken for a bomb
+            with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 50):
+                downloader.run()
+
+        self.assertEqual(len(os.listdir('./images')), 3,
+                         "An image too large to decode stopped the "
+                         "downloads")
+
+
+class TestHashIndexes(TestCase):
+
+    def test_matches_linear_search(self):
+        import random
+        from crawler_collage import MultiIndexHash, SpillFile, \
+            SpillHashIndex, find_hash_distance
+
+        generator = random.Random(4)
+        hashes = [generator.getrandbits(16) for i in range(500)]
+        spill_file = SpillFile()
+        self.addCleanup(spill_file.close)
+        for index in [MultiIndexHash(3, hash_bits=16),
+                      SpillHashIndex(3, spill_file, 100, hash_bits=16)]:
+            for i, value in enumerate(hashes):
+                index.add(value, str(i))
+
+            self.assertEqual(len(index), 500)
+            for query in hashes[:20] + [generator.getrandbits(16)
+                                        for i in range(20)]:
+                expected = sorted(str(i) for i, value in enumerate(hashes)
+                                  if find_hash_distance(query, value) <= 3)
+                self.assertEqual(sorted(item for distance, value, item in
+                                        index.find(query, 3)), expected,
+                                 type(index).__name__ + " missed hashes "
+                                 "within the distance")
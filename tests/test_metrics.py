@@ -0,0 +1,118 @@
+from unittest import TestCase
+
+
+class TestMetrics(TestCase):
+    """Ensure that stage timings and counts are kept and exported"""
+
+    def test_prometheus_export(self):
+        from collage_maker.metrics import Metrics
+
+        metrics = Metrics()
+        for seconds in [0.002, 0.02, 0.2, 20.0]:
+            metrics.observe('fetch', seconds)
+        metrics.increment('pages_visited', 3)
+        metrics.set_depth('frontier', 7)
+        metrics.set_depth('frontier', 2)
+        lines = metrics.to_prometheus().splitlines()
+
+        self.assertIn('crawler_collage_pages_visited_total 3', lines)
+        self.assertIn('crawler_collage_queue_depth{queue="frontier"} 2',
+                      lines)
+        self.assertIn('crawler_collage_queue_max_depth{queue="frontier"} 7',
+                      lines)
+        self.assertIn('crawler_collage_stage_seconds_bucket{stage="fetch",'
+                      'le="0.025"} 2', lines)
+        self.assertIn('crawler_collage_stage_seconds_bucket{stage="fetch",'
+                      'le="+Inf"} 4', lines)
+        self.assertIn('crawler_collage_stage_seconds_count{stage="fetch"} 4',
+                      lines)
+
+    def test_json_export(self):
+        import json
+        from collage_maker.metrics import Metrics
+
+        metrics = Metrics()
+        with metrics.time_stage('parse'):
+            pass
+        metrics.increment('bytes_fetched', 1000)
+        exported = json.loads(metrics.to_json())
+
+        self.assertEqual(exported['counters'], {'bytes_fetched': 1000})
+        self.assertGreater(exported['rates']['bytes_fetched'], 0)
+        self.assertEqual(exported['stages']['parse']['count'], 1)
+
+    def test_stage_profiled(self):
+        from collage_maker.metrics import Metrics
+
+        def busy_function():
+            return sum(range(1000))
+
+        spans = []
+        metrics = Metrics(profile_stages=['resize'],
+                          stage_hook=lambda stage, start, seconds:
+                          spans.append(stage))
+        for i in range(3):
+            with metrics.time_stage('resize'):
+                busy_function()
+        with metrics.time_stage('paste'):
+            busy_function()
+
+        stats = metrics.get_profile_stats('resize')
+        calls = [calls for (path, line, name), (primitive_calls, calls, *rest)
+                 in stats.stats.items() if name == 'busy_function']
+        self.assertEqual(calls, [3], "Profiled runs of a stage were lost")
+        self.assertIsNone(metrics.get_profile_stats('paste'),
+                          "A stage was profiled without being asked for")
+        self.assertEqual(spans, ['resize'] * 3 + ['paste'],
+                         "The stage hook was not called for every run")
+
+
+class TestCrawlMetrics(TestCase):
+    """Ensure that a crawl records every stage from fetch to save"""
+
+    def setUp(self):
+        import os
+        import tempfile
+
+        self.old_dir = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        import os
+
+        os.chdir(self.old_dir)
+        self.temp_dir.cleanup()
+
+    def test_command_line_metrics(self):
+        import io
+        import json
+        from PIL import Image
+        from crawler_collage import main
+        from fixture_site import FixtureSite
+
+        pages = {}
+        for i in range(3):
+            pages["/page{}.html".format(i)] = (
+                '<a href="/page{}.html">Next</a>'
+                '<img src="/img{}.png" alt="Image {}">'.format(i + 1, i, i))
+            png = io.BytesIO()
+            Image.effect_noise((60, 40), 60).save(png, 'PNG')
+            pages["/img{}.png".format(i)] = ("image/png", png.getvalue())
+
+        with FixtureSite(pages) as site:
+            self.assertEqual(main(["-q", "-p", "3", "-w", "200",
+                                   "--metrics", "metrics.json",
+                                   site.url("/page0.html")]), 0)
+
+        with open("metrics.json") as metrics_file:
+            metrics = json.load(metrics_file)
+        self.assertEqual(metrics['counters']['pages_visited'], 3)
+        self.assertEqual(metrics['counters']['images_downloaded'], 3)
+        self.assertGreater(metrics['counters']['bytes_fetched'], 0)
+        self.assertIn('frontier', metrics['queues'])
+        self.assertIn('download_queue', metrics['queues'])
+        for stage in ['fetch', 'parse', 'dedup', 'download', 'probe',
+                      'resize', 'paste', 'save']:
+            self.assertIn(stage, metrics['stages'],
+                          "The {} stage was not timed".format(stage))
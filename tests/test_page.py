@@ -48,8 +48,8 @@ class TestCollectImages(TestCase):
                                     alt_text="WD4E",
                                     unnamed_image_count=5)
         page_img = page.get_images().pop()
-        self.assertTrue(page_img.__dict__ == expected_result.__dict__,
-                        "Single image collected incorrectly")
+        self.assertEqual(page_img, expected_result,
+                         "Single image collected incorrectly")
 
     def test_multiple_imgs(self):
         from crawler_collage import Page
@@ -93,3 +93,60 @@ class TestVerifyAbsUrl(TestCase):
             "https://wikimedia.org",
             "Absolute url incorrectly calculated when given incomplete"
             " absolute url")
+
+
+class TestSingleFetch(TestCase):
+
+    def test_page_requested_once(self):
+        from crawler_collage import Page
+        from fixture_site import FixtureSite
+
+        html = ('<a href="/one.html">One</a>'
+                '<img src="/logo.png" alt="Site logo">'
+                '<a href="/two.html">Two</a>')
+        with FixtureSite({"/index.html": html}) as site:
+            page = Page(site.url("/index.html"))
+            page.collect_images(total_unnamed_image_count=0)
+
+            self.assertEqual(site.get_request_count("/index.html"), 1,
+                             "Page was requested more than once")
+            self.assertEqual(page.get_links(),
+                             [site.url("/one.html"), site.url("/two.html")],
+                             "Links were not collected from the single fetch")
+            self.assertEqual([img.get_image_url() for img in
+                              page.get_images()],
+                             [site.url("/logo.png")],
+                             "Images were not collected from the single"
+                             " fetch")
+
+
+class TestParsers(TestCase):
+
+    def test_parsers_agree(self):
+        from crawler_collage import Page, PARSERS
+        from fixture_site import FixtureSite
+
+        html = ('<html><head><title>Parsers</title></head><body>'
+                '<A HREF="/one.html">One</A>'
+                '<a name="no-href">Anchor</a>'
+                '<a href="/two.html?a=1&amp;b=2">Two</a>'
+                '<p><img src="/logo.png" alt="Café logo"/></p>'
+                '<img src="/blank.png" alt>'
+                '<IMG SRC="/plain.png">'
+                '<script>var s = "<a href=\'/script.html\'>";</script>'
+                '</body></html>')
+        pages = {"/index.html": ("text/html; charset=utf-8",
+                                 html.encode("utf-8"))}
+        with FixtureSite(pages) as site:
+            results = {}
+            for parser in PARSERS:
+                page = Page(site.url("/index.html"), parser=parser)
+                results[parser] = (page.hrefs, page.image_tags)
+
+        expected = (["/one.html", "/two.html?a=1&b=2"],
+                    [("/logo.png", "Café logo"), ("/blank.png", ""),
+                     ("/plain.png", "None")])
+        for parser, result in results.items():
+            self.assertEqual(result, expected,
+                             "The " + parser + " parser read the page"
+                             " differently")
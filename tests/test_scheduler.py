@@ -0,0 +1,199 @@
+from unittest import TestCase
+
+
+def make_settings(url, page_lim):
+    from crawler_collage import CrawlerUserInput
+
+    return CrawlerUserInput(url, page_lim)
+
+
+def make_pages(page_count):
+    """Return pages that each link to the next one"""
+
+    return {"/page{}.html".format(i):
+            '<a href="/page{}.html">Next</a>'.format(i + 1)
+            for i in range(page_count)}
+
+
+class TestRobots(TestCase):
+    """Ensure that the crawl keeps to what robots.txt allows"""
+
+    def test_disallowed_pages_skipped(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        pages = make_pages(3)
+        pages["/page0.html"] += '<a href="/private/secret.html">Secret</a>'
+        pages["/private/secret.html"] = '<a href="/page9.html">Hidden</a>'
+        pages["/robots.txt"] = ("text/plain",
+                                b"User-agent: *\nDisallow: /private/\n")
+        with FixtureSite(pages) as site:
+            crawler = Crawler(make_settings(site.url("/page0.html"), 5))
+            crawler.visit_multiple_pages()
+
+            self.assertEqual(site.get_request_count("/private/secret.html"),
+                             0, "A disallowed page was fetched")
+            self.assertEqual(site.get_request_count("/robots.txt"), 1,
+                             "robots.txt was not fetched once per host")
+        self.assertEqual(crawler.scheduler.pages_disallowed, 1,
+                         "The disallowed page was not counted")
+
+    def test_forbidden_robots_disallows_all(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        with FixtureSite(make_pages(3),
+                         statuses={"/robots.txt": [403]}) as site:
+            crawler = Crawler(make_settings(site.url("/page0.html"), 3))
+            crawler.visit_multiple_pages()
+
+            self.assertEqual(site.get_request_count("/page0.html"), 0,
+                             "A page was fetched from a forbidden site")
+        self.assertEqual(crawler.pages_visited, 0,
+                         "A page was visited on a forbidden site")
+
+    def test_crawl_delay_honored(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        pages = make_pages(2)
+        pages["/robots.txt"] = ("text/plain",
+                                b"User-agent: *\nCrawl-delay: 1\n")
+        with FixtureSite(pages) as site:
+            crawler = Crawler(make_settings(site.url("/page0.html"), 2))
+            crawler.visit_multiple_pages()
+            times = [site.get_request_times("/page{}.html".format(i))[0]
+                     for i in range(2)]
+
+        self.assertEqual(crawler.pages_visited, 2)
+        for earlier, later in zip(times, times[1:]):
+            self.assertGreaterEqual(later - earlier, 0.99,
+                                    "Requests were closer than the "
+                                    "Crawl-delay")
+
+
+class TestThrottling(TestCase):
+    """Ensure that hosts that are too busy are backed off from"""
+
+    def test_retry_after_honored(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        with FixtureSite(make_pages(2), statuses={
+                "/page1.html": [(429, {"Retry-After": "0.3"})]}) as site:
+            crawler = Crawler(make_settings(site.url("/page0.html"), 2))
+            crawler.visit_multiple_pages()
+            times = site.get_request_times("/page1.html")
+
+        self.assertEqual(len(times), 2, "The throttled page was not retried")
+        self.assertGreaterEqual(times[1] - times[0], 0.29,
+                                "Retry-After was not waited for")
+        self.assertEqual(crawler.pages_visited, 2,
+                         "The retried page was not visited")
+        self.assertEqual(crawler.scheduler.throttled_responses, 1)
+
+    def test_retries_limited(self):
+        from crawler_collage import Crawler, HostScheduler
+        from fixture_site import FixtureSite
+
+        with FixtureSite(make_pages(1), statuses={
+                "/page0.html": [503] * 5}) as site:
+            crawler = Crawler(make_settings(site.url("/page0.html"), 1),
+                              scheduler=HostScheduler(max_delay=0.05),
+                              max_retries=2)
+            crawler.visit_multiple_pages()
+
+            self.assertEqual(site.get_request_count("/page0.html"), 3,
+                             "A busy page was not tried max_retries more "
+                             "times")
+
+    def test_hosts_paced_apart(self):
+        import asyncio
+        import time
+        from crawler_collage import HostScheduler
+
+        scheduler = HostScheduler()
+        scheduler.record_response("http://slow.com/", 0.1, 503,
+                                  retry_after="0.5")
+
+        async def visit_hosts():
+            start = time.monotonic()
+            await scheduler.wait_turn("http://fast.com/")
+            fast_wait = time.monotonic() - start
+            await scheduler.wait_turn("http://slow.com/")
+            return fast_wait, time.monotonic() - start
+
+        fast_wait, slow_wait = asyncio.run(visit_hosts())
+        self.assertLess(fast_wait, 0.1, "A host waited on another host")
+        self.assertGreaterEqual(slow_wait, 0.45,
+                                "A busy host was not backed off from")
+
+    def test_delay_follows_latency(self):
+        from crawler_collage import HostScheduler
+
+        scheduler = HostScheduler(target_concurrency=2.0)
+        for i in range(20):
+            scheduler.record_response("http://a.com/", 0.4, 200)
+        self.assertAlmostEqual(scheduler.get_host("http://a.com/").delay, 0.2,
+                               places=3, msg="Delay did not follow latency")
+
+
+class TestSeveralHosts(TestCase):
+    """Ensure that a host that has to be waited on does not hold up the
+    pages of other hosts"""
+
+    @staticmethod
+    def make_fast_pages(other_url):
+        """Return ten pages that each link to the next one, the first also
+        linking to a page on another host"""
+
+        pages = make_pages(10)
+        pages["/page0.html"] = '<a href="{}">Other</a>'.format(other_url) + \
+            pages["/page0.html"]
+        return pages
+
+    def assert_not_held_up(self, fast_site):
+        times = [fast_site.get_request_times("/page{}.html".format(i))[0]
+                 for i in range(10)]
+        self.assertLess(times[-1] - times[0], 0.9,
+                        "A host that was waited on held up another host")
+
+    def test_crawl_delay_does_not_hold_up_other_hosts(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        slow_pages = make_pages(3)
+        slow_pages["/robots.txt"] = ("text/plain",
+                                     b"User-agent: *\nCrawl-delay: 1\n")
+        with FixtureSite(slow_pages) as slow_site, \
+                FixtureSite(self.make_fast_pages(
+                    slow_site.url("/page0.html"))) as fast_site:
+            crawler = Crawler(make_settings(fast_site.url("/page0.html"), 12))
+            crawler.visit_multiple_pages()
+            slow_times = [slow_site.get_request_times(
+                "/page{}.html".format(i))[0] for i in range(2)]
+
+            self.assert_not_held_up(fast_site)
+        self.assertEqual(crawler.pages_visited, 12)
+        self.assertGreaterEqual(slow_times[1] - slow_times[0], 0.99,
+                                "Requests were closer than the Crawl-delay")
+
+    def test_retry_after_does_not_hold_up_other_hosts(self):
+        from crawler_collage import Crawler
+        from fixture_site import FixtureSite
+
+        with FixtureSite(make_pages(1), statuses={
+                "/page0.html": [(429, {"Retry-After": "1"})]}) as busy_site, \
+                FixtureSite(self.make_fast_pages(
+                    busy_site.url("/page0.html"))) as fast_site:
+            crawler = Crawler(make_settings(fast_site.url("/page0.html"), 11))
+            crawler.visit_multiple_pages()
+            busy_times = busy_site.get_request_times("/page0.html")
+
+            self.assert_not_held_up(fast_site)
+        self.assertEqual(crawler.pages_visited, 11,
+                         "The throttled page was not visited")
+        self.assertEqual(len(busy_times), 2,
+                         "The throttled page was not retried")
+        self.assertGreaterEqual(busy_times[1] - busy_times[0], 0.99,
+                                "Retry-After was not waited for")